@@ -0,0 +1,331 @@
+"""
+The interface between redditvfs and wherever its data comes from.
+
+redditvfs only talks to reddit through a Backend.  PrawBackend is the real
+one, going through a client.RedditClient; fakereddit.FakeBackend generates
+synthetic data for benchmarks, snapshot.SnapshotBackend serves an
+exported snapshot offline and dump.DumpBackend indexed reddit dumps.
+
+Things handed out by a backend are model.Submission, model.Comment and
+model.MoreComments objects, never praw's own.
+"""
+import errno
+
+import model
+
+
+def is_comment(thing):
+    """
+    returns whether thing is a comment
+    """
+    return isinstance(thing, model.Comment)
+
+
+def is_more(thing):
+    """
+    returns whether thing is a MoreComments placeholder
+    """
+    return isinstance(thing, model.MoreComments)
+
+
+def from_praw(thing, link_id=None):
+    """
+    returns the model of a praw submission, comment or MoreComments,
+    without its comments or replies.  Only reads what praw already has, so
+    nothing is fetched lazily.  link_id is the thread of a MoreComments.
+    """
+    fields = vars(thing)
+    if 'body' in fields:
+        kind = model.Comment
+    elif 'children' in fields:
+        kind = model.MoreComments
+        fields = dict(fields, link_id=link_id)
+    else:
+        kind = model.Submission
+    return kind(**dict((field, fields.get(field)) for field in kind.__slots__
+                       if field not in ['comments', 'replies']))
+
+
+def thread_from_praw(post):
+    """
+    returns the model of a praw submission and its comment forest
+    """
+    thread = from_praw(post)
+    stack = [(comment, thread.comments)
+             for comment in reversed(post.comments)]
+    while stack:
+        comment, siblings = stack.pop()
+        converted = from_praw(comment, thread.fullname)
+        siblings.append(converted)
+        if is_comment(converted):
+            # what praw parsed of the thread, the replies property would
+            # fetch the comment's permalink if there are none
+            for reply in reversed(vars(comment).get('_replies') or []):
+                stack.append((reply, converted.replies))
+    return thread
+
+
+class Backend(object):
+    """
+    Base class of backends; every method here must be implemented.
+    read_only is whether nothing can ever be changed through it.
+    """
+    read_only = False
+
+    def is_logged_in(self):
+        """
+        returns whether write operations are possible
+        """
+        raise NotImplementedError
+
+    def get_submission(self, post_id):
+        """
+        returns the submission post_id with its comment forest
+        """
+        raise NotImplementedError
+
+    def get_by_id(self, post_ids):
+        """
+        returns the submissions post_ids, without their comments, in as few
+        requests as possible; missing ones are left out
+        """
+        raise NotImplementedError
+
+    def get_my_subreddits(self):
+        """
+        returns the names of the subreddits the user is subscribed to
+        """
+        raise NotImplementedError
+
+    def get_popular_subreddits(self):
+        """
+        returns the names of the subreddits shown when not logged in
+        """
+        raise NotImplementedError
+
+    def get_listing(self, subreddit, sort, period, after, limit):
+        """
+        returns up to limit submissions of a subreddit listing, starting
+        after the thing with fullname after (None for the first page)
+        """
+        raise NotImplementedError
+
+    def get_user_listing(self, username, kind, after, limit):
+        """
+        like get_listing, for a user's overview, submitted or comments
+        """
+        raise NotImplementedError
+
+    def expand_more(self, more):
+        """
+        returns the things behind a MoreComments as reddit's flat list, each
+        naming its parent, parents before children
+        """
+        raise NotImplementedError
+
+    def get_new_comments(self, subreddit, since, limit):
+        """
+        returns the comments of a subreddit posted since the time since,
+        newest first and without their replies; at most limit of them
+        """
+        raise NotImplementedError
+
+    def vote(self, thing, direction):
+        """
+        votes on thing: 1 up, 0 clear, -1 down
+        """
+        raise NotImplementedError
+
+    def reply(self, thing, text):
+        """
+        posts a comment replying to a submission or comment
+        """
+        raise NotImplementedError
+
+    def edit(self, thing, text):
+        """
+        replaces the text of a submission or comment
+        """
+        raise NotImplementedError
+
+    def delete(self, thing):
+        """
+        deletes a submission or comment
+        """
+        raise NotImplementedError
+
+    def submit(self, subreddit, title, text=None, url=None):
+        """
+        posts a self post (text) or a link (url)
+        """
+        raise NotImplementedError
+
+    def subscribe(self, subreddit):
+        """
+        subscribes the logged in user to a subreddit
+        """
+        raise NotImplementedError
+
+    def unsubscribe(self, subreddit):
+        """
+        unsubscribes the logged in user from a subreddit
+        """
+        raise NotImplementedError
+
+
+class ReadOnlyBackend(Backend):
+    """
+    Base class of backends serving data that can't be changed, such as a
+    snapshot.  They are never logged in, and writes raise an IOError with
+    EROFS, which FUSE passes on.
+    """
+    read_only = True
+
+    def is_logged_in(self):
+        return False
+
+    def _read_only(self, *args):
+        raise IOError(errno.EROFS, 'Read-only backend')
+
+    vote = reply = edit = delete = submit = subscribe = unsubscribe = \
+        _read_only
+
+
+class PrawBackend(Backend):
+    """
+    Backend talking to reddit through praw.  client is a RedditClient, so
+    every call is made under its session lock.  What praw returns is turned
+    into model objects; writes and "load more" name things by fullname.
+    """
+    def __init__(self, client):
+        self.client = client
+
+    def is_logged_in(self):
+        return self.client.is_logged_in()
+
+    def login(self, username, password):
+        self.client.login(username=username, password=password)
+
+    def get_submission(self, post_id):
+        return thread_from_praw(
+            self.client.get_submission(submission_id=post_id))
+
+    def get_by_id(self, post_ids):
+        # praw asks /by_id for up to 100 names per request; a tuple, as
+        # the arguments of coalesced calls must be hashable
+        names = tuple('t3_' + post_id for post_id in post_ids)
+        return [from_praw(post)
+                for post in self.client.get_info(thing_id=names) or []
+                if post is not None]
+
+    def get_my_subreddits(self):
+        return [sub.display_name for sub in self.client.get_my_subreddits()]
+
+    def get_popular_subreddits(self):
+        return [sub.display_name for sub in
+                self.client.get_popular_subreddits()]
+
+    def get_listing(self, subreddit, sort, period, after, limit):
+        sub = self.client.get_subreddit(subreddit)
+        if sort == 'top':
+            method = getattr(sub, 'get_top_from_' + period)
+        else:
+            method = getattr(sub, 'get_' + sort)
+        return self._page(method, after, limit)
+
+    def get_user_listing(self, username, kind, after, limit):
+        user = self.client.get_redditor(username)
+        return self._page(getattr(user, 'get_' + kind), after, limit)
+
+    def _page(self, method, after, limit):
+        params = {}
+        if after is not None:
+            params['after'] = after
+        return [from_praw(thing) for thing in
+                self.client.call(method, limit=limit, params=params)]
+
+    def expand_more(self, more):
+        if not more.count:
+            return self._continue_thread(more)
+        response = self._request('morechildren', link_id=more.link_id,
+                                 children=','.join(more.children))
+        return [from_praw(thing, more.link_id)
+                for thing in response['data']['things']]
+
+    def _continue_thread(self, more):
+        """
+        returns the comments below a "continue this thread" MoreComments,
+        which morechildren can't expand, from the thread focused on its
+        parent comment, as expand_more's flat list
+        """
+        post_id = more.link_id.split('_', 1)[-1]
+        parent_id = more.parent_id.split('_', 1)[-1]
+        # not coalesced, params isn't hashable
+        thread = thread_from_praw(self.client.call(
+            self.client.reddit.get_submission, submission_id=post_id,
+            params={'comment': parent_id}))
+        stack = list(thread.comments)
+        while stack:
+            parent = stack.pop()
+            if not is_comment(parent):
+                continue
+            if parent.id == parent_id:
+                break
+            stack.extend(parent.replies)
+        else:
+            return []
+        things = []
+        stack = list(reversed(parent.replies))
+        while stack:
+            thing = stack.pop()
+            things.append(thing)
+            if is_comment(thing):
+                stack.extend(reversed(thing.replies))
+                thing.replies = []
+        return things
+
+    def get_new_comments(self, subreddit, since, limit):
+        return self.client.coalesce(
+            ('get_new_comments', subreddit, since, limit),
+            self._new_comments, subreddit, since, limit)
+
+    def _new_comments(self, subreddit, since, limit):
+        comments = []
+        # praw fetches the listing a page at a time as it is iterated, so
+        # this stops at the first page reaching back to since
+        for comment in self.client.reddit.get_comments(subreddit,
+                                                       limit=limit):
+            if comment.created < since:
+                break
+            # replies posted since are in the listing themselves
+            comments.append(from_praw(comment))
+        return comments
+
+    def _request(self, name, **data):
+        """
+        makes the API request praw's method on a thing would, by fullname,
+        as things aren't praw objects; name is the API path in praw's config
+        """
+        return self.client.request_json(self.client.config[name], data=data)
+
+    def vote(self, thing, direction):
+        self._request('vote', id=thing.fullname, dir=str(direction))
+
+    def reply(self, thing, text):
+        self._request('comment', thing_id=thing.fullname, text=text)
+
+    def edit(self, thing, text):
+        self._request('edit', thing_id=thing.fullname, text=text)
+
+    def delete(self, thing):
+        self._request('del', id=thing.fullname)
+
+    def submit(self, subreddit, title, text=None, url=None):
+        self.client.submit(subreddit=subreddit, title=title, text=text,
+                           url=url)
+
+    def subscribe(self, subreddit):
+        self.client.subscribe(subreddit)
+
+    def unsubscribe(self, subreddit):
+        self.client.unsubscribe(subreddit)
@@ -0,0 +1,264 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+Offline benchmarks for redditvfs.  Drives the real FUSE methods against a
+fakereddit.FakeBackend and reports, per workload, the backend calls made,
+latency percentiles of each FUSE operation and the peak memory used.
+
+Each workload runs in its own forked process, so they all start cold and
+their peak memory is their own.  Run "./bench.py --help" for the options.
+"""
+import json
+import optparse
+import os
+import resource
+import stat
+import sys
+import time
+
+import fakereddit
+import redditvfs
+
+# FUSE operations timed by the harness
+OPERATIONS = ['getattr', 'readdir', 'readlink', 'open', 'read', 'release']
+
+
+class TimedFS(object):
+    """
+    Calls through to a redditvfs instance, recording how long each call
+    took.  readdir is timed until the listing is exhausted.
+    """
+    def __init__(self, fs):
+        self.fs = fs
+        self.times = dict((op, []) for op in OPERATIONS)
+
+    def __getattr__(self, op):
+        method = getattr(self.fs, op)
+
+        def timed(*args):
+            start = time.time()
+            result = method(*args)
+            if op == 'readdir':
+                result = [entry.name for entry in result]
+            self.times[op].append(time.time() - start)
+            return result
+        return timed
+
+
+def is_dir(st):
+    return not isinstance(st, int) and stat.S_ISDIR(st.st_mode)
+
+
+def ls_l(fs, path):
+    """
+    what "ls -l path" does: list it and stat every entry
+    """
+    names = fs.readdir(path, 0)
+    for name in names:
+        if name not in ['.', '..']:
+            fs.getattr(path + '/' + name)
+    return [name for name in names if name not in ['.', '..']]
+
+
+def cat(fs, path, chunk=128 * 1024):
+    """
+    what "cat path" does: stat, open, read to the end and close
+    """
+    fs.getattr(path)
+    fh = fs.open(path, os.O_RDONLY)
+    offset = 0
+    while True:
+        data = fs.read(path, chunk, offset, fh)
+        if not data:
+            break
+        offset += len(data)
+    fs.release(path, os.O_RDONLY, fh)
+    return offset
+
+
+def find(fs, path, depth):
+    """
+    what "find path -maxdepth depth" does
+    """
+    count = 0
+    for name in ls_l(fs, path):
+        count += 1
+        if depth > 1 and is_dir(fs.getattr(path + '/' + name)):
+            count += find(fs, path + '/' + name, depth - 1)
+    return count
+
+
+def first_post(fs, subreddit):
+    """
+    returns the path of the first post listed in subreddit
+    """
+    for name in fs.fs.readdir('/r/' + subreddit, 0):
+        if ' ' in name.name:
+            return '/r/%s/%s' % (subreddit, name.name)
+
+
+def workload_ls(fs, options):
+    """ls -l of a subreddit, then of every post in it"""
+    for name in ls_l(fs, '/r/sub0'):
+        if ' ' in name:
+            ls_l(fs, '/r/sub0/' + name)
+
+
+def workload_cat_flat(fs, options):
+    """cat flat of a single large thread"""
+    cat(fs, first_post(fs, 'sub1') + '/flat')
+
+
+def workload_cat_deep(fs, options):
+    """cat flat of a thread nested deep_depth levels, mostly formatting"""
+    cat(fs, '/r/sub1/' + [name for name in ls_l(fs, '/r/sub1')
+                          if name.endswith(' ' + DEEP_POST)][0] + '/flat')
+
+
+def workload_find(fs, options):
+    """find over the comment tree of one post"""
+    find(fs, first_post(fs, 'sub0'), options.find_depth)
+
+
+WORKLOADS = [('ls', workload_ls), ('cat_flat', workload_cat_flat),
+             ('cat_deep', workload_cat_deep), ('find', workload_find)]
+
+# the post of sub1 read by cat_deep
+DEEP_POST = '1p1'
+
+
+def percentiles(times):
+    """
+    returns the count and the 50th, 90th and 99th percentile and maximum of
+    times, in milliseconds
+    """
+    times = sorted(times)
+    if not times:
+        return {'count': 0}
+    result = {'count': len(times)}
+    for name, fraction in [('p50', 0.5), ('p90', 0.9), ('p99', 0.99)]:
+        index = min(len(times) - 1, int(fraction * len(times)))
+        result[name] = times[index] * 1000
+    result['max'] = times[-1] * 1000
+    return result
+
+
+def run(name, workload, options):
+    """
+    runs one workload against a fresh fake backend and returns its results
+    """
+    fake = fakereddit.FakeBackend(
+        subreddits=2, posts=options.posts, comments=options.comments,
+        depth=options.depth, latency=options.latency, seed=options.seed)
+    # sub1's first post is the big thread read by cat_flat
+    fake.thread_sizes[fake.post_ids('sub1')[0]] = options.thread_size
+    fake.thread_sizes[DEEP_POST] = options.thread_size
+    fake.thread_depths[DEEP_POST] = options.deep_depth
+    redditvfs.reddit = fake
+    redditvfs.prefetcher.workers = options.prefetch_workers
+    fs = TimedFS(redditvfs.redditvfs(reddit=fake))
+    start = time.time()
+    workload(fs, options)
+    wall = time.time() - start
+    # let background work settle so its backend calls are counted
+    while redditvfs.prefetcher.pending():
+        time.sleep(0.01)
+    return {
+        'workload': name,
+        'wall_ms': wall * 1000,
+        'backend_calls': dict(fake.calls),
+        'operations': dict((op, percentiles(times))
+                           for op, times in fs.times.items() if times),
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def run_forked(name, workload, options):
+    """
+    runs a workload in a child process and returns its results
+    """
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_end)
+        try:
+            result = run(name, workload, options)
+        except Exception, e:
+            result = {'workload': name, 'error': repr(e)}
+        os.write(write_end, json.dumps(result))
+        os._exit(0)
+    os.close(write_end)
+    data = ''
+    while True:
+        chunk = os.read(read_end, 65536)
+        if not chunk:
+            break
+        data += chunk
+    os.waitpid(pid, 0)
+    return json.loads(data)
+
+
+def report(result):
+    """
+    prints the results of a workload for humans
+    """
+    print '%s' % result['workload']
+    if 'error' in result:
+        print '  failed: %s' % result['error']
+        return
+    print '  wall time %.1f ms, peak rss %d KiB' % (result['wall_ms'],
+                                                    result['peak_rss_kb'])
+    calls = result['backend_calls']
+    print '  backend calls: %d (%s)' % (
+        sum(calls.values()),
+        ', '.join('%s %d' % item for item in sorted(calls.items())))
+    for op in OPERATIONS:
+        if op in result['operations']:
+            p = result['operations'][op]
+            print ('  %-8s n=%-6d p50 %8.3f  p90 %8.3f  p99 %8.3f  '
+                   'max %8.3f ms' % (op, p['count'], p['p50'], p['p90'],
+                                     p['p99'], p['max']))
+
+
+def main():
+    parser = optparse.OptionParser(
+        usage='%prog [options] [workload ...]',
+        description='workloads: ' + ', '.join(
+            '%s (%s)' % (name, func.__doc__) for name, func in WORKLOADS))
+    parser.add_option('--posts', type='int', default=20,
+                      help='posts per subreddit')
+    parser.add_option('--comments', type='int', default=100,
+                      help='comments per post')
+    parser.add_option('--thread-size', type='int', default=5000,
+                      help='comments in the threads read by cat_*')
+    parser.add_option('--depth', type='int', default=8,
+                      help='maximum comment depth')
+    parser.add_option('--deep-depth', type='int', default=60,
+                      help='comment depth of the thread read by cat_deep')
+    parser.add_option('--find-depth', type='int', default=4,
+                      help='levels walked by find')
+    parser.add_option('--latency', type='float', default=0.0,
+                      help='seconds each backend call takes')
+    parser.add_option('--prefetch-workers', type='int', default=0,
+                      help='prefetch threads, as with the mount option')
+    parser.add_option('--seed', type='int', default=0)
+    parser.add_option('--json', action='store_true', default=False,
+                      help='print results as JSON lines')
+    options, args = parser.parse_args()
+
+    workloads = dict(WORKLOADS)
+    for name in args:
+        if name not in workloads:
+            parser.error('unknown workload ' + name)
+    for name, workload in WORKLOADS:
+        if args and name not in args:
+            continue
+        result = run_forked(name, workload, options)
+        if options.json:
+            print json.dumps(result, sort_keys=True)
+        else:
+            report(result)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,316 @@
+"""
+Process-wide object cache for redditvfs.  Submissions and comment forests are
+kept here, keyed by post id, so every FUSE callback touching the same post
+shares a single fetch instead of going back to reddit.
+
+Rendered file contents are cached separately in a RenderCache, keyed by the
+path and the revision of the object they were formatted from.
+
+Both can be backed by a persist.PersistentStore.  Entries are then written
+through to disk, and a memory miss falls back to the disk copy: fresh ones
+are used as is, stale ones are served while a refresh runs in the
+background.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+# seconds an entry of each kind stays fresh
+DEFAULT_TTLS = {
+    'submission': 60,
+    'index': 60,
+    'page': 60,
+    'flat': 60,
+    # the set of subscribed subreddits
+    'subscriptions': 300,
+    # paths getattr found missing
+    'missing': 5,
+    # revision each content file was last opened at
+    'opened': 3600,
+    # subreddit of a post, which never changes
+    'location': 24 * 3600,
+    # mtime of a post seen in a listing, until its thread is fetched
+    'mtime': 24 * 3600,
+}
+
+# kinds of entries written through to the persistent store
+PERSISTENT_KINDS = ['submission', 'page']
+
+# bookkeeping kinds, whose lookups aren't counted as hits or misses
+UNCOUNTED_KINDS = ['missing', 'opened']
+
+
+_revision_lock = threading.Lock()
+_last_revision = [0.0]
+
+
+def new_revision():
+    """
+    returns a revision greater than any returned before, from any thread.
+    Revisions are timestamps, so they stay unique across restarts of a
+    persistent cache.
+    """
+    with _revision_lock:
+        _last_revision[0] = max(time.time(), _last_revision[0] + 1e-6)
+        return _last_revision[0]
+
+
+# approximate number of objects (submissions + comments) kept in memory
+DEFAULT_MAX_WEIGHT = 50000
+
+
+class ObjectCache(object):
+    """
+    A TTL cache with a weight cap and least-recently-used eviction.  Entries
+    are addressed by (kind, key); each kind has its own time-to-live.
+
+    If a store is set, revalidate(kind, key) is called when a stale entry is
+    served from it, and should return whether it queued a refresh.
+    """
+    def __init__(self, ttls=None, max_weight=DEFAULT_MAX_WEIGHT, store=None,
+                 revalidate=None):
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.max_weight = max_weight
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.store = store
+        self.revalidate = revalidate
+        # (kind, key) -> (value, fetched, weight, revision), oldest first
+        self._entries = OrderedDict()
+        # prefetch threads fill the cache while FUSE reads from it
+        self._lock = threading.RLock()
+
+    def get(self, kind, key):
+        """
+        returns the cached value, or None if it is missing or expired
+        """
+        with self._lock:
+            return self._get(kind, key)
+
+    def _get(self, kind, key):
+        entry = self._entries.pop((kind, key), None)
+        if entry is None:
+            return self._load(kind, key)
+        value, fetched, weight, revision = entry
+        if time.time() - fetched > self.ttls.get(kind, 0):
+            self.weight -= weight
+            self._count(kind, False)
+            return None
+        # re-insert to mark as most recently used
+        self._entries[(kind, key)] = entry
+        self._count(kind, True)
+        return value
+
+    def _load(self, kind, key):
+        """
+        returns an entry missing from memory from the persistent store
+        """
+        row = None
+        if self.store is not None and kind in PERSISTENT_KINDS:
+            row = self.store.get(kind, key)
+        if row is None:
+            self._count(kind, False)
+            return None
+        value, fetched, revision, weight = row
+        if time.time() - fetched > self.ttls.get(kind, 0):
+            if self.revalidate is None or not self.revalidate(kind, key):
+                self._count(kind, False)
+                return None
+            # stale, but serve it for another ttl while it is refreshed
+            fetched = time.time()
+        self._insert(kind, key, (value, fetched, weight, revision))
+        self._count(kind, True)
+        return value
+
+    def _count(self, kind, hit):
+        if kind in UNCOUNTED_KINDS:
+            return
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def put(self, kind, key, value, weight=1):
+        """
+        stores value, evicting least recently used entries past the cap
+        """
+        with self._lock:
+            self._drop(kind, key)
+            entry = (value, time.time(), weight, new_revision())
+            self._insert(kind, key, entry)
+        self._persist(kind, key, entry)
+
+    def _insert(self, kind, key, entry):
+        self._entries[(kind, key)] = entry
+        self.weight += entry[2]
+        while self.weight > self.max_weight and len(self._entries) > 1:
+            _, old_entry = self._entries.popitem(last=False)
+            self.weight -= old_entry[2]
+
+    def _persist(self, kind, key, entry):
+        if self.store is not None and kind in PERSISTENT_KINDS:
+            self.store.put(kind, key, entry[0], entry[1], entry[3],
+                           entry[2])
+
+    def revision(self, kind, key):
+        """
+        returns the revision of the cached value, or None if not cached.  Two
+        calls return the same revision only if the value was not re-fetched
+        or changed in between.
+        """
+        with self._lock:
+            entry = self._entries.get((kind, key))
+        if entry is None:
+            return None
+        return entry[3]
+
+    def peek(self, kind, key):
+        """
+        returns the cached value even if it expired, without counting a hit
+        or a miss; None if not cached
+        """
+        with self._lock:
+            entry = self._entries.get((kind, key))
+        if entry is None:
+            return None
+        return entry[0]
+
+    def fetched(self, kind, key):
+        """
+        returns when the cached value was fetched, or None if not cached
+        """
+        with self._lock:
+            entry = self._entries.get((kind, key))
+        if entry is None:
+            return None
+        return entry[1]
+
+    def bump(self, kind, key, value=None):
+        """
+        gives a cached value that was changed a new revision, without
+        resetting its time-to-live.  If value is given, it replaces the
+        cached one, such as a changed copy of it.
+        """
+        with self._lock:
+            entry = self._entries.get((kind, key))
+            if entry is None:
+                return
+            if value is None:
+                value = entry[0]
+            entry = (value,) + entry[1:3] + (new_revision(),)
+            self._entries[(kind, key)] = entry
+        self._persist(kind, key, entry)
+
+    def touch(self, kind, key):
+        """
+        marks a cached value that was brought up to date in place as fresh,
+        keeping its revision
+        """
+        with self._lock:
+            entry = self._entries.get((kind, key))
+            if entry is None:
+                return
+            entry = (entry[0], time.time()) + entry[2:]
+            self._entries[(kind, key)] = entry
+        self._persist(kind, key, entry)
+
+    def invalidate(self, kind, key):
+        """
+        drops a single entry, if present, from memory and disk
+        """
+        with self._lock:
+            self._drop(kind, key)
+        if self.store is not None and kind in PERSISTENT_KINDS:
+            self.store.delete(kind, key)
+
+    def _drop(self, kind, key):
+        entry = self._entries.pop((kind, key), None)
+        if entry is not None:
+            self.weight -= entry[2]
+
+    def clear(self):
+        """
+        drops everything
+        """
+        with self._lock:
+            self._entries.clear()
+            self.weight = 0
+
+
+# bytes of rendered files kept in memory
+DEFAULT_MAX_RENDER_BYTES = 64 * 1024 * 1024
+
+
+class RenderCache(object):
+    """
+    Holds the encoded output of formatted files, keyed by (path, revision),
+    so that getattr's st_size and every chunked read share one rendering.
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_RENDER_BYTES, store=None):
+        self.max_bytes = max_bytes
+        self.store = store
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # path -> (revision, data), oldest first
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, path, revision):
+        """
+        returns the rendered bytes for path at revision, or None
+        """
+        with self._lock:
+            return self._get(path, revision)
+
+    def _get(self, path, revision):
+        entry = self._entries.pop(path, None)
+        if entry is None and self.store is not None:
+            row = self.store.get('render', path)
+            if row is not None:
+                entry = (row[2], row[0])
+                self.size += len(entry[1])
+        if entry is None or entry[0] != revision:
+            if entry is not None:
+                self.size -= len(entry[1])
+            self.misses += 1
+            return None
+        self._entries[path] = entry
+        self.hits += 1
+        return entry[1]
+
+    def put(self, path, revision, data):
+        """
+        stores data, replacing any older revision of the same path
+        """
+        with self._lock:
+            self.invalidate(path)
+            if len(data) > self.max_bytes:
+                return
+            self._entries[path] = (revision, data)
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, (_, old_data) = self._entries.popitem(last=False)
+                self.size -= len(old_data)
+        if self.store is not None:
+            self.store.put('render', path, data, time.time(), revision)
+
+    def invalidate(self, path):
+        """
+        drops the rendering of path, if present
+        """
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                self.size -= len(entry[1])
+
+    def clear(self):
+        """
+        drops everything
+        """
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
@@ -0,0 +1,121 @@
+"""
+Thread-safe access to the reddit session.  praw isn't safe to call from
+several threads at once, so every request goes through one lock, and
+concurrent callers asking for the same thing share a single in-flight
+request instead of queueing up behind each other to fetch it again.
+
+Requests to reddit are therefore serialized: only one is ever on the wire.
+Serving FUSE from several threads lets cache hits, rendering and downloads
+of link content go on while a request is out, but doesn't make reddit
+answer more requests per second.
+
+Requests are let through by a scheduler.Scheduler, which keeps within the
+API's rate limit and serves interactive requests before background ones.
+"""
+import threading
+import types
+
+import scheduler
+
+# read-only praw methods whose concurrent identical calls are coalesced
+COALESCED = set(['get_submission', 'get_my_subreddits',
+                 'get_popular_subreddits', 'get_redditor', 'get_info',
+                 'is_logged_in'])
+
+# praw methods that don't make a request, and so don't wait for a turn
+LOCAL = set(['get_subreddit', 'is_logged_in'])
+
+
+class Call(object):
+    """
+    A request in flight, which later callers wait on for its result.
+    """
+    def __init__(self, ticket):
+        self.ticket = ticket
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class RedditClient(object):
+    """
+    Wraps a praw.Reddit session.  Its methods are available as attributes,
+    called under the session lock; listings are read to the end under the
+    lock too, since praw fetches their pages lazily.
+    """
+    def __init__(self, reddit, request_scheduler=None):
+        self.reddit = reddit
+        if request_scheduler is None:
+            request_scheduler = scheduler.Scheduler()
+        self.scheduler = request_scheduler
+        self.coalesced = 0
+        self._lock = threading.RLock()
+        self._calls_lock = threading.Lock()
+        # key -> Call for coalesced requests in flight
+        self._calls = {}
+
+    def __getattr__(self, name):
+        attr = getattr(self.reddit, name)
+        if not callable(attr):
+            return attr
+        if name in LOCAL:
+            return lambda *args, **kw: self.call_local(attr, *args, **kw)
+        if name in COALESCED:
+            return lambda *args, **kw: self.coalesce(
+                (name, args, tuple(sorted(kw.items()))), attr, *args, **kw)
+        return lambda *args, **kw: self.call(attr, *args, **kw)
+
+    def call(self, func, *args, **kw):
+        """
+        calls func under the session lock once the scheduler lets it
+        through.  Use this for methods of praw objects, such as upvote() or
+        a subreddit's listings.
+        """
+        return self._call(None, func, *args, **kw)
+
+    def _call(self, ticket, func, *args, **kw):
+        with self.scheduler.request(ticket):
+            return self.call_local(func, *args, **kw)
+
+    def call_local(self, func, *args, **kw):
+        """
+        calls func under the session lock without waiting for a turn, for
+        methods that make no request
+        """
+        with self._lock:
+            result = func(*args, **kw)
+            if isinstance(result, types.GeneratorType):
+                result = list(result)
+            return result
+
+    def coalesce(self, key, func, *args, **kw):
+        """
+        calls func like call(), unless a call with the same key is already
+        in flight, in which case its result is shared
+        """
+        with self._calls_lock:
+            pending = self._calls.get(key)
+            if pending is None:
+                pending = self._calls[key] = Call(self.scheduler.ticket())
+                owner = True
+            else:
+                self.coalesced += 1
+                owner = False
+        if not owner:
+            # the request waited on is now as urgent as its most urgent
+            # caller
+            self.scheduler.boost(pending.ticket)
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.result
+        try:
+            pending.result = self._call(pending.ticket, func, *args, **kw)
+        except Exception, e:
+            pending.error = e
+            raise
+        finally:
+            with self._calls_lock:
+                del self._calls[key]
+            pending.done.set()
+        return pending.result
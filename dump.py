@@ -0,0 +1,421 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+Read-only mounts of reddit dumps, such as Pushshift's: files holding one
+submission or comment per line, as JSON.
+
+"./dump.py INDEX DUMP..." reads the dumps once, front to back, and writes to
+the directory INDEX where every submission and comment is and how they
+relate.  "./redditvfs.py --dump INDEX MOUNTPOINT" then serves them through a
+DumpBackend.  The dumps and the index are memory-mapped rather than read, so
+a large dump mounts as fast as a small one, and only the lines of the
+threads being looked at are ever parsed.
+
+Besides index.json, which lists the dumps and where each subreddit's posts
+are in listings.bin, the index is arrays of little-endian records:
+
+    posts.bin     every submission (POST), sorted by id
+    comments.bin  every comment (COMMENT), grouped by submission in dump
+                  order, so a thread's comments are one range
+    listings.bin  positions in posts.bin, one section per order in ORDERS,
+                  grouped by subreddit within a section
+"""
+import errno
+import json
+import math
+import mmap
+import optparse
+import os
+import struct
+import sys
+from array import array
+
+import backend
+import model
+import snapshot
+
+# id, file, offset, length, created, score, first comment, comment count,
+# subreddit number
+POST = struct.Struct('<QIQIqqQII')
+# id, parent comment id (0 for top-level comments), file, offset, length
+COMMENT = struct.Struct('<QQIQI')
+# a position in posts.bin
+POSITION = struct.Struct('<I')
+ID = struct.Struct('<Q')
+
+# orders of listings.bin; other sorts are served in the first
+ORDERS = ['hot', 'new', 'top']
+
+# bumped when the index layout changes
+FORMAT = 1
+
+INDEX = 'index.json'
+POSTS = 'posts.bin'
+COMMENTS = 'comments.bin'
+LISTINGS = 'listings.bin'
+
+
+def base36(thing_id):
+    """
+    returns the number of an id or fullname
+    """
+    return int(thing_id.split('_')[-1], 36)
+
+
+def get_created(data):
+    """
+    returns the creation time of a dumped thing; older dumps have it as a
+    string
+    """
+    return int(float(data.get('created_utc') or data.get('created') or 0))
+
+
+def hotness(score, created):
+    """
+    returns the rank of a post in reddit's hot listing
+    """
+    sign = (score > 0) - (score < 0)
+    return (sign * math.log10(max(abs(score), 1)) +
+            (created - 1134028003) / 45000.0)
+
+
+def read_lines(path):
+    """
+    yields the offset and content of every line of a file
+    """
+    offset = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            yield offset, line
+            offset += len(line)
+
+
+def map_file(path):
+    """
+    returns the contents of a file, memory-mapped
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # empty files can't be mapped
+            return ''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def build_index(paths, root, log=None):
+    """
+    writes the index of the dumps at paths to the directory root, in one
+    pass over them.  Only fixed-size fields are kept while reading, in
+    arrays, so memory grows with the number of things rather than their
+    size.
+    """
+    # submission numbers, in order of first sight, by id.  Ids and offsets
+    # need 64 bits, which 'l' and 'L' are where FUSE runs.
+    numbers = {}
+    post_ids = array('L')
+    post_files = array('I')
+    post_offsets = array('l')
+    post_lengths = array('I')
+    post_created = array('l')
+    post_scores = array('l')
+    post_subreddits = array('I')
+    comment_ids = array('L')
+    comment_parents = array('L')
+    comment_posts = array('I')
+    comment_files = array('I')
+    comment_offsets = array('L')
+    comment_lengths = array('I')
+    # subreddit numbers by lowercase name, and their names
+    subreddits = {}
+    names = []
+
+    def number_of(post_id):
+        number = numbers.get(post_id)
+        if number is None:
+            # comments can come before their submission
+            number = numbers[post_id] = len(post_ids)
+            post_ids.append(post_id)
+            post_files.append(0)
+            post_offsets.append(-1)
+            post_lengths.append(0)
+            post_created.append(0)
+            post_scores.append(0)
+            post_subreddits.append(0)
+        return number
+
+    for file_number, path in enumerate(paths):
+        skipped = 0
+        for offset, line in read_lines(path):
+            try:
+                data = json.loads(line)
+                if 'link_id' in data:
+                    thing_id = base36(data['id'])
+                    parent = data.get('parent_id') or ''
+                    parent = base36(parent) if parent[:3] == 't1_' else 0
+                    number = number_of(base36(data['link_id']))
+                    comment_ids.append(thing_id)
+                    comment_parents.append(parent)
+                    comment_posts.append(number)
+                    comment_files.append(file_number)
+                    comment_offsets.append(offset)
+                    comment_lengths.append(len(line))
+                elif 'title' in data and data.get('subreddit'):
+                    number = number_of(base36(data['id']))
+                    name = data['subreddit']
+                    if name.lower() not in subreddits:
+                        subreddits[name.lower()] = len(names)
+                        names.append(name)
+                    post_files[number] = file_number
+                    post_offsets[number] = offset
+                    post_lengths[number] = len(line)
+                    post_created[number] = get_created(data)
+                    post_scores[number] = int(data.get('score') or 0)
+                    post_subreddits[number] = subreddits[name.lower()]
+                else:
+                    skipped += 1
+            except (ValueError, KeyError, TypeError, AttributeError):
+                skipped += 1
+        if log is not None:
+            log('%s: %d submissions and %d comments so far, %d lines '
+                'skipped' % (path, len(numbers), len(comment_ids), skipped))
+
+    # submissions only seen as the link of a comment are left out
+    kept = [number for number in xrange(len(post_ids))
+            if post_offsets[number] >= 0]
+    kept.sort(key=post_ids.__getitem__)
+    positions = array('i', [-1]) * len(post_ids)
+    for position, number in enumerate(kept):
+        positions[number] = position
+
+    # comments are placed by counting sort, grouped by position
+    counts = array('I', [0]) * len(kept)
+    for number in comment_posts:
+        if positions[number] >= 0:
+            counts[positions[number]] += 1
+    starts = array('L', [0]) * len(kept)
+    total = 0
+    for position, count in enumerate(counts):
+        starts[position] = total
+        total += count
+
+    if not os.path.isdir(root):
+        os.makedirs(root)
+    with open(os.path.join(root, POSTS), 'wb') as f:
+        for position, number in enumerate(kept):
+            f.write(POST.pack(post_ids[number], post_files[number],
+                              post_offsets[number], post_lengths[number],
+                              post_created[number], post_scores[number],
+                              starts[position], counts[position],
+                              post_subreddits[number]))
+    with open(os.path.join(root, COMMENTS), 'w+b') as f:
+        f.truncate(total * COMMENT.size)
+        if total:
+            out = mmap.mmap(f.fileno(), 0)
+            for n in xrange(len(comment_ids)):
+                position = positions[comment_posts[n]]
+                if position < 0:
+                    continue
+                COMMENT.pack_into(out, starts[position] * COMMENT.size,
+                                  comment_ids[n], comment_parents[n],
+                                  comment_files[n], comment_offsets[n],
+                                  comment_lengths[n])
+                starts[position] += 1
+            out.close()
+
+    by_subreddit = [[] for _ in names]
+    for position, number in enumerate(kept):
+        by_subreddit[post_subreddits[number]].append(position)
+    keys = {'hot': lambda position: -hotness(post_scores[kept[position]],
+                                             post_created[kept[position]]),
+            'new': lambda position: -post_created[kept[position]],
+            'top': lambda position: -post_scores[kept[position]]}
+    with open(os.path.join(root, LISTINGS), 'wb') as f:
+        for order in ORDERS:
+            for listed in by_subreddit:
+                listed.sort(key=keys[order])
+                f.write(struct.pack('<%dI' % len(listed), *listed))
+    listings = {}
+    start = 0
+    for name, listed in zip(names, by_subreddit):
+        listings[name.lower()] = {'name': name, 'start': start,
+                                  'count': len(listed)}
+        start += len(listed)
+
+    # written last, so that an interrupted build doesn't mount
+    with open(os.path.join(root, INDEX), 'wb') as f:
+        json.dump({'format': FORMAT,
+                   'files': [os.path.abspath(path) for path in paths],
+                   'posts': len(kept), 'comments': total,
+                   'subreddits': listings}, f)
+
+
+def make_thing(kind, data, fields):
+    """
+    returns a kind, model.Submission or model.Comment, with the given
+    fields of a dumped line, filling in what dumps leave out
+    """
+    thing = kind(**dict((field, data.get(field)) for field in fields))
+    thing.created = get_created(data)
+    for field in ['title', 'selftext', 'url', 'thumbnail', 'body']:
+        if field in fields and getattr(thing, field) is None:
+            setattr(thing, field, u'')
+    if thing.score is None:
+        thing.score = 0
+    if thing.ups is None:
+        thing.ups = thing.score
+    if thing.downs is None:
+        thing.downs = 0
+    return thing
+
+
+class DumpBackend(backend.ReadOnlyBackend):
+    """
+    Serves dumps indexed by build_index().  Posts are found by binary search
+    in posts.bin and threads read from the ranges comments.bin gives, so
+    nothing but index.json is loaded up front.
+    """
+    def __init__(self, root):
+        with open(os.path.join(root, INDEX), 'rb') as f:
+            index = json.load(f)
+        if index.get('format') != FORMAT:
+            raise ValueError('%s was built by another version of dump.py, '
+                             'rebuild it' % root)
+        self.subreddits = index['subreddits']
+        self.post_count = index['posts']
+        self._dumps = [map_file(path) for path in index['files']]
+        self._posts = map_file(os.path.join(root, POSTS))
+        self._comments = map_file(os.path.join(root, COMMENTS))
+        self._listings = map_file(os.path.join(root, LISTINGS))
+
+    def _find(self, post_id):
+        """
+        returns the position of a submission in posts.bin, or None
+        """
+        try:
+            wanted = base36(post_id)
+        except ValueError:
+            return None
+        low, high = 0, self.post_count
+        while low < high:
+            middle = (low + high) // 2
+            if ID.unpack_from(self._posts, middle * POST.size)[0] < wanted:
+                low = middle + 1
+            else:
+                high = middle
+        if (low < self.post_count and
+                ID.unpack_from(self._posts, low * POST.size)[0] == wanted):
+            return low
+        return None
+
+    def _line(self, file_number, offset, length):
+        return json.loads(self._dumps[file_number][offset:offset + length])
+
+    def _submission(self, position):
+        record = POST.unpack_from(self._posts, position * POST.size)
+        post = make_thing(model.Submission, self._line(*record[1:4]),
+                          snapshot.SUBMISSION_FIELDS)
+        return post, record
+
+    def get_submission(self, post_id):
+        position = self._find(post_id)
+        if position is None:
+            raise IOError(errno.ENOENT, 'No such submission', post_id)
+        post, record = self._submission(position)
+        first, count = record[6:8]
+        comments = {}
+        parents = []
+        for n in xrange(first, first + count):
+            thing_id, parent, file_number, offset, length = \
+                COMMENT.unpack_from(self._comments, n * COMMENT.size)
+            if thing_id in comments:
+                # the same comment in overlapping dumps
+                continue
+            comment = make_thing(model.Comment,
+                                 self._line(file_number, offset, length),
+                                 snapshot.COMMENT_FIELDS)
+            comments[thing_id] = comment
+            parents.append((comment, parent))
+        # parents don't always come first in a dump
+        for comment, parent in parents:
+            if parent in comments:
+                comments[parent].replies.append(comment)
+            else:
+                post.comments.append(comment)
+        return post
+
+    def get_by_id(self, post_ids):
+        posts = []
+        for post_id in post_ids:
+            position = self._find(post_id)
+            if position is not None:
+                posts.append(self._submission(position)[0])
+        return posts
+
+    def get_my_subreddits(self):
+        return [entry['name'] for entry in self.subreddits.values()]
+
+    def get_popular_subreddits(self):
+        return self.get_my_subreddits()
+
+    def get_listing(self, subreddit, sort, period, after, limit):
+        entry = self.subreddits.get(subreddit.lower())
+        if entry is None:
+            return []
+        order = ORDERS.index(sort) if sort in ORDERS else 0
+        start = order * self.post_count + entry['start']
+        end = start + entry['count']
+        if after is not None:
+            position = self._find(after)
+            if position is not None:
+                found = self._index(POSITION.pack(position), start, end)
+                if found is not None:
+                    start = found + 1
+        end = min(end, start + limit)
+        return [self._submission(POSITION.unpack_from(
+                    self._listings, n * POSITION.size)[0])[0]
+                for n in xrange(start, end)]
+
+    def _index(self, packed, start, end):
+        """
+        returns the index of a position between start and end in
+        listings.bin, or None
+        """
+        offset = start * POSITION.size
+        while True:
+            offset = self._listings.find(packed, offset,
+                                         end * POSITION.size)
+            if offset < 0:
+                return None
+            if offset % POSITION.size == 0:
+                return offset // POSITION.size
+            offset += 1
+
+    def get_user_listing(self, username, kind, after, limit):
+        # the index has no table of authors
+        return []
+
+    def get_new_comments(self, subreddit, since, limit):
+        # nothing is posted to a dump
+        return []
+
+    def expand_more(self, more):
+        # dumps have every comment
+        return []
+
+
+def main():
+    parser = optparse.OptionParser(
+        usage='%prog [options] INDEX DUMP...',
+        description='indexes dumps of one JSON submission or comment per '
+                    'line, uncompressed, into the directory INDEX, which '
+                    '"redditvfs.py --dump INDEX" mounts')
+    options, args = parser.parse_args()
+    if len(args) < 2:
+        parser.error('an index directory and at least one dump are needed')
+
+    def log(message):
+        sys.stderr.write(message + '\n')
+    build_index(args[1:], args[0], log=log)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,267 @@
+"""
+A deterministic, in-process stand-in for reddit, used by the benchmarks.
+
+FakeBackend generates subreddits, submissions and comment trees of a
+configurable size and depth from a seed, so the same run always sees the
+same data.  Every call sleeps for an injectable latency and is counted by
+endpoint.  post_comments() makes a thread grow, as a live one does.
+"""
+import collections
+import random
+import threading
+import time
+
+import backend
+import model
+
+WORDS = ('the of and to in is you that it he was for on are as with his they '
+         'at be this have from or one had by word but not what all were we '
+         'when your can said there use an each which she do how their if '
+         'will up other about out many then them these so some her would '
+         'make like him into time has look two more write go see number no '
+         'way could people my than first water been call who oil its now '
+         'find long down day did get come made may part').split()
+
+
+class FakeBackend(backend.Backend):
+    """
+    Synthetic reddit.  Each subreddit has posts submissions, each with
+    comments comments nested up to depth levels; top-level comments past
+    top_level go behind a MoreComments, as on reddit.  thread_sizes and
+    thread_depths map post ids to a comment count and a depth overriding
+    comments and depth.
+    """
+    def __init__(self, subreddits=3, posts=100, comments=50, depth=6,
+                 top_level=200, latency=0.0, seed=0, thread_sizes=None,
+                 logged_in=True, thread_depths=None):
+        self.subreddits = ['sub%d' % n for n in range(subreddits)]
+        self.posts = posts
+        self.comments = comments
+        self.depth = depth
+        self.top_level = top_level
+        self.latency = latency
+        self.seed = seed
+        self.thread_sizes = thread_sizes or {}
+        self.thread_depths = thread_depths or {}
+        self.logged_in = logged_in
+        self.calls = collections.Counter()
+        self._lock = threading.Lock()
+        # post id -> comment forest hidden behind its MoreComments
+        self._hidden = {}
+        # post id -> comments added by post_comments(), oldest first
+        self._posted = collections.defaultdict(list)
+
+    def _call(self, endpoint):
+        with self._lock:
+            self.calls[endpoint] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _rng(self, *key):
+        return random.Random('%d/%s' % (self.seed, '/'.join(key)))
+
+    def _text(self, rng, low, high):
+        return ' '.join(rng.choice(WORDS)
+                        for _ in range(rng.randint(low, high)))
+
+    def post_ids(self, subreddit):
+        """
+        returns the ids of the posts of a subreddit, in hot order
+        """
+        number = self.subreddits.index(subreddit.lower())
+        return ['%dp%d' % (number, n) for n in range(self.posts)]
+
+    def _submission(self, post_id):
+        rng = self._rng(post_id)
+        number = int(post_id.split('p')[0])
+        ups = rng.randint(0, 5000)
+        downs = rng.randint(0, ups // 2 + 1)
+        return model.Submission(
+            id=post_id, title=self._text(rng, 3, 15).capitalize(),
+            selftext=self._text(rng, 0, 200),
+            url='http://www.reddit.com/r/%s/comments/%s/'
+                % (self.subreddits[number], post_id),
+            thumbnail='self', author='user%d' % rng.randint(0, 99),
+            subreddit=self.subreddits[number],
+            created=1400000000 + rng.randint(0, 10 ** 7), edited=False,
+            score=ups - downs, ups=ups, downs=downs,
+            num_comments=self.thread_sizes.get(post_id, self.comments))
+
+    def _forest(self, post_id, count):
+        """
+        returns (visible top-level list, hidden top-level list)
+        """
+        rng = self._rng(post_id, 'comments')
+        depth = self.thread_depths.get(post_id, self.depth)
+        top = []
+        open_nodes = []
+        depths = {}
+        for n in range(count):
+            ups = rng.randint(0, 500)
+            downs = rng.randint(0, ups // 2 + 1)
+            comment = model.Comment(
+                id='%sc%d' % (post_id, n), link_id='t3_' + post_id,
+                body=self._text(rng, 1, 120),
+                author='user%d' % rng.randint(0, 99),
+                created=1400000000 + rng.randint(0, 10 ** 7), edited=False,
+                score=ups - downs, ups=ups, downs=downs)
+            if not open_nodes or rng.random() < 0.3:
+                comment.parent_id = 't3_' + post_id
+                depths[comment.id] = 0
+                top.append(comment)
+            else:
+                # replies cluster under recent comments, like real threads
+                parent = rng.choice(open_nodes[-50:])
+                comment.parent_id = parent.fullname
+                depths[comment.id] = depths[parent.id] + 1
+                parent.replies.append(comment)
+            if depths[comment.id] < depth - 1:
+                open_nodes.append(comment)
+        return top[:self.top_level], top[self.top_level:]
+
+    def post_comments(self, post_id, count):
+        """
+        adds count comments to a thread, replying to its visible comments
+        or to each other; they are newer than every generated comment
+        """
+        visible, _ = self._forest(
+            post_id, self.thread_sizes.get(post_id, self.comments))
+        parents = ['t3_' + post_id]
+        stack = list(visible)
+        while stack:
+            comment = stack.pop()
+            if backend.is_comment(comment):
+                parents.append(comment.fullname)
+                stack.extend(comment.replies)
+        with self._lock:
+            posted = self._posted[post_id]
+            parents.extend(comment.fullname for comment in posted)
+            rng = self._rng(post_id, 'posted', str(len(posted)))
+            for _ in range(count):
+                n = len(posted)
+                comment = model.Comment(
+                    id='%sn%d' % (post_id, n), link_id='t3_' + post_id,
+                    parent_id=rng.choice(parents),
+                    body=self._text(rng, 1, 120),
+                    author='user%d' % rng.randint(0, 99),
+                    created=1410000001 + n, edited=False, score=1, ups=1,
+                    downs=0)
+                posted.append(comment)
+                parents.append(comment.fullname)
+
+    def is_logged_in(self):
+        self._call('is_logged_in')
+        return self.logged_in
+
+    def get_submission(self, post_id):
+        self._call('get_submission')
+        post = self._submission(post_id)
+        visible, hidden = self._forest(
+            post_id, self.thread_sizes.get(post_id, self.comments))
+        if hidden:
+            visible.append(model.MoreComments(
+                id='more' + post_id, parent_id='t3_' + post_id,
+                link_id='t3_' + post_id,
+                children=[comment.id for comment in hidden],
+                count=len(hidden)))
+        post.comments = visible
+        with self._lock:
+            self._hidden[post_id] = hidden
+            posted = list(self._posted.get(post_id, []))
+        comments = {}
+        stack = list(visible) if posted else []
+        while stack:
+            comment = stack.pop()
+            if backend.is_comment(comment):
+                comments[comment.fullname] = comment
+                stack.extend(comment.replies)
+        for comment in posted:
+            copy = comment.copy(replies=[])
+            comments[copy.fullname] = copy
+            if copy.parent_id in comments:
+                comments[copy.parent_id].replies.append(copy)
+            else:
+                post.comments.append(copy)
+        return post
+
+    def get_by_id(self, post_ids):
+        self._call('get_by_id')
+        return [self._submission(post_id) for post_id in post_ids]
+
+    def get_my_subreddits(self):
+        self._call('get_my_subreddits')
+        return list(self.subreddits)
+
+    def get_popular_subreddits(self):
+        self._call('get_popular_subreddits')
+        return list(self.subreddits)
+
+    def get_listing(self, subreddit, sort, period, after, limit):
+        self._call('get_listing')
+        ids = self.post_ids(subreddit)
+        if sort != 'hot':
+            self._rng(subreddit, sort, period or '').shuffle(ids)
+        return self._page([self._submission(post_id) for post_id in ids],
+                          after, limit)
+
+    def get_user_listing(self, username, kind, after, limit):
+        self._call('get_user_listing')
+        things = []
+        for subreddit in self.subreddits:
+            for post_id in self.post_ids(subreddit):
+                post = self._submission(post_id)
+                if post.author == username and kind != 'comments':
+                    things.append(post)
+        return self._page(things, after, limit)
+
+    def _page(self, things, after, limit):
+        start = 0
+        for n, thing in enumerate(things):
+            if thing.fullname == after:
+                start = n + 1
+        return things[start:start + limit]
+
+    def expand_more(self, more):
+        self._call('expand_more')
+        post_id = more.parent_id.split('_', 1)[-1]
+        with self._lock:
+            hidden = self._hidden.get(post_id, [])
+        things = []
+        stack = list(reversed(hidden))
+        while stack:
+            comment = stack.pop()
+            # reddit sends a flat list, each thing without its replies
+            copy = comment.copy(replies=[])
+            things.append(copy)
+            stack.extend(reversed(comment.replies))
+        return things
+
+    def get_new_comments(self, subreddit, since, limit):
+        self._call('get_new_comments')
+        with self._lock:
+            comments = [comment for post_id in self.post_ids(subreddit)
+                        for comment in self._posted.get(post_id, [])
+                        if comment.created >= since]
+        comments.sort(key=lambda comment: -comment.created)
+        return [comment.copy(replies=[]) for comment in comments[:limit]]
+
+    def vote(self, thing, direction):
+        self._call('vote')
+
+    def reply(self, thing, text):
+        self._call('reply')
+
+    def edit(self, thing, text):
+        self._call('edit')
+
+    def delete(self, thing):
+        self._call('delete')
+
+    def submit(self, subreddit, title, text=None, url=None):
+        self._call('submit')
+
+    def subscribe(self, subreddit):
+        self._call('subscribe')
+
+    def unsubscribe(self, subreddit):
+        self._call('unsubscribe')
@@ -0,0 +1,244 @@
+"""
+Comment id index for a submission's comment forest.  Resolving a comment
+path used to mean walking post.comments and every level of replies; the
+index maps each comment id straight to its node instead.
+
+The index also tracks the MoreComments placeholders of the forest.  Each is
+keyed by the id of its parent (reddit puts at most one per list of
+replies), and expanding one splices the fetched comments into the forest in
+place of the placeholder.
+
+Comments posted after the forest was fetched can be spliced in by
+add_new(), which stamps the submission and every comment above them, so
+that only what shows their subtree has to be formatted again.
+"""
+import threading
+import time
+
+import backend
+
+
+class CommentIndex(object):
+    """
+    Maps comment id -> (comment, parent id, depth) for one submission.  Top
+    level comments have the submission id as parent and a depth of 0.
+    """
+    def __init__(self, post_id, comments=None):
+        self.post_id = post_id
+        if comments is None:
+            comments = []
+        # the top-level list, replies are spliced into it in place
+        self.comments = comments
+        self._nodes = {}
+        # parent id -> (MoreComments, depth) not expanded yet
+        self._more = {}
+        # parent id -> ids of the comments loaded through its MoreComments
+        self._expanded = {}
+        # submission or comment id -> times comments were added below it
+        self._stamps = {}
+        # when the forest was fetched, and its newest comment
+        self.built = time.time()
+        self.newest = 0
+        self._lock = threading.Lock()
+        self.add_forest(comments, post_id, 0)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __contains__(self, comment_id):
+        return comment_id in self._nodes
+
+    def __iter__(self):
+        # the indexed comments, in no particular order
+        return iter([node[0] for node in self._nodes.values()])
+
+    def add_forest(self, comments, parent_id, depth):
+        """
+        indexes comments and all of their replies below parent_id
+        """
+        stack = [(comment, parent_id, depth) for comment in comments]
+        while stack:
+            comment, parent_id, depth = stack.pop()
+            if backend.is_more(comment):
+                self._more[parent_id] = (comment, depth)
+                continue
+            if not backend.is_comment(comment):
+                continue
+            self._nodes[comment.id] = (comment, parent_id, depth)
+            self.newest = max(self.newest, comment.created)
+            for reply in comment.replies:
+                stack.append((reply, comment.id, depth + 1))
+
+    def get(self, comment_id):
+        """
+        returns the (comment, parent id, depth) tuple for comment_id, or None
+        """
+        return self._nodes.get(comment_id)
+
+    def resolve(self, comment_ids):
+        """
+        returns the comment at the end of a path of comment ids, or None if
+        it isn't indexed or doesn't sit at that place in the tree
+        """
+        if not comment_ids:
+            return None
+        node = self._nodes.get(comment_ids[-1])
+        if node is None or node[2] != len(comment_ids) - 1:
+            return None
+        if len(comment_ids) > 1 and node[1] != comment_ids[-2]:
+            return None
+        return node[0]
+
+    def has_more(self, parent_id):
+        """
+        returns whether parent_id has, or had, a MoreComments below it
+        """
+        return parent_id in self._more or parent_id in self._expanded
+
+    def pending_more(self):
+        """
+        returns the parent ids of unexpanded MoreComments, shallowest first
+        """
+        with self._lock:
+            return sorted(self._more, key=lambda key: self._more[key][1])
+
+    def expanded(self, parent_id):
+        """
+        returns the comments loaded so far through parent_id's MoreComments
+        """
+        ids = self._expanded.get(parent_id, [])
+        return [self._nodes[comment_id][0] for comment_id in ids
+                if comment_id in self._nodes]
+
+    def take_more(self, parent_id):
+        """
+        removes and returns the unexpanded MoreComments below parent_id, so
+        that only one caller fetches it; None if there is none
+        """
+        with self._lock:
+            entry = self._more.pop(parent_id, None)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def put_back_more(self, parent_id, more):
+        """
+        returns a MoreComments whose expansion failed to the pending set
+        """
+        with self._lock:
+            depth = 0
+            if parent_id in self._nodes:
+                depth = self._nodes[parent_id][2] + 1
+            self._more.setdefault(parent_id, (more, depth))
+
+    def merge(self, parent_id, more, comments):
+        """
+        splices the comments fetched for the MoreComments below parent_id
+        into the forest.  comments is reddit's flat morechildren list: each
+        thing names its parent, and parents come before their children.
+        """
+        with self._lock:
+            container = self._replies(parent_id)
+            if container is not None and more in container:
+                container.remove(more)
+            loaded = self._expanded.setdefault(parent_id, [])
+            for comment in comments:
+                thing_parent = comment.parent_id.split('_', 1)[-1]
+                if thing_parent == self.post_id:
+                    depth = 0
+                elif thing_parent in self._nodes:
+                    depth = self._nodes[thing_parent][2] + 1
+                else:
+                    # orphaned, its parent isn't in the forest
+                    continue
+                if backend.is_more(comment):
+                    self._more[thing_parent] = (comment, depth)
+                elif comment.id in self._nodes:
+                    continue
+                else:
+                    self._nodes[comment.id] = (comment, thing_parent, depth)
+                    self.add_forest(comment.replies, comment.id, depth + 1)
+                    if thing_parent == parent_id:
+                        loaded.append(comment.id)
+                container = self._replies(thing_parent)
+                if container is not None:
+                    container.append(comment)
+
+    def add(self, parent_id, comment):
+        """
+        adds a comment at the end of the replies of parent_id, such as one
+        that is still being posted; returns whether parent_id was found
+        """
+        with self._lock:
+            return self._attach(parent_id, comment)
+
+    def replace(self, comment):
+        """
+        puts comment in the place of the indexed comment with its id, such
+        as a changed copy of it; returns whether that one was found
+        """
+        with self._lock:
+            node = self._nodes.get(comment.id)
+            if node is None:
+                return False
+            container = self._replies(node[1])
+            for i, reply in enumerate(container):
+                if reply is node[0]:
+                    container[i] = comment
+                    break
+            self._nodes[comment.id] = (comment,) + node[1:]
+            return True
+
+    def add_new(self, comments):
+        """
+        splices comments posted since the forest was fetched, parents
+        first, below their parents and returns how many were added.
+        Comments already there, or whose parent isn't, are skipped.
+        """
+        added = 0
+        with self._lock:
+            stamped = set()
+            for comment in comments:
+                parent_id = comment.parent_id.split('_', 1)[-1]
+                if comment.id in self._nodes or \
+                        not self._attach(parent_id, comment):
+                    continue
+                added += 1
+                self.newest = max(self.newest, comment.created)
+                while parent_id not in stamped:
+                    stamped.add(parent_id)
+                    self._stamps[parent_id] = \
+                        self._stamps.get(parent_id, 0) + 1
+                    if parent_id == self.post_id:
+                        break
+                    parent_id = self._nodes[parent_id][1]
+        return added
+
+    def stamp(self, thing_id):
+        """
+        returns how many times comments were added below the submission or
+        comment thing_id
+        """
+        return self._stamps.get(thing_id, 0)
+
+    def _attach(self, parent_id, comment):
+        container = self._replies(parent_id)
+        if container is None:
+            return False
+        depth = 0
+        if parent_id != self.post_id:
+            depth = self._nodes[parent_id][2] + 1
+        self._nodes[comment.id] = (comment, parent_id, depth)
+        container.append(comment)
+        return True
+
+    def _replies(self, parent_id):
+        """
+        returns the list holding the replies of parent_id
+        """
+        if parent_id == self.post_id:
+            return self.comments
+        node = self._nodes.get(parent_id)
+        if node is None:
+            return None
+        return node[0].replies
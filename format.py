@@ -1,28 +1,28 @@
-import praw
 import textwrap
+import backend
+import bisect
 import time
-import codecs
 
 
 def format_sub_content(submission):
     """return formatted submission without comments as a String"""
     text = []
     indent = 3
-    wrap = textwrap.TextWrapper(initial_indent=indent*' '+'|', subsequent_indent=indent*' '+'|')
-    br = indent * ' ' + '-' * (79-indent) + '\n'
+    wrap = get_wrapper(indent)
+    br = get_rule(indent, 79) + '\n'
     text.append(br)
-    text += wrap.wrap(submission.title)
+    text += wrap_text(wrap, submission.title)
     text.append(br)
     if submission.selftext:
-        text += wrap.wrap('\n' + submission.selftext + '\n')
+        text += wrap_text(wrap, '\n' + submission.selftext + '\n')
         text.append(br)
     if submission.url:
-        text += wrap.wrap('\n' + submission.url + '\n')
+        text += wrap_text(wrap, '\n' + submission.url + '\n')
         text.append(br)
     d = get_info_dict(submission)
     formatted = "%(author)s %(time)s ago\n"\
     +"%(score)d points (%(ups)d|%(downs)d) id:%(id)s"
-    text += wrap.wrap(formatted % d)
+    text += wrap_text(wrap, formatted % d)
     text.append(br)
     return '\n'.join(text)+'\n'
 
@@ -32,11 +32,82 @@ def format_submission(submission):
              [format_comment(c) for c in submission.comments]
     return '\n'.join(text)+'\n'
 
+def iter_submission_pieces(submission):
+    """yield the pieces of format_submission as (prefix, thing, depth)"""
+    yield ('', submission, None)
+    for c in submission.comments:
+        for piece in iter_comment_pieces(c, prefix='\n'):
+            yield piece
+    yield ('\n', None, None)
+
+def iter_comment_pieces(comment, depth=0, prefix=''):
+    """yield the pieces of format_comment as (prefix, thing, depth)"""
+    stack = [(comment, depth, prefix)]
+    while stack:
+        comment, depth, prefix = stack.pop()
+        yield (prefix, comment, depth)
+        if not backend.is_more(comment):
+            for child in reversed(comment.replies):
+                stack.append((child, depth+1, ''))
+
+def format_piece(piece):
+    """return one piece of a flat file as an encoded String"""
+    prefix, thing, depth = piece
+    if thing is None:
+        text = prefix
+    elif depth is None:
+        text = prefix + format_sub_content(thing)
+    else:
+        text = prefix + format_comment(thing, depth, recursive=False)
+    return text.encode('ascii', 'ignore')
+
+class FlatFile(object):
+    """
+    encoded flat file rendered piece by piece: only the byte offset of each
+    piece is kept, and slicing renders just the pieces it covers
+    """
+    def __init__(self, pieces):
+        self.pieces = []
+        self.offsets = []
+        size = 0
+        for piece in pieces:
+            self.pieces.append(piece)
+            self.offsets.append(size)
+            size += len(format_piece(piece))
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        """only slices without a step are supported"""
+        start, stop, _ = key.indices(self.size)
+        return self.read(start, stop - start)
+
+    def __getslice__(self, start, stop):
+        start = max(start, 0)
+        return self.read(start, min(stop, self.size) - start)
+
+    def read(self, offset, size):
+        """return size bytes starting at offset"""
+        if size <= 0 or offset >= self.size:
+            return ''
+        i = bisect.bisect_right(self.offsets, offset) - 1
+        skip = offset - self.offsets[i]
+        chunks = []
+        left = size + skip
+        while left > 0 and i < len(self.pieces):
+            chunk = format_piece(self.pieces[i])
+            chunks.append(chunk)
+            left -= len(chunk)
+            i += 1
+        return ''.join(chunks)[skip:skip+size]
+
 def get_info_dict(comsub):
     """get dictionary of attributes for formatting"""
     d = {}
     d['author'] = comsub.author if comsub.author else "DELETED"
-    d['time'] = time.ctime(comsub.created)
+    d['time'] = get_ctime(comsub.created)
     d['score'] = comsub.score
     d['ups'] = comsub.ups
     d['downs'] = comsub.downs
@@ -50,7 +121,7 @@ def format_comment(comment, depth=0, cutoff=-1, recursive=True, top=-1):
     indent += depth * base_ind
     if depth==cutoff:
         return ' '*indent + '...\n'
-    if isinstance(comment, praw.objects.MoreComments):
+    if backend.is_more(comment):
         return ' '*indent + 'More...\n'
     text = get_comment_header(comment, indent) 
     text += get_comment_body(comment,indent)
@@ -62,7 +133,7 @@ def format_comment(comment, depth=0, cutoff=-1, recursive=True, top=-1):
 
 def get_comment_header(comment, indent):
     """return formatted header of post"""
-    wrap = indent * ' ' + (78- indent) * '-'
+    wrap = get_rule(indent, 78)
     formatted = indent * '-'+ "|%(author)s %(time)s ago\n"\
     + indent * ' ' + "|%(score)d points (%(ups)d|%(downs)d) id:%(id)s"
     d = get_info_dict(comment)
@@ -70,26 +141,84 @@ def get_comment_header(comment, indent):
 
 def get_comment_body(comment, indent):
     """returns formatted body of comment as [String]"""
-    wrap = indent * ' ' + (78- indent) * '-' + '\n'
-    indent = indent* ' '
-    wrapper = textwrap.TextWrapper(initial_indent=indent + '|',
-         subsequent_indent=indent + '|',width=79)
-    return '\n'.join(wrapper.wrap(comment.body)+[wrap])
-
-
-def get_top_10(subreddit):
-    """utility testing function"""
-    r = praw.Reddit('test!')
-    sub = r.get_subreddit(subreddit)
-    return [post for post in sub.get_top(limit=10)]    
-
-    
-#testing code
-if __name__=='__main__':
-    r = praw.Reddit('test!')
-    sub = r.get_subreddit('iama')
-    posts = [post for post in sub.get_top(limit=1)]   
-    with codecs.open('out.txt', mode='w',encoding='utf-8') as f:
-        for post in posts:
-            lines = format_submission(post) 
-            print lines 
+    key = (comment.id, comment.edited, indent)
+    cached = _bodies.get(key)
+    if cached is not None and cached[0] == comment.body:
+        return cached[1]
+    wrap = get_rule(indent, 78) + '\n'
+    wrapper = get_wrapper(indent, width=79)
+    text = '\n'.join(wrap_text(wrapper, comment.body)+[wrap])
+    remember(_bodies, key, (comment.body, text))
+    return text
+
+# wrapped comment bodies, (id, edited, indent) -> (body, text)
+_bodies = {}
+# TextWrappers by (indent, width)
+_wrappers = {}
+# rule lines by (indent, width)
+_rules = {}
+# time.ctime() by timestamp
+_ctimes = {}
+# entries kept per memo before it is emptied
+MEMO_SIZE = 20000
+
+def remember(memo, key, value):
+    """store value in a memo dict, emptying it when full"""
+    if len(memo) >= MEMO_SIZE:
+        memo.clear()
+    memo[key] = value
+
+def get_wrapper(indent, width=70):
+    """return the shared TextWrapper for an indent level"""
+    wrapper = _wrappers.get((indent, width))
+    if wrapper is None:
+        wrapper = textwrap.TextWrapper(initial_indent=indent*' '+'|',
+            subsequent_indent=indent*' '+'|', width=width)
+        _wrappers[(indent, width)] = wrapper
+    return wrapper
+
+def get_rule(indent, width):
+    """return indent spaces followed by dashes up to width"""
+    rule = _rules.get((indent, width))
+    if rule is None:
+        rule = _rules[(indent, width)] = indent*' ' + (width-indent)*'-'
+    return rule
+
+def get_ctime(created):
+    """return time.ctime(created), memoized"""
+    text = _ctimes.get(created)
+    if text is None:
+        text = time.ctime(created)
+        remember(_ctimes, created, text)
+    return text
+
+def wrap_text(wrapper, text):
+    """
+    return wrapper.wrap(text).  Text made of words separated by single
+    spaces is wrapped here instead, with the same result, much faster.
+    """
+    words = text.split()
+    # anything else goes through TextWrapper: it turns other whitespace
+    # into spaces, keeps runs of spaces and splits words on hyphens
+    if not words or ' '.join(words) != text or '-' in text or \
+            len(wrapper.initial_indent) != len(wrapper.subsequent_indent):
+        return wrapper.wrap(text)
+    width = wrapper.width - len(wrapper.initial_indent)
+    if len(text) <= width:
+        return [wrapper.initial_indent + text]
+    lines = []
+    line = []
+    length = -1
+    for word in words:
+        if len(word) > width:
+            # TextWrapper breaks words too long for a line
+            return wrapper.wrap(text)
+        if length + 1 + len(word) > width:
+            lines.append(' '.join(line))
+            line = []
+            length = -1
+        line.append(word)
+        length += 1 + len(word)
+    lines.append(' '.join(line))
+    return [wrapper.initial_indent + lines[0]] +\
+        [wrapper.subsequent_indent + l for l in lines[1:]]
@@ -0,0 +1,451 @@
+"""
+Fetches the remote files behind thumbnail and link_content.
+
+Sizes come from a HEAD request's Content-Length, reads are answered with
+HTTP Range requests for fixed-size blocks, and every block is written to an
+on-disk store so a URL is downloaded at most once.  Once all blocks of a URL
+are present the file is moved into a content-addressed blob, so identical
+files linked from several posts are only kept once.  The store has a size
+cap, past which the least recently read files are removed.
+
+Without a store, which needs a persistent cache directory, nothing is
+written to disk: the last few blocks read are kept in memory instead.  A
+server that ignores Range sends the whole body instead of a block; in
+memory its response is kept open and read on by the next blocks asked for,
+so reading such a file from start to end downloads it once.
+"""
+import hashlib
+import os
+import threading
+import urllib2
+from collections import OrderedDict
+
+# bytes fetched per Range request
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+
+# seconds to wait on a remote server
+DEFAULT_TIMEOUT = 30
+
+# chunk size used when streaming a whole body to disk
+COPY_SIZE = 64 * 1024
+
+# blocks kept in memory when there is no store
+MEMORY_BLOCKS = 16
+# responses of servers ignoring Range kept open for the blocks that follow
+MEMORY_STREAMS = 4
+
+
+class HeadRequest(urllib2.Request):
+    """
+    urllib2 only knows GET and POST
+    """
+    def get_method(self):
+        return 'HEAD'
+
+
+def url_key(url):
+    """
+    returns the file name used for url in the store
+    """
+    return hashlib.sha1(url).hexdigest()
+
+
+def read_file(path, size, offset):
+    """
+    returns up to size bytes of a local file starting at offset
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+class BlobStore(object):
+    """
+    On-disk storage for downloaded link content.
+
+    root/blobs/<sha1 of content>   complete files
+    root/urls/<sha1 of url>        sha1 of the content the url resolved to
+    root/partial/<sha1 of url>     sparse file being filled block by block
+    root/partial/<sha1 of url>.blocks   numbers of the blocks present
+
+    Files are removed least recently read first past max_bytes, None for no
+    cap; a read updates the mtime of the file read.
+    """
+    def __init__(self, root, max_bytes=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        # bytes in the store, None until evict() first looks
+        self.size = None
+        self._lock = threading.Lock()
+
+    def _path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def _ensure_dirs(self):
+        for name in ['blobs', 'urls', 'partial']:
+            if not os.path.isdir(self._path(name)):
+                os.makedirs(self._path(name))
+
+    def blob_path(self, url):
+        """
+        returns the path of the complete file for url, or None
+        """
+        try:
+            with open(self._path('urls', url_key(url))) as f:
+                digest = f.read().strip()
+        except IOError:
+            return None
+        path = self._path('blobs', digest)
+        if not os.path.exists(path):
+            return None
+        return path
+
+    def partial_path(self, url):
+        """
+        returns the path of the partial file for url, creating it if needed
+        """
+        self._ensure_dirs()
+        path = self._path('partial', url_key(url))
+        if not os.path.exists(path):
+            open(path, 'wb').close()
+        return path
+
+    def blocks(self, url):
+        """
+        returns the set of block numbers already stored for url
+        """
+        try:
+            with open(self._path('partial', url_key(url) + '.blocks')) as f:
+                return set(int(line) for line in f if line.strip())
+        except IOError:
+            return set()
+
+    def add_block(self, url, number, offset, data):
+        """
+        writes data at offset in the partial file of url and records it
+        """
+        with open(self.partial_path(url), 'r+b') as f:
+            f.seek(offset)
+            f.write(data)
+        with open(self._path('partial', url_key(url) + '.blocks'), 'a') as f:
+            f.write('%d\n' % number)
+        self._grow(len(data))
+
+    def write(self, url, f):
+        """
+        streams the whole body of response f into the partial file of url
+        """
+        written = 0
+        with open(self.partial_path(url), 'wb') as out:
+            for chunk in iter(lambda: f.read(COPY_SIZE), ''):
+                out.write(chunk)
+                written += len(chunk)
+        self._grow(written)
+        return written
+
+    def _grow(self, nbytes):
+        with self._lock:
+            if self.size is not None:
+                self.size += nbytes
+
+    def complete(self, url):
+        """
+        moves the finished partial file of url into the blob store and
+        returns its path
+        """
+        partial = self.partial_path(url)
+        digest = hashlib.sha1()
+        with open(partial, 'rb') as f:
+            for chunk in iter(lambda: f.read(COPY_SIZE), ''):
+                digest.update(chunk)
+        path = self._path('blobs', digest.hexdigest())
+        if os.path.exists(path):
+            # the same file was already downloaded through another url
+            self._grow(-os.path.getsize(partial))
+            os.remove(partial)
+        else:
+            os.rename(partial, path)
+        try:
+            os.remove(self._path('partial', url_key(url) + '.blocks'))
+        except OSError:
+            pass
+        tmp = self._path('urls', url_key(url) + '.tmp')
+        with open(tmp, 'w') as f:
+            f.write(digest.hexdigest())
+        os.rename(tmp, self._path('urls', url_key(url)))
+        return path
+
+    def touch(self, path):
+        """
+        marks a blob or partial file as just read
+        """
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def evict(self, busy):
+        """
+        removes the least recently read files until the store fits in
+        max_bytes.  busy(key) says whether the partial file of the url with
+        key is being filled, and must be left alone.  The store is only
+        listed when the running size says it is over the cap.
+        """
+        if self.max_bytes is None:
+            return
+        with self._lock:
+            if self.size is not None and self.size <= self.max_bytes:
+                return
+        files = []
+        total = 0
+        for name in ['blobs', 'partial']:
+            try:
+                names = os.listdir(self._path(name))
+            except OSError:
+                continue
+            for filename in names:
+                if filename.endswith('.blocks'):
+                    continue
+                path = self._path(name, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                # partial files are sparse
+                size = min(st.st_size, st.st_blocks * 512)
+                total += size
+                files.append((st.st_mtime, path, name, filename, size))
+        files.sort()
+        for _, path, name, filename, size in files:
+            if total <= self.max_bytes:
+                break
+            if name == 'partial' and busy(filename):
+                continue
+            try:
+                if name == 'partial':
+                    # the block list first, so no block is trusted whose
+                    # data is gone
+                    os.remove(path + '.blocks')
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        with self._lock:
+            self.size = total
+
+
+class LinkFetcher(object):
+    """
+    Size probes and ranged reads of remote files, backed by a BlobStore, or
+    by a few blocks in memory if store is None.
+    """
+    def __init__(self, store=None, block_size=DEFAULT_BLOCK_SIZE,
+                 timeout=DEFAULT_TIMEOUT):
+        self.store = store
+        self.block_size = block_size
+        self.timeout = timeout
+        self.bytes_downloaded = 0
+        # url -> size, None if the server didn't say
+        self._sizes = {}
+        # url key -> lock held while blocks of that url are fetched
+        self._url_locks = {}
+        # (url, block number) -> data, without a store; oldest first
+        self._memory = OrderedDict()
+        # url -> (open response, number of its next block) of servers
+        # ignoring Range, without a store; oldest first
+        self._streams = OrderedDict()
+        self._lock = threading.Lock()
+
+    def size(self, url):
+        """
+        returns the size of the file behind url, or None if the server
+        doesn't tell without downloading it
+        """
+        path = None
+        if self.store is not None:
+            path = self.store.blob_path(url)
+        if path is not None:
+            return os.path.getsize(path)
+        if url not in self._sizes:
+            try:
+                f = urllib2.urlopen(HeadRequest(url), timeout=self.timeout)
+                length = f.info().getheader('Content-Length')
+                f.close()
+                self._sizes[url] = int(length) if length else None
+            except (urllib2.URLError, ValueError, IOError):
+                self._sizes[url] = None
+        return self._sizes[url]
+
+    def read(self, url, size, offset):
+        """
+        returns up to size bytes of the file behind url starting at offset
+        """
+        if self.store is None:
+            return self._read_memory(url, size, offset)
+        path = self.store.blob_path(url)
+        if path is not None:
+            try:
+                data = read_file(path, size, offset)
+                self.store.touch(path)
+                return data
+            except IOError:
+                # evicted meanwhile
+                pass
+        total = self.size(url)
+        if total is not None and offset >= total:
+            return ''
+        with self._url_lock(url):
+            # another reader may have finished it while we waited, and a
+            # partial file may be moved once complete, so read under the lock
+            path = self.store.blob_path(url)
+            fetched = path is None
+            if path is None and total is None:
+                path = self._download(url)
+            elif path is None:
+                path = self._fetch_blocks(url, total, offset, size)
+            data = read_file(path, size, offset)
+            self.store.touch(path)
+        if fetched:
+            self.store.evict(self._busy)
+        return data
+
+    def _url_lock(self, url):
+        """
+        returns the lock serializing downloads of url
+        """
+        with self._lock:
+            return self._url_locks.setdefault(url_key(url),
+                                              threading.Lock())
+
+    def _busy(self, key):
+        """
+        returns whether blocks of the url with key are being fetched
+        """
+        with self._lock:
+            lock = self._url_locks.get(key)
+        if lock is None or lock.acquire(False):
+            if lock is not None:
+                lock.release()
+            return False
+        return True
+
+    def _read_memory(self, url, size, offset):
+        """
+        read() without a store, from blocks kept in memory
+        """
+        total = self.size(url)
+        end = offset + size
+        if total is not None:
+            end = min(end, total)
+        first = offset // self.block_size
+        last = max(end - 1, offset) // self.block_size
+        chunks = []
+        for number in range(first, last + 1):
+            data = self._memory_block(url, number, total)
+            chunks.append(data)
+            if len(data) < self.block_size:
+                break
+        skip = offset - first * self.block_size
+        return ''.join(chunks)[skip:skip + size]
+
+    def _memory_block(self, url, number, total):
+        """
+        returns block number of url, fetching it unless it is in memory
+        """
+        key = (url, number)
+        with self._lock:
+            data = self._memory.pop(key, None)
+            if data is not None:
+                self._memory[key] = data
+                return data
+            stream = self._streams.pop(url, None)
+        start = number * self.block_size
+        if total is not None and start >= total:
+            if stream is not None:
+                stream[0].close()
+            return ''
+        if stream is not None and stream[1] > number:
+            # already read past it
+            stream[0].close()
+            stream = None
+        if stream is None:
+            request = urllib2.Request(url)
+            request.add_header('Range', 'bytes=%d-%d' %
+                               (start, start + self.block_size - 1))
+            f = urllib2.urlopen(request, timeout=self.timeout)
+            if f.getcode() == 206:
+                data = f.read(self.block_size)
+                f.close()
+                self.bytes_downloaded += len(data)
+                self._remember(key, data)
+                return data
+            # no Range support, the block is somewhere in the whole body
+            stream = (f, 0)
+        f, position = stream
+        data = ''
+        while position <= number:
+            data = f.read(self.block_size)
+            self.bytes_downloaded += len(data)
+            self._remember((url, position), data)
+            position += 1
+            if len(data) < self.block_size:
+                # the end of the body
+                f.close()
+                return data if position > number else ''
+        with self._lock:
+            self._streams[url] = (f, position)
+            while len(self._streams) > MEMORY_STREAMS:
+                self._streams.popitem(last=False)[1][0].close()
+        return data
+
+    def _remember(self, key, data):
+        """
+        keeps a block in memory, dropping the least recently read past
+        MEMORY_BLOCKS
+        """
+        with self._lock:
+            self._memory[key] = data
+            while len(self._memory) > MEMORY_BLOCKS:
+                self._memory.popitem(last=False)
+
+    def _fetch_blocks(self, url, total, offset, size):
+        """
+        makes sure the blocks covering offset..offset+size are on disk and
+        returns the file to read them from
+        """
+        first = offset // self.block_size
+        last = min(offset + size, total) - 1
+        last = max(last, offset) // self.block_size
+        present = self.store.blocks(url)
+        for number in range(first, last + 1):
+            if number in present or number * self.block_size >= total:
+                continue
+            start = number * self.block_size
+            end = min(start + self.block_size, total) - 1
+            request = urllib2.Request(url)
+            request.add_header('Range', 'bytes=%d-%d' % (start, end))
+            f = urllib2.urlopen(request, timeout=self.timeout)
+            if f.getcode() != 206:
+                # no Range support, take the whole body in one go
+                return self._download(url, f)
+            data = f.read()
+            f.close()
+            self.bytes_downloaded += len(data)
+            self.store.add_block(url, number, start, data)
+            present.add(number)
+        blocks = (total + self.block_size - 1) // self.block_size
+        if len(present) >= blocks:
+            return self.store.complete(url)
+        return self.store.partial_path(url)
+
+    def _download(self, url, f=None):
+        """
+        streams the whole body of url into the store and returns its path
+        """
+        if f is None:
+            f = urllib2.urlopen(url, timeout=self.timeout)
+        try:
+            self.bytes_downloaded += self.store.write(url, f)
+        finally:
+            f.close()
+        return self.store.complete(url)
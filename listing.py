@@ -0,0 +1,51 @@
+"""
+Lazily paginated reddit listings.  Pages are fetched one at a time with
+reddit's "after" cursor as a directory is read, and each page is cached by
+the cursor that starts it, so rereading a listing doesn't refetch pages and
+only one page is held while entries stream out.
+"""
+
+# reddit returns at most this many things per request
+PAGE_SIZE = 100
+
+# things listed per directory unless configured otherwise, None for no limit
+DEFAULT_DEPTH = 20
+
+# sort-specific subdirectories of r/<subreddit>
+SORTS = ['hot', 'new', 'top', 'controversial']
+
+# subdirectories of r/<subreddit>/top
+PERIODS = ['hour', 'day', 'week', 'month', 'year', 'all']
+
+
+def iter_listing(object_cache, key, fetch, entry, depth=DEFAULT_DEPTH,
+                 page_size=PAGE_SIZE):
+    """
+    yields entry(thing) for the first depth things of the listing identified
+    by key, fetching pages with fetch(after, limit) only when they aren't
+    cached.  entry should return something small, as that is what gets
+    cached.
+    """
+    after = None
+    count = 0
+    while depth is None or count < depth:
+        page = object_cache.get('page', (key, after))
+        if page is None:
+            limit = page_size
+            if depth is not None:
+                limit = min(page_size, depth - count)
+            things = fetch(after, limit)
+            entries = [entry(thing) for thing in things]
+            next_after = None
+            if len(things) == limit:
+                next_after = things[-1].fullname
+            page = (entries, next_after)
+            object_cache.put('page', (key, after), page, weight=len(entries))
+        entries, after = page
+        for item in entries:
+            if depth is not None and count >= depth:
+                return
+            count += 1
+            yield item
+        if after is None:
+            return
@@ -0,0 +1,111 @@
+"""
+The submissions, comments and MoreComments placeholders redditvfs keeps.
+Backends hand these out instead of praw objects, which carry a dict of
+every JSON field reddit sent, a reference to the session and attributes
+that fetch when touched.  These hold only what the filesystem shows, in
+__slots__, with the names of users and subreddits and the fullnames
+repeated across a thread interned, so a thread costs a fraction of the
+memory and nothing is fetched behind the cache's back.
+"""
+
+
+def intern_name(value):
+    """
+    returns the shared copy of a user or subreddit name, or of a fullname
+    """
+    if value is None:
+        return None
+    return intern(str(value))
+
+
+class Thing(object):
+    """
+    Base class of things.  Fields are set from keyword arguments, those
+    left out are None; NAMES are interned.
+    """
+    __slots__ = ()
+    KIND = None
+    NAMES = ()
+
+    def __init__(self, **fields):
+        for field in self.__slots__:
+            value = fields.pop(field, None)
+            if field in self.NAMES:
+                value = intern_name(value)
+            elif field == 'id' and value is not None:
+                value = str(value)
+            setattr(self, field, value)
+        if fields:
+            raise TypeError('unknown fields: ' + ', '.join(sorted(fields)))
+
+    @property
+    def fullname(self):
+        return self.KIND + '_' + self.id
+
+    def fields(self):
+        """
+        returns the fields as a dict
+        """
+        return dict((field, getattr(self, field))
+                    for field in self.__slots__)
+
+    def copy(self, **changes):
+        """
+        returns a copy of the thing, with changes made to its fields
+        """
+        fields = self.fields()
+        fields.update(changes)
+        return type(self)(**fields)
+
+    def __repr__(self):
+        return '<%s %s>' % (type(self).__name__, self.id)
+
+
+class Submission(Thing):
+    """
+    A submission, with its top-level comments once its thread is fetched.
+    """
+    __slots__ = ('id', 'title', 'selftext', 'url', 'thumbnail', 'author',
+                 'subreddit', 'created', 'edited', 'score', 'ups', 'downs',
+                 'likes', 'num_comments', 'comments')
+    KIND = 't3'
+    NAMES = ('author', 'subreddit')
+
+    def __init__(self, **fields):
+        Thing.__init__(self, **fields)
+        if self.comments is None:
+            self.comments = []
+
+
+class Comment(Thing):
+    """
+    A comment, with its replies; parent_id and link_id are fullnames.
+    """
+    __slots__ = ('id', 'parent_id', 'link_id', 'body', 'author',
+                 'subreddit', 'created', 'edited', 'score', 'ups', 'downs',
+                 'likes', 'replies')
+    KIND = 't1'
+    NAMES = ('author', 'subreddit', 'link_id')
+
+    def __init__(self, **fields):
+        Thing.__init__(self, **fields)
+        if self.parent_id is not None:
+            self.parent_id = str(self.parent_id)
+        if self.replies is None:
+            self.replies = []
+
+
+class MoreComments(Thing):
+    """
+    A "load more" placeholder: the ids of the comments it hides below
+    parent_id, in the thread link_id.
+    """
+    __slots__ = ('id', 'parent_id', 'link_id', 'children', 'count')
+    KIND = 'more'
+    NAMES = ('parent_id', 'link_id')
+
+    def __init__(self, **fields):
+        Thing.__init__(self, **fields)
+        if self.children is None:
+            self.children = []
+        self.children = [str(child) for child in self.children]
@@ -0,0 +1,176 @@
+"""
+Parsing of redditvfs paths.  Every FUSE call used to split its path again
+and walk a chain of conditions to find out what it names; parse() does that
+once per path and returns a Node whose kind the FUSE methods dispatch on.
+Nodes are memoized, as the kernel asks about the same paths over and over.
+"""
+import threading
+from collections import OrderedDict
+
+import listing
+
+# files in every submission and comment directory
+CONTENT_FILES = ['thumbnail', 'flat', 'votes', 'content', 'reply',
+                 'raw_content', 'link_content']
+
+# u/<name>/* directories and the praw listing behind each
+USER_LISTINGS = {'Overview': 'overview', 'Submitted': 'submitted',
+                 'Comments': 'comments'}
+
+# kinds of node
+DOT = 'dot'                  # . and ..
+ROOT = 'root'                # /
+SUBREDDITS = 'subreddits'    # /r
+USERS = 'users'              # /u
+STATS = 'stats'              # /.stats
+WATCH = 'watch'              # /.watch
+SEARCH = 'search'            # /search
+SEARCH_RESULTS = 'search_results'  # search/<query>
+SEARCH_LINK = 'search_link'  # search/<query>/<thing>
+SUBREDDIT = 'subreddit'      # r/<subreddit>, or r/<subreddit>.sub
+NEW_POST = 'new_post'        # r/<subreddit>/post
+SUBMISSION = 'submission'    # r/<subreddit>/<post>
+SORT = 'sort'                # r/<subreddit>/<sort>, and top/<period> in it
+SORT_LINK = 'sort_link'      # r/<subreddit>/<sort>/**/<post>
+MORE = 'more'                # r/<subreddit>/<post>/**/more_<parent id>
+MORE_LINK = 'more_link'      # r/<subreddit>/<post>/**/more_<id>/<comment>
+CONTENT = 'content'          # r/<subreddit>/<post>/**/<content file>
+COMMENT = 'comment'          # r/<subreddit>/<post>/**/<comment>
+USERLINK = 'userlink'        # r/<subreddit>/<post>/**/_Posted_by_<user>_
+USER = 'user'                # u/<user>
+USER_LISTING = 'user_listing'  # u/<user>/<listing>
+USER_ENTRY = 'user_entry'    # u/<user>/<listing>/<thing>
+
+# kinds that are directories and symlinks, all others are files
+DIRECTORIES = set([DOT, ROOT, SUBREDDITS, USERS, SUBREDDIT, SUBMISSION, SORT,
+                   MORE, COMMENT, USER, USER_LISTING, SEARCH,
+                   SEARCH_RESULTS])
+SYMLINKS = set([SORT_LINK, MORE_LINK, USERLINK, USER_ENTRY, SEARCH_LINK])
+
+# parsed paths kept
+MEMO_SIZE = 4096
+# path -> Node, least recently parsed first
+_memo = OrderedDict()
+_memo_lock = threading.Lock()
+
+
+class Node(object):
+    """
+    What a path names.  kind is one of the kinds above, or None if the path
+    doesn't name anything.  Depending on the kind, subreddit, post_id,
+    comment_ids (from the submission down), sort, period, username,
+    user_listing and query are set; name is the last component.
+    """
+    def __init__(self, kind, path, parts):
+        self.kind = kind
+        self.path = path
+        self.parts = parts
+        self.name = parts[-1]
+        self.subreddit = None
+        self.post_id = None
+        self.comment_ids = []
+        self.sort = None
+        self.period = None
+        self.username = None
+        self.user_listing = None
+        self.query = None
+
+    def __repr__(self):
+        return '<Node %s %r>' % (self.kind, self.path)
+
+
+def parse(path):
+    """
+    returns the Node for path
+    """
+    with _memo_lock:
+        node = _memo.pop(path, None)
+        if node is None:
+            node = _parse(path)
+            if len(_memo) >= MEMO_SIZE:
+                _memo.popitem(last=False)
+        _memo[path] = node
+    return node
+
+
+def _parse(path):
+    parts = path.split('/')
+    count = len(parts)
+    name = parts[-1]
+    if name in ['.', '..']:
+        return Node(DOT, path, parts)
+    if path == '/':
+        return Node(ROOT, path, parts)
+    if path == '/r':
+        return Node(SUBREDDITS, path, parts)
+    if path == '/u':
+        return Node(USERS, path, parts)
+    if path == '/.stats':
+        return Node(STATS, path, parts)
+    if path == '/.watch':
+        return Node(WATCH, path, parts)
+    if parts[1] == 'r':
+        return _parse_subreddit(path, parts)
+    if parts[1] == 'search' and count <= 4:
+        node = Node([None, None, SEARCH, SEARCH_RESULTS,
+                     SEARCH_LINK][count], path, parts)
+        if count > 2:
+            node.query = parts[2]
+        return node
+    if parts[1] == 'u' and count <= 5:
+        node = Node([None, None, None, USER, USER_LISTING,
+                     USER_ENTRY][count], path, parts)
+        node.username = parts[2]
+        if count > 3:
+            node.user_listing = USER_LISTINGS.get(parts[3])
+        return node
+    return Node(None, path, parts)
+
+
+def is_more(name):
+    """
+    returns whether name is that of a more_<parent id> directory, and not a
+    comment whose text starts with more_
+    """
+    return name[:5] == 'more_' and name[5:].isalnum()
+
+
+def _parse_subreddit(path, parts):
+    count = len(parts)
+    name = parts[-1]
+    if count == 3:
+        kind = SUBREDDIT
+    elif count == 4 and name == 'post':
+        kind = NEW_POST
+    elif count == 4 and name in listing.SORTS:
+        kind = SORT
+    elif count == 4:
+        kind = SUBMISSION
+    elif parts[3] in listing.SORTS:
+        if parts[3] == 'top' and count == 5:
+            kind = SORT
+        else:
+            kind = SORT_LINK
+    elif is_more(name):
+        kind = MORE
+    elif count > 5 and is_more(parts[-2]):
+        kind = MORE_LINK
+    elif name in CONTENT_FILES:
+        kind = CONTENT
+    elif name[-1:] == '_':
+        kind = USERLINK
+    else:
+        kind = COMMENT
+    node = Node(kind, path, parts)
+    node.subreddit = parts[2]
+    if kind == SORT or kind == SORT_LINK:
+        node.sort = parts[3]
+        if parts[3] == 'top' and count > 4:
+            node.period = parts[4]
+    elif count > 3 and kind != NEW_POST:
+        node.post_id = parts[3].split(' ')[-1]
+        comment_parts = parts[4:]
+        if kind == CONTENT or kind == USERLINK or kind == MORE:
+            comment_parts = comment_parts[:-1]
+        node.comment_ids = [part.split(' ')[-1] for part in comment_parts]
+    return node
@@ -0,0 +1,232 @@
+"""
+Optional on-disk cache behind the in-memory caches, so a remount starts warm.
+
+Entries live in a single SQLite file, one row per (kind, key), holding the
+pickled value together with the time it was fetched from reddit, its
+revision and the weight it counts for in memory.  The file is kept under a
+size cap by dropping the least recently used rows.
+
+Writes are queued and made by a background thread, one transaction per
+batch, so a FUSE call changing a thread doesn't wait for it to be pickled.
+Writes to the same entry coalesce while queued, and an entry whose revision
+is already on disk only has its fetched time updated.
+"""
+import cPickle
+import sqlite3
+import threading
+import time
+
+# default cap on the size of the values kept on disk
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# seconds the writer waits for more writes before making a batch
+WRITE_DELAY = 1.0
+
+
+class PersistentStore(object):
+    """
+    A size-capped key/value store in SQLite.
+    """
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.size = None
+        self._db = None
+        self._lock = threading.Lock()
+        # (kind, key) -> (value, fetched, revision, weight), or None to
+        # delete
+        self._pending = {}
+        # the batch being written
+        self._writing = {}
+        # flush() calls waiting
+        self._flushes = 0
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def _connect(self):
+        """
+        opens the database on first use, which is after FUSE has forked
+        """
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            columns = [row[1] for row in
+                       self._db.execute('PRAGMA table_info(entries)')]
+            if columns and 'weight' not in columns:
+                # written by a version that didn't keep weights
+                self._db.execute('DROP TABLE entries')
+            self._db.execute('CREATE TABLE IF NOT EXISTS entries ('
+                             'kind TEXT, key TEXT, value BLOB, fetched REAL, '
+                             'revision REAL, accessed REAL, size INTEGER, '
+                             'weight INTEGER, PRIMARY KEY (kind, key))')
+            self._db.execute('CREATE INDEX IF NOT EXISTS entries_accessed '
+                             'ON entries (accessed)')
+            row = self._db.execute('SELECT SUM(size) FROM entries').fetchone()
+            self.size = row[0] or 0
+        return self._db
+
+    def get(self, kind, key):
+        """
+        returns (value, fetched, revision, weight) for an entry, or None
+        """
+        with self._cond:
+            for queued in [self._pending, self._writing]:
+                if (kind, key) in queued:
+                    return queued[(kind, key)]
+        with self._lock:
+            db = self._connect()
+            row = db.execute('SELECT value, fetched, revision, weight '
+                             'FROM entries '
+                             'WHERE kind = ? AND key = ?',
+                             (kind, repr(key))).fetchone()
+            if row is None:
+                return None
+            db.execute('UPDATE entries SET accessed = ? '
+                       'WHERE kind = ? AND key = ?',
+                       (time.time(), kind, repr(key)))
+            db.commit()
+        try:
+            value = cPickle.loads(str(row[0]))
+        except Exception:
+            # written by an incompatible version, treat as missing
+            self.delete(kind, key)
+            return None
+        return (value,) + tuple(row[1:])
+
+    def put(self, kind, key, value, fetched, revision, weight=1):
+        """
+        queues an entry to be stored, replacing any queued write of it
+        """
+        self._queue(kind, key, (value, fetched, revision, weight))
+
+    def delete(self, kind, key):
+        """
+        queues an entry to be dropped, if present
+        """
+        self._queue(kind, key, None)
+
+    def _queue(self, kind, key, entry):
+        with self._cond:
+            self._pending[(kind, key)] = entry
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        waits until every queued write was made, at most timeout seconds;
+        returns whether it was
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            # the writer doesn't wait for more writes while a flush does
+            self._flushes += 1
+            self._cond.notify_all()
+            try:
+                while self._pending or self._writing:
+                    if deadline is None:
+                        self._cond.wait()
+                        continue
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                return True
+            finally:
+                self._flushes -= 1
+
+    def _run(self):
+        while True:
+            batch = self._take()
+            try:
+                self._write(batch)
+            except Exception:
+                # a failed batch only loses what the cache could refetch
+                pass
+            finally:
+                with self._cond:
+                    self._writing = {}
+                    self._cond.notify_all()
+
+    def _take(self):
+        """
+        waits for queued writes and returns them as the batch to write
+        """
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            # every write queued wakes the condition, so wait out the delay
+            # rather than for the next one, letting a burst coalesce
+            deadline = time.time() + WRITE_DELAY
+            while not self._flushes:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._writing = self._pending
+            self._pending = {}
+            return batch
+
+    def _write(self, batch):
+        """
+        makes a batch of writes in one transaction, evicting least recently
+        used rows past the cap.  Values are pickled without the database
+        lock held, so that reads don't wait on it, and only if their
+        revision isn't on disk yet; those that can't be pickled are silently
+        not stored.
+        """
+        with self._lock:
+            db = self._connect()
+            stored = {}
+            for (kind, key), entry in batch.iteritems():
+                row = db.execute('SELECT revision FROM entries '
+                                 'WHERE kind = ? AND key = ?',
+                                 (kind, repr(key))).fetchone()
+                if entry is not None and row is not None:
+                    stored[(kind, key)] = row[0]
+        writes = []
+        for (kind, key), entry in batch.iteritems():
+            data = None
+            if entry is not None and stored.get((kind, key)) != entry[2]:
+                try:
+                    data = cPickle.dumps(entry[0], cPickle.HIGHEST_PROTOCOL)
+                except Exception:
+                    continue
+                if len(data) > self.max_bytes:
+                    continue
+            writes.append((kind, key, entry, data))
+        with self._lock:
+            for kind, key, entry, data in writes:
+                if entry is None:
+                    self._delete(kind, key)
+                elif data is None:
+                    # only touched since it was written
+                    db.execute('UPDATE entries SET fetched = ?, accessed = ? '
+                               'WHERE kind = ? AND key = ?',
+                               (entry[1], time.time(), kind, repr(key)))
+                else:
+                    self._insert(kind, key, entry, data)
+            db.commit()
+
+    def _insert(self, kind, key, entry, data):
+        _, fetched, revision, weight = entry
+        self._delete(kind, key)
+        self._db.execute('INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                         (kind, repr(key), sqlite3.Binary(data), fetched,
+                          revision, time.time(), len(data), weight))
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            row = self._db.execute('SELECT kind, key, size FROM entries '
+                                   'ORDER BY accessed LIMIT 1').fetchone()
+            self._db.execute('DELETE FROM entries '
+                             'WHERE kind = ? AND key = ?', row[:2])
+            self.size -= row[2]
+
+    def _delete(self, kind, key):
+        row = self._db.execute('SELECT size FROM entries '
+                               'WHERE kind = ? AND key = ?',
+                               (kind, repr(key))).fetchone()
+        if row is not None:
+            self._db.execute('DELETE FROM entries WHERE kind = ? AND key = ?',
+                             (kind, repr(key)))
+            self.size -= row[0]
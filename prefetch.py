@@ -0,0 +1,94 @@
+"""
+Background prefetching for redditvfs.  When a directory is listed, the shell
+usually stats every child right afterwards; the prefetcher fetches what those
+stats will need in the background so they find it already cached.
+
+Requests to reddit go through client.RedditClient, which sends one at a
+time, so the workers' fetches from reddit don't overlap with each other,
+only with the FUSE work going on meanwhile.  Jobs that don't ask reddit,
+such as the size probes of link content, do run in parallel.
+"""
+import Queue
+import threading
+import time
+
+import scheduler
+
+# worker threads; a few keep reddit's queue full while others probe links
+DEFAULT_WORKERS = 4
+
+# minimum seconds between two fetches started by the pool, to stay within
+# the API rate limit.  praw already spaces out its own requests, so this is
+# only needed for stricter limits.
+DEFAULT_MIN_INTERVAL = 0.0
+
+
+class Prefetcher(object):
+    """
+    A bounded pool of daemon threads running fetch jobs.  Jobs are keyed so
+    the same object isn't queued twice while it is still pending.  Threads
+    are started on first use, after FUSE has daemonized.
+    """
+    def __init__(self, workers=DEFAULT_WORKERS,
+                 min_interval=DEFAULT_MIN_INTERVAL):
+        self.workers = workers
+        self.min_interval = min_interval
+        self._queue = Queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._next_start = 0.0
+
+    def submit(self, key, job, *args):
+        """
+        queues job(*args) unless a job with the same key is still pending
+        """
+        if self.workers <= 0:
+            return
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+            if not self._threads:
+                self._start()
+        self._queue.put((key, job, args))
+
+    def pending(self):
+        """
+        returns the number of jobs queued or running
+        """
+        with self._lock:
+            return len(self._pending)
+
+    def _start(self):
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._run)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _throttle(self):
+        """
+        sleeps until this worker may start its next fetch
+        """
+        with self._lock:
+            now = time.time()
+            start = max(now, self._next_start)
+            self._next_start = start + self.min_interval
+        if start > now:
+            time.sleep(start - now)
+
+    def _run(self):
+        # users waiting on the filesystem go first
+        scheduler.set_priority(scheduler.BACKGROUND)
+        while True:
+            key, job, args = self._queue.get()
+            try:
+                self._throttle()
+                job(*args)
+            except Exception:
+                # a failed prefetch is simply fetched again on demand
+                pass
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
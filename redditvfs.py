@@ -7,20 +7,112 @@ daemonizing.
 """
 import errno
 import fuse
+import itertools
+import os
 import stat
+import threading
 import time
 import praw
 import getpass
 import ConfigParser
 import sys
-import urllib2
 import format
 import json
+import backend
+import cache
+import dump
+import client
+import forest
+import linkcontent
+import listing
+import model
+import paths
+import persist
+import prefetch
+import scheduler
+import search
+import signal
+import snapshot
+import stats
+import watch
+import writeback
+from collections import OrderedDict
 
 fuse.fuse_python_api = (0, 2)
 
-content_stuff = ['thumbnail', 'flat', 'votes', 'content', 'reply',
-                 'raw_content', 'link_content']
+content_stuff = paths.CONTENT_FILES
+# access mode bits of open() flags; python 2 has no os.O_ACCMODE
+accmode = os.O_RDONLY | os.O_WRONLY | os.O_RDWR
+
+# cut-off length on items with id to make things usable for end-user
+pathmax = 50
+
+# things listed per directory, 0 for no limit
+listing_depth = listing.DEFAULT_DEPTH
+
+# MoreComments expanded in the background per fetched thread
+more_budget = 2
+
+# bring expired threads up to date with the comments posted since, rather
+# than refetching them
+incremental_refresh = False
+# comments of a subreddit a sync looks through at most; reddit lists no
+# more than 1000
+SYNC_LIMIT = 1000
+# seconds a thread is synced before it is refetched whole anyway, which
+# also picks up edits, votes and comments hidden from syncs
+FULL_REFRESH_INTERVAL = 600
+
+# content files backed by a remote url rather than by formatted text
+link_stuff = ['thumbnail', 'link_content']
+
+# content files whose writes are sent to reddit
+written_stuff = ['votes', 'reply', 'raw_content']
+
+# submissions and comment forests shared by every FUSE callback
+object_cache = cache.ObjectCache()
+# rendered content files, keyed by path and object revision
+render_cache = cache.RenderCache()
+# downloads behind thumbnail and link_content, stored on disk only under
+# --cache-dir
+link_fetcher = linkcontent.LinkFetcher()
+# fetches what a directory's children will need once it is listed
+prefetcher = prefetch.Prefetcher()
+
+# counters and timings served from /.stats
+registry = stats.Registry()
+# where SIGUSR1 writes a snapshot of them, stderr if None
+stats_file = None
+
+# sends votes, replies, edits and posts in the background
+write_behind = writeback.WriteBehind(registry)
+# seconds to wait at unmount for queued writes to be sent
+DRAIN_TIMEOUT = 30
+
+# keeps the subreddits and threads listed in /.watch fresh
+watcher = watch.Watcher(registry=registry)
+
+# words of the submissions and comments seen, queried through search/
+search_index = search.SearchIndex()
+# threads not indexed yet, post id -> (submission, comment index)
+search_backlog = OrderedDict()
+search_lock = threading.Lock()
+# threads queued at most before the oldest is indexed right away
+SEARCH_BACKLOG = 50
+
+# the logged in user, author of replies that aren't sent yet
+username = None
+# ids of those replies
+unsent_ids = itertools.count()
+
+# mtime of anything nothing better is known about
+mount_time = int(time.time())
+
+# let the kernel keep the pages of content files whose object didn't change
+keep_cache = True
+
+# seconds the kernel caches attributes and lookups unless -o sets them
+DEFAULT_ATTR_TIMEOUT = 10
 
 
 class redditvfs(fuse.Fuse):
@@ -34,206 +126,182 @@ class redditvfs(fuse.Fuse):
         if reddit is None:
             raise Exception('reddit must be set')
 
+    @registry.timed('fuse.rmdir')
     def rmdir(self, path):
         """
         One can run "rmdir" on r/<subreddit>.sub" to unsubscribe from the
         directory.
         """
-        if len(path.split('/')) == 3 and reddit.is_logged_in:
-            reddit.unsubscribe(path.split('/')[-1:][0])
-            return
-        else:
+        node = paths.parse(path)
+        if node.kind != paths.SUBREDDIT:
             return -errno.ENOSYS
+        if reddit.read_only:
+            return -errno.EROFS
+        if not reddit.is_logged_in():
+            return -errno.EACCES
+        subreddit = node.subreddit
+        if subreddit[-4:] == '.sub':
+            subreddit = subreddit[:-4]
+        try:
+            reddit.unsubscribe(subreddit)
+        except IOError, e:
+            return -(e.errno or errno.EIO)
+        set_subscribed(subreddit, False)
 
+    @registry.timed('fuse.mkdir')
     def mkdir(self, path, mode):
         """
-        One can run "mmkdir" on r/<subreddit>.sub" to subscribe to the
+        One can run "mkdir" on r/<subreddit>.sub" to subscribe to the
         directory.
         """
-        if len(path.split('/')) == 3 \
-                and path.split('/')[-1:][0][-4:] == '.sub' \
-                and reddit.is_logged_in:
-            reddit.subscribe(path.split('/')[-1:][0][:-4])
-            return
-        else:
+        node = paths.parse(path)
+        if node.kind != paths.SUBREDDIT or node.subreddit[-4:] != '.sub':
             return -errno.ENOSYS
+        if reddit.read_only:
+            return -errno.EROFS
+        if not reddit.is_logged_in():
+            return -errno.EACCES
+        subreddit = node.subreddit[:-4]
+        try:
+            reddit.subscribe(subreddit)
+        except IOError, e:
+            return -(e.errno or errno.EIO)
+        set_subscribed(subreddit, True)
 
+    @registry.timed('fuse.getattr')
     def getattr(self, path):
         """
         Returns stat info for file, such as permissions and access times.
+        Missing paths are remembered for a few seconds, as shells and editors
+        stat the same ones (.git, swap files) over and over.
+        """
+        if object_cache.get('missing', path):
+            return -errno.ENOENT
+        try:
+            st = self._getattr(paths.parse(path))
+        except (IOError, OSError), e:
+            if e.errno == errno.ENOENT:
+                object_cache.put('missing', path, True)
+            raise
+        if st == -errno.ENOENT:
+            object_cache.put('missing', path, True)
+        return st
+
+    def _getattr(self, node):
         """
+        getattr without the cache of missing paths
+        """
+        if node.kind is None:
+            return -errno.ENOENT
 
         # default nlink and time info
         st = fuse.Stat()
         st.st_nlink = 2
-        st.st_atime = int(time.time())
-        st.st_mtime = st.st_atime
-        st.st_ctime = st.st_atime
-
-        # everything defaults to being a normal file unless explicitly set
-        # otherwise
-        st.st_mode = stat.S_IFREG | 0444
-
-        # useful information
-        path_split = path.split('/')
-        path_len = len(path_split)
-
-        # "." and ".."
-        if path_split[-1] == '.' or path_split[-1] == '..':
-            # . and ..
-            st.st_mode = stat.S_IFDIR | 0555
-            return st
-
-        # top-level directories
-        if path in ['/', '/u', '/r']:
-            st.st_mode = stat.S_IFDIR | 0555
-            return st
-
-        # r/*/ - subreddits
-        if path_split[1] == 'r' and path_len == 3:
-            # check for .sub directories for subscribing
-            if reddit.is_logged_in():
-                if path.split('/')[-1:][0][-4:] == '.sub':
-                    my_subs = [sub.display_name.lower() for sub in
-                               reddit.get_my_subreddits()]
-                    if (path.split('/')[-1:][0][:-4]).lower() not in my_subs:
-                        st = -2
-                    else:
-                        st.st_mode = stat.S_IFDIR | 0555
-                else:
-                    st.st_mode = stat.S_IFDIR | 0555
-            else:
-                # normal subreddit
-                st.st_mode = stat.S_IFDIR | 0555
-            return st
-
-        # r/*/* - submissions
-        if path_split[1] == 'r' and path_len == 4:
-            if path_split[-1] == 'post':
-                # file to post a submission
-                st.st_mode = stat.S_IFREG | 0666
-            else:
-                # submission
-                st.st_mode = stat.S_IFDIR | 0555
-            return st
-
-        # r/*/*/[vote, etc] - content stuff in submission
-        if (path_split[1] == 'r' and path_len == 5 and path_split[-1] in
-                content_stuff):
-            st.st_mode = stat.S_IFREG | 0444
-            post_id = path_split[3].split(' ')[-1]
-            post = reddit.get_submission(submission_id=post_id)
-            formatted = ''
-            if path_split[-1] == 'content':
-                formatted = format.format_sub_content(post)
-                formatted = formatted.encode('ascii', 'ignore')
-            elif path_split[-1] == 'votes':
-                formatted = str(post.score) + '\n'
-            elif path_split[-1] == 'flat':
-                formatted = format.format_submission(post)
-                formatted = formatted.encode('ascii', 'ignore')
-            elif (path_split[-1] == 'thumbnail' and 'thumbnail' in dir(post)
-                    and post.thumbnail != '' and post.thumbnail != 'self'
-                    and post.thumbnail != 'default'):
-                f = urllib2.urlopen(post.thumbnail)
-                if f.getcode() == 200:
-                    formatted = f.read()
-            elif path_split[-1] == 'reply':
-                st.st_mode = stat.S_IFREG | 0666
-            elif path_split[-1] == 'raw_content' and post.selftext:
-                st.st_mode = stat.S_IFREG | 0666
-                formatted = post.selftext.encode('ascii', 'ignore')
-            elif path_split[-1] == 'raw_content' and post.url:
-                st.st_mode = stat.S_IFREG | 0666
-                formatted = post.url.encode('ascii', 'ignore')
-            elif path_split[-1] == 'link_content' and post.url:
-                f = urllib2.urlopen(post.url)
-                if f.getcode() == 200:
-                    formatted = f.read()
-            st.st_size = len(formatted)
-            return st
+        st.st_mtime = get_mtime(node)
+        st.st_atime = st.st_mtime
+        st.st_ctime = st.st_mtime
 
-        # r/*/*/** - comment post
-        if (path_split[1] == 'r' and path_len > 4 and path_split[-1] not in
-                content_stuff and path.split('/')[-1:][0][-1:] != '_'):
+        if node.kind in paths.DIRECTORIES:
             st.st_mode = stat.S_IFDIR | 0555
-            return st
-
-        # user link
-        if (path_split[1] == 'r' and path_len > 4 and path_split[-1] not in
-                content_stuff and path.split('/')[-1:][0][-1:] == '_'):
+        elif node.kind in paths.SYMLINKS:
             st.st_mode = stat.S_IFLNK | 0777
-            return st
-
-        # r/*/*/** - comment directory
-        if (path_split[1] == 'r' and path_len > 5 and path_split[-1] not in
-                content_stuff):
-            st.st_mode = stat.S_IFDIR | 0555
-            return st
-
-        # r/*/*/** - comment stuff
-        if (path_split[1] == 'r' and path_len > 5 and path_split[-1] in
-                content_stuff):
+        else:
             st.st_mode = stat.S_IFREG | 0444
-            post = get_comment_obj(path)
-            formatted = ''
-            if path_split[-1] == 'content':
-                formatted = format.format_comment(post, recursive=False)
-                formatted = formatted.encode('ascii', 'ignore')
-            elif path_split[-1] == 'votes':
-                formatted = str(post.score) + '\n'
-            elif path_split[-1] == 'flat':
-                formatted = format.format_comment(post, recursive=True)
-                formatted = formatted.encode('ascii', 'ignore')
-            elif path_split[-1] == 'reply':
-                st.st_mode = stat.S_IFREG | 0666
-            elif path_split[-1] == 'raw_content':
-                st.st_mode = stat.S_IFREG | 0666
-                formatted = post.body.encode('ascii', 'ignore')
-            st.st_size = len(formatted)
-            return st
-
-        # u/* - user
-        if path_split[1] == 'u' and path_len == 3:
-            st.st_mode = stat.S_IFDIR | 0555
-            return st
-
-        # u/*/* - user stuff (comments, submitted, etc)
-        if path_split[1] == 'u' and path_len == 4:
-            st.st_mode = stat.S_IFDIR | 0555
-            return st
 
-        # u/*/*/* - links (comment, submitted, etc)
-        elif (path_split[1] == 'u' and path_len == 5):
-            st.st_mode = stat.S_IFLNK | 0777
+        handler = getattr(self, '_getattr_' + node.kind, None)
+        if handler is not None:
+            return handler(node, st)
+        return st
+
+    def _getattr_subreddit(self, node, st):
+        # r/<subreddit>.sub only exists if subscribed, mkdir subscribes
+        if node.subreddit[-4:] == '.sub' and reddit.is_logged_in():
+            if node.subreddit[:-4].lower() not in get_subscriptions():
+                return -errno.ENOENT
+        return st
+
+    def _getattr_new_post(self, node, st):
+        # file to post a submission
+        st.st_mode = stat.S_IFREG | 0666
+        return st
+
+    def _getattr_stats(self, node, st):
+        st.st_size = len(render_stats())
+        return st
+
+    def _getattr_watch(self, node, st):
+        st.st_mode = stat.S_IFREG | 0666
+        st.st_size = len(render_watch())
+        return st
+
+    def _getattr_search_results(self, node, st):
+        if search_results(node) is None:
+            return -errno.ENOENT
+        return st
+
+    def _getattr_search_link(self, node, st):
+        # any result of any query, only what was indexed exists
+        if search_result(node.name) is None:
+            return -errno.ENOENT
+        return st
+
+    def _getattr_content(self, node, st):
+        if node.comment_ids:
+            # comment stuff
+            if node.name in ['reply', 'raw_content']:
+                st.st_mode = stat.S_IFREG | 0666
+            st.st_size = len(render(node.path))
             return st
+        # vote, etc - content stuff in submission
+        post = get_submission(node.post_id)
+        if node.name == 'reply':
+            st.st_mode = stat.S_IFREG | 0666
+        elif node.name == 'raw_content' and (post.selftext or post.url):
+            st.st_mode = stat.S_IFREG | 0666
+        if node.name in link_stuff:
+            # never download the file just to stat it
+            url = get_link_url(node.path)
+            st.st_size = 0
+            if url is not None:
+                st.st_size = link_fetcher.size(url) or 0
+        else:
+            st.st_size = len(render(node.path))
+        return st
 
+    @registry.timed('fuse.readlink')
     def readlink(self, path):
         """
         Symlinks are used to redirect some references to one thing to a single
         implementation.  The logic to dereference symlinks is here.
         """
-        numdots = len(path.split('/'))
-        dots = ''
-        if path.split('/')[-1:][0][-1:] == '_' and len(path.split('/')) >= 5:
-            #if this is a userlink
-            numdots -= 2
-            while (numdots > 0):
-                dots += '../'
-                numdots -= 1
-            return dots + 'u/' + path.split('/')[-1:][0][11:-1]
-        if path.split('/')[1] == 'u' and len(path.split('/')) == 5:
-            numdots -= 2
-            while (numdots > 0):
-                dots += '../'
-                numdots -= 1
-            comment_id = path.split(' ')[-1]
-            sub = str('http://www.reddit.com/comments/'+comment_id)
-            sub = reddit.get_submission(sub)
-            subname = str(sub.subreddit)
-            subid = str(sub.id)
-            return str(dots + 'r/' + subname + '/' + subid)
-
+        node = paths.parse(path)
+        handler = getattr(self, '_readlink_' + str(node.kind), None)
+        if handler is not None:
+            return handler(node)
+
+    def _readlink_more_link(self, node):
+        # a comment loaded through "load more", now in the parent
+        return '../' + node.name
+
+    def _readlink_userlink(self, node):
+        return '../' * (len(node.parts) - 2) + 'u/' + node.name[11:-1]
+
+    def _readlink_sort_link(self, node):
+        # sorted listing entry, points at the post directory
+        return '../' * (len(node.parts) - 4) + node.name
+
+    def _readlink_user_entry(self, node):
+        subname, subid = locate_user_entry(node.username, node.user_listing,
+                                           node.name)
+        return str('../' * (len(node.parts) - 2) + 'r/' + subname + '/' +
+                   subid)
+
+    def _readlink_search_link(self, node):
+        # a search result, points at the post or comment directory
+        path, _ = search_result(node.name)
+        return str('../' * (len(node.parts) - 2) + path)
+
+    @registry.timed('fuse.readdir')
     def readdir(self, path, offset):
         """
         Returns a list of directories in requested path
@@ -243,246 +311,334 @@ class redditvfs(fuse.Fuse):
         yield fuse.Direntry('.')
         yield fuse.Direntry('..')
 
-        # cut-off length on items with id to make things usable for end-user
-        pathmax = 50
-
-        path_split = path.split('/')
-        path_len = len(path_split)
-
-        if path == '/':
-            # top-level directory
-            yield fuse.Direntry('u')
-            yield fuse.Direntry('r')
-        elif path_split[1] == 'r':
-            if path_len == 2:
-                # if user is logged in, populate with get_my_subreddits
-                # otherwise, default to frontpage
-                if reddit.is_logged_in():
-                    for subreddit in reddit.get_my_subreddits():
-                        url_part = subreddit.url.split('/')[2]
-                        dirname = sanitize_filepath(url_part)
-                        yield fuse.Direntry(dirname)
-                else:
-                    for subreddit in reddit.get_popular_subreddits():
-                        url_part = subreddit.url.split('/')[2]
-                        dirname = sanitize_filepath(url_part)
-                        yield fuse.Direntry(dirname)
-            elif path_len == 3:
-                # posts in subreddits
-                subreddit = path_split[2]
-                for post in reddit.get_subreddit(subreddit).get_hot(limit=20):
-                    filename = sanitize_filepath(post.title[0:pathmax]
-                                                 + ' ' + post.id)
-                    yield fuse.Direntry(filename)
-                # write to this to create a new post
-                yield fuse.Direntry('post')
-            elif path_len == 4:
-                # a submission in a subreddit
-
-                post_id = path_split[3].split(' ')[-1]
-                post = reddit.get_submission(submission_id=post_id)
-
-                # vote, content, etc
-                for file in content_stuff:
-                    if file != 'thumbnail' and file != 'link_content':
-                        yield fuse.Direntry(file)
-                yield fuse.Direntry("_Posted_by_" + str(post.author) + "_")
-
-                if post.thumbnail != "" and post.thumbnail != 'self':
-                    # there is link content, maybe a thumbnail
-                    if post.thumbnail != 'default':
-                        yield fuse.Direntry('thumbnail')
-                    yield fuse.Direntry('link_content')
-
-                for comment in post.comments:
-                    if 'body' in dir(comment):
-                        yield fuse.Direntry(
-                            sanitize_filepath(comment.body[0:pathmax]
-                                              + ' ' + comment.id))
-            elif len(path.split('/')) > 4:
-                # a comment or a user
-
-                # Can't find a good way to get a comment from an id, but there
-                # is a good way to get a submission from the id and to walk
-                # down the tree, so doing that as a work-around.
-
-                comment = get_comment_obj(path)
-
-                for file in content_stuff:
-                    if file != 'thumbnail' and file != 'link_content':
-                        yield fuse.Direntry(file)
-                yield fuse.Direntry('_Posted_by_' + str(comment.author)+'_')
-
-                for reply in comment.replies:
-                    if 'body' in dir(reply):
-                        yield fuse.Direntry(
-                            sanitize_filepath(reply.body[0:pathmax]
-                                              + ' ' + reply.id))
-        elif path_split[1] == 'u':
-            if path_len == 2:
-                # if user is logged in, show the user.  Otherwise, this empty
-                # doesn't have any values listed.
-                if reddit.is_logged_in():
-                    yield fuse.Direntry(username)
-            if path_len == 3:
-                yield fuse.Direntry('Overview')
-                yield fuse.Direntry('Submitted')
-                yield fuse.Direntry('Comments')
-            if path_len == 4:
-                user = reddit.get_redditor(path_split[2])
-                if path_split[3] == 'Overview':
-                    for c in enumerate(user.get_overview(limit=10)):
-                        if type(c[1]) == praw.objects.Submission:
-                            c_part = c[1].title[0:pathmax] + ' ' + c[1].id
-                            yield fuse.Direntry(sanitize_filepath(c_part))
-                        if type(c[1]) == praw.objects.Comment:
-                            c_part = c[1].body[0:pathmax] + ' ' +\
-                                c[1].submission.id
-                            yield fuse.Direntry(sanitize_filepath(c_part))
-                elif path_split[3] == 'Submitted':
-                    for c in enumerate(user.get_submitted(limit=10)):
-                        c_part = c[1].title[0:pathmax] + ' ' + c[1].id
-                        yield fuse.Direntry(sanitize_filepath(c_part))
-                elif path_split[3] == 'Comments':
-                    for c in enumerate(user.get_comments(limit=10)):
-                        c_part = c[1].body[0:pathmax] + ' ' +\
-                            c[1].submission.id
-                        yield fuse.Direntry(sanitize_filepath(c_part))
+        node = paths.parse(path)
+        handler = getattr(self, '_readdir_' + str(node.kind), None)
+        if handler is not None:
+            for name in handler(node):
+                yield fuse.Direntry(name)
+
+    def _readdir_root(self, node):
+        # top-level directory
+        return ['u', 'r', 'search', '.stats', '.watch']
+
+    def _readdir_search_results(self, node):
+        # symlinks to what matches the query, newest first
+        for _, name in search_results(node) or []:
+            yield name
+
+    def _readdir_subreddits(self, node):
+        # if user is logged in, populate with get_my_subreddits
+        # otherwise, default to frontpage
+        if reddit.is_logged_in():
+            subreddits = reddit.get_my_subreddits()
+        else:
+            subreddits = reddit.get_popular_subreddits()
+        for subreddit in subreddits:
+            yield sanitize_filepath(subreddit)
+
+    def _readdir_subreddit(self, node):
+        # posts in subreddits
+        for filename, post_id in iter_subreddit(node.subreddit, 'hot'):
+            # the shell will stat the files inside each post next
+            prefetcher.submit(('submission', post_id),
+                              get_submission, post_id)
+            yield filename
+        # write to this to create a new post
+        yield 'post'
+        # the same posts under other sort orders
+        for sort in listing.SORTS:
+            yield sort
+
+    def _readdir_sort(self, node):
+        if node.sort == 'top' and node.period is None:
+            for period in listing.PERIODS:
+                yield period
+            return
+        if node.sort == 'top' and node.period not in listing.PERIODS:
+            return
+        # symlinks to the posts of a sorted listing
+        for filename, post_id in iter_subreddit(node.subreddit, node.sort,
+                                                node.period):
+            yield filename
+
+    def _readdir_submission(self, node):
+        # a submission in a subreddit
+        post_id = node.post_id
+        post = get_submission(post_id)
+
+        # vote, content, etc
+        for file in content_stuff:
+            if file != 'thumbnail' and file != 'link_content':
+                yield file
+        yield "_Posted_by_" + str(post.author) + "_"
+
+        if post.thumbnail and post.thumbnail != 'self':
+            # there is link content, maybe a thumbnail
+            for name in link_stuff:
+                url = get_link_url(node.path + '/' + name)
+                if url is not None:
+                    prefetcher.submit(('size', url), link_fetcher.size, url)
+            if post.thumbnail != 'default':
+                yield 'thumbnail'
+            yield 'link_content'
+
+        for comment in list(get_comments(post_id)):
+            if backend.is_comment(comment):
+                yield comment_name(comment)
+        if get_comment_index(post_id).has_more(post_id):
+            yield 'more_' + post_id
+
+    def _readdir_more(self, node):
+        # comments hidden behind "load more", fetched when listed
+        parent_id = node.name[5:]
+        expand_more(node.post_id, parent_id)
+        for comment in get_comment_index(node.post_id).expanded(parent_id):
+            yield comment_name(comment)
+
+    def _readdir_comment(self, node):
+        comment = get_comment_obj(node.path)
+
+        for file in content_stuff:
+            if file != 'thumbnail' and file != 'link_content':
+                yield file
+        yield '_Posted_by_' + str(comment.author) + '_'
+
+        for reply in list(comment.replies):
+            if backend.is_comment(reply):
+                yield comment_name(reply)
+        if get_comment_index(node.post_id).has_more(comment.id):
+            yield 'more_' + comment.id
+
+    def _readdir_users(self, node):
+        # if user is logged in, show the user.  Otherwise, this empty
+        # doesn't have any values listed.
+        if reddit.is_logged_in():
+            yield username
+
+    def _readdir_user(self, node):
+        return ['Overview', 'Submitted', 'Comments']
+
+    def _readdir_user_listing(self, node):
+        if node.user_listing is None:
+            return
+        for filename, post_id, subreddit in iter_user(node.username,
+                                                      node.user_listing):
+            yield filename
 
+    @registry.timed('fuse.read')
     def read(self, path, size, offset, fh=None):
         """
         Is used to get contents of posts, comments, etc from reddit to the end
         user.
         """
-        path_split = path.split('/')
-        path_len = len(path_split)
-
-        if path_split[1] == 'r' and path_len == 5:
-            # Get the post
-            post_id = path_split[3].split(' ')[-1]
-            post = reddit.get_submission(submission_id=post_id)
-
-            formatted = ''
-            if path_split[-1] == 'content':
-                formatted = format.format_sub_content(post)
-                formatted = formatted.encode('ascii', 'ignore')
-            elif path_split[-1] == 'votes':
-                formatted = str(post.score) + '\n'
-            elif path_split[-1] == 'flat':
-                formatted = format.format_submission(post)
-                formatted = formatted.encode('ascii', 'ignore')
-            elif (path_split[-1] == 'thumbnail' and post.thumbnail != '' and
-                    post.thumbnail != 'self' and post.thumbnail != 'default'):
-                f = urllib2.urlopen(post.thumbnail)
-                if f.getcode() == 200:
-                    formatted = f.read()
-            elif path_split[-1] == 'raw_content' and post.selftext:
-                formatted = post.selftext.encode('ascii', 'ignore')
-            elif path_split[-1] == 'raw_content' and post.url:
-                formatted = post.url.encode('ascii', 'ignore')
-            elif path_split[-1] == 'link_content' and post.url:
-                f = urllib2.urlopen(post.url)
-                if f.getcode() == 200:
-                    formatted = f.read()
-            return formatted[offset:offset+size]
-        elif path_split[1] == 'r' and path_len > 5:
-            # Get the comment
-            post = get_comment_obj(path)
-            if path_split[-1] == 'content':
-                formatted = format.format_comment(post, recursive=False)
-                formatted = formatted.encode('ascii', 'ignore')
-            elif path_split[-1] == 'votes':
-                formatted = str(post.score) + '\n'
-            elif path_split[-1] == 'flat':
-                formatted = format.format_comment(post, recursive=True)
-                formatted = formatted.encode('ascii', 'ignore')
-            elif path_split[-1] == 'raw_content':
-                formatted = post.body.encode('ascii', 'ignore')
-            return formatted[offset:offset+size]
-
-        return -errno.ENOSYS
+        if isinstance(fh, RenderedFile) and fh.data is not None:
+            # rendered once when the file was opened
+            return fh.data[offset:offset+size]
+
+        node = paths.parse(path)
+        if node.kind == paths.STATS:
+            return render_stats()[offset:offset+size]
+        if node.kind == paths.WATCH:
+            return render_watch()[offset:offset+size]
+        if node.kind != paths.CONTENT:
+            return -errno.ENOSYS
+
+        if node.name in link_stuff and not node.comment_ids:
+            url = get_link_url(path)
+            if url is None:
+                return ''
+            return link_fetcher.read(url, size, offset)
+
+        return render(path)[offset:offset+size]
+
+    @registry.timed('fuse.open')
+    def open(self, path, flags):
+        """
+        Content files opened for reading are rendered once here and the
+        buffer is kept on the file handle until release().
+        """
+        node = paths.parse(path)
+        if node.kind == paths.STATS:
+            if (flags & accmode) != os.O_RDONLY:
+                return -errno.EACCES
+            # a snapshot, which grows past the size getattr gave
+            return RenderedFile(render_stats(), direct_io=True)
+        if node.kind == paths.WATCH:
+            if (flags & accmode) == os.O_RDONLY:
+                return RenderedFile(render_watch(), direct_io=True)
+            return WriteFile()
+        if (flags & accmode) != os.O_RDONLY:
+            if node.kind == paths.NEW_POST or (node.kind == paths.CONTENT and
+                                               node.name in written_stuff):
+                if not reddit.is_logged_in():
+                    return -errno.EACCES
+                return WriteFile()
+            return
+        if node.kind != paths.CONTENT:
+            return
+        if node.name in link_stuff:
+            url = get_link_url(path)
+            if url is not None and link_fetcher.size(url) is None:
+                # size unknown until downloaded, read until EOF instead
+                return LinkFile(direct_io=True)
+            # a url's content is stored once and never changes
+            return LinkFile(keep_cache=keep_cache)
+        if watcher.is_watched(watch_key(node)):
+            # rendered by every read, as the thread changes while it is
+            # open, e.g. under tail -f
+            return RenderedFile(None, direct_io=True)
+        data = render(path)
+        revision = content_revision(node)
+        # the pages the kernel holds are good if nothing changed since the
+        # last open; otherwise not keeping them is what invalidates them
+        opened = object_cache.get('opened', path)
+        object_cache.put('opened', path, revision)
+        return RenderedFile(data, keep_cache=keep_cache and
+                            revision is not None and opened == revision)
+
+    @registry.timed('fuse.flush')
+    def flush(self, path, fh=None):
+        """
+        Sends what was written to a file since the last flush, as one
+        operation.
+        """
+        if isinstance(fh, WriteFile):
+            return self._commit(path, fh)
+        return 0
+
+    @registry.timed('fuse.release')
+    def release(self, path, flags, fh=None):
+        """
+        Drops the buffer held by an open content file, sending what is left
+        of one opened for writing.
+        """
+        if isinstance(fh, RenderedFile):
+            fh.data = None
+        elif isinstance(fh, WriteFile):
+            result = self._commit(path, fh)
+            fh.buffer = None
+            return result
+        return 0
+
+    def _commit(self, path, fh):
+        if not fh.dirty:
+            return 0
+        fh.dirty = False
+        node = paths.parse(path)
+        handler = getattr(self, '_write_' + str(node.kind), None)
+        if handler is None:
+            return 0
+        return min(handler(node, str(fh.buffer)), 0)
 
+    @registry.timed('fuse.truncate')
     def truncate(self, path, len):
         """
-        there is no situation where this will actually be used
+        files opened for writing start out empty, so there is nothing to
+        truncate by path
         """
         pass
 
+    @registry.timed('fuse.ftruncate')
+    def ftruncate(self, path, len, fh=None):
+        if isinstance(fh, WriteFile):
+            fh.truncate(len)
+
+    @registry.timed('fuse.write')
     def write(self, path, buf, offset, fh=None):
         """
-        Handles voting, content creation, and management. Requires login
+        Handles voting, content creation, and management. Requires login.
+        Writes to an open file are gathered on its handle until it is
+        flushed.
         """
+        if isinstance(fh, WriteFile):
+            # opening it checked the login
+            fh.write(buf, offset)
+            return len(buf)
+
         if not reddit.is_logged_in():
             return errno.EACCES
 
-        path_split = path.split('/')
-        path_len = len(path_split)
-
-        # Voting
-        if path_split[1] == 'r' and path_len >= 5 and\
-                path_split[-1] == 'votes':
-            # Get the post or comment
-            if path_len > 5:
-                post = get_comment_obj(path)
-            else:
-                post_id = path_split[-2].split(' ')[-1]
-                post = reddit.get_submission(submission_id=post_id)
-
-            # Determine what type of vote and place the vote
-            vote = int(buf)
-            if vote == 0:
-                post.clear_vote()
-            elif vote > 0:
-                post.upvote()
-            elif vote < 0:
-                post.downvote()
-            return len(buf)
+        node = paths.parse(path)
+        handler = getattr(self, '_write_' + str(node.kind), None)
+        if handler is not None:
+            return handler(node, buf)
 
-        # Reply to submission
-        if path_split[1] == 'r' and path_len == 5 and\
-                path_split[-1] == 'reply':
-            post_id = path_split[-2].split(' ')[-1]
-            post = reddit.get_submission(submission_id=post_id)
-            post.add_comment(buf)
-            return len(buf)
+        # fake success for editor's backup files
+        return len(buf)
 
-        # Reply to comments
-        if path_split[1] == 'r' and path_len > 5 and\
-                path_split[-1] == 'reply':
-            post = get_comment_obj(path)
-            post.reply(buf)
+    def _write_content(self, node, buf):
+        if node.name not in written_stuff:
+            # fake success for editor's backup files
             return len(buf)
+        # Get the post or comment
+        thing = get_thing(node)
+        if thing.id.startswith('unsent'):
+            # a reply that isn't posted yet
+            return -errno.EAGAIN
+        if node.name == 'votes':
+            # Determine what type of vote and place the vote
+            try:
+                direction = cmp(int(buf), 0)
+            except ValueError:
+                return -errno.EINVAL
+            thing = apply_vote(node, thing, direction)
+            write_behind.submit(('vote', thing.fullname), reddit.vote,
+                                (thing, direction),
+                                sent(node.post_id, False))
+        elif node.name == 'reply':
+            # Reply to submission or comment
+            apply_reply(node, thing, buf)
+            write_behind.submit(None, reddit.reply, (thing, buf),
+                                sent(node.post_id, True))
+        else:
+            # Edit a post or comment
+            thing = apply_edit(node, thing, buf)
+            index_thread(get_submission(node.post_id),
+                         get_comment_index(node.post_id), [thing])
+            write_behind.submit(('edit', thing.fullname), reddit.edit,
+                                (thing, buf), sent(node.post_id, False))
+        object_cache.bump('submission', node.post_id)
+        return len(buf)
 
+    def _write_new_post(self, node, buf):
         # Write a new post
-        if path_split[1] == 'r' and path_len == 4 and\
-                path_split[-1] == 'post':
-            buf_split = buf.split('\n')
-            title = buf_split[0]
-            if len(buf_split) > 2:
-                # Self-post
-                text = '\n'.join(buf_split[1:])
-                reddit.submit(subreddit=path_split[2], title=title, text=text)
-            else:
-                # Link
-                reddit.submit(subreddit=path_split[2], title=title,
-                              url=buf_split[1])
-            return len(buf)
+        buf_split = buf.split('\n')
+        title = buf_split[0]
+        if len(buf_split) > 2:
+            # Self-post
+            text = '\n'.join(buf_split[1:])
+            write_behind.submit(None, reddit.submit,
+                                (node.subreddit, title, text))
+        elif len(buf_split) == 2:
+            # Link
+            write_behind.submit(None, reddit.submit,
+                                (node.subreddit, title, None, buf_split[1]))
+        else:
+            return -errno.EINVAL
+        return len(buf)
 
-        # Edit a post or comment
-        if path_split[1] == 'r' and path_len >= 5 and\
-                path_split[-1] == 'raw_content':
-            # Get the post or comment
-            if path_len > 5:
-                post = get_comment_obj(path)
-            else:
-                post_id = path_split[-2].split(' ')[-1]
-                post = reddit.get_submission(submission_id=post_id)
-            post.edit(buf)
-            return len(buf)
+    def fsdestroy(self):
+        """
+        Gives writes still queued a chance to be sent, and cache entries a
+        chance to reach the disk, before unmounting.
+        """
+        write_behind.drain(DRAIN_TIMEOUT)
+        if object_cache.store is not None:
+            object_cache.store.flush(DRAIN_TIMEOUT)
 
-        # fake success for editor's backup files
+    def _write_watch(self, node, buf):
+        if not update_watches(buf.splitlines()):
+            return -errno.EINVAL
         return len(buf)
 
+    def fsinit(self):
+        """
+        Starts polling watched subreddits and threads, now that FUSE has
+        daemonized.
+        """
+        watcher.start()
+
+    @registry.timed('fuse.create')
     def create(self, path, flags, mode):
         """
         No part of the redditvfs API actually utilizes create() - it is always
@@ -490,6 +646,7 @@ class redditvfs(fuse.Fuse):
         """
         return errno.EPERM
 
+    @registry.timed('fuse.unlink')
     def unlink(self, path):
         """
         Handle deleting posts and comments
@@ -497,21 +654,56 @@ class redditvfs(fuse.Fuse):
         if not reddit.is_logged_in():
             return errno.EACCES
 
-        path_split = path.split('/')
-        path_len = len(path_split)
-
-        if path_split[1] == 'r' and path_len >= 5 and\
-                path_split[-1] == 'raw_content':
-            if path_len > 5:
-                post = get_comment_obj(path)
-            else:
-                post_id = path_split[-2].split(' ')[-1]
-                post = reddit.get_submission(submission_id=post_id)
-            post.delete()
+        node = paths.parse(path)
+        if node.kind == paths.CONTENT and node.name == 'raw_content':
+            reddit.delete(get_thing(node))
+            invalidate_post(node.post_id)
             return 0
         return errno.EPERM
 
 
+class RenderedFile(object):
+    """
+    An open content file.  Holds the rendered bytes (or the FlatFile) for as
+    long as the file stays open, so chunked reads are answered from it.
+    """
+    def __init__(self, data, keep_cache=False, direct_io=False):
+        self.data = data
+        self.keep_cache = keep_cache
+        self.direct_io = direct_io
+
+
+class LinkFile(object):
+    """
+    An open thumbnail or link_content file.  Reads go straight to the
+    link fetcher; direct_io is set when the remote size is unknown.
+    """
+    def __init__(self, direct_io=False, keep_cache=False):
+        self.direct_io = direct_io
+        self.keep_cache = keep_cache
+
+
+class WriteFile(object):
+    """
+    A votes, reply, raw_content or post file opened for writing.  Editors
+    write in chunks, so they are put together here and sent as one
+    operation when the file is flushed or released.
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+        self.dirty = False
+
+    def write(self, buf, offset):
+        if offset > len(self.buffer):
+            self.buffer.extend('\0' * (offset - len(self.buffer)))
+        self.buffer[offset:offset + len(buf)] = buf
+        self.dirty = True
+
+    def truncate(self, length):
+        del self.buffer[length:]
+        self.dirty = True
+
+
 def sanitize_filepath(path):
     """
     Converts provided path to legal UNIX filepaths.
@@ -524,36 +716,790 @@ def sanitize_filepath(path):
     return path
 
 
-def get_comment_obj(path):
+def iter_listing(key, fetch, entry):
     """
-    given a filesystem path, returns a praw comment object
-    """
-    # Can't find a good way to get a comment from an id, but there
-    # is a good way to get a submission from the id and to walk
-    # down the tree, so doing that as a work-around.
-    path_split = path.split('/')
-    path_len = len(path_split)
-    post_id = path_split[3].split(' ')[-1]
-    post = reddit.get_submission(submission_id=post_id)
-    # quick error check
-    if len(post.comments) == 0:
-        return -errno.ENOENT
-    for comment in post.comments:
-        if comment.id == path_split[4].split(' ')[-1]:
-            break
-    level = 4
-    if path_split[-1] in content_stuff:
-        adjust = 2
-    else:
-        adjust = 1
-    while level < path_len - adjust:
-        level += 1
-        for comment in comment.replies:
-            if comment.id == path_split[level].split(' ')[-1]:
+    yields the entries of a paginated listing, up to listing_depth of them
+    """
+    for item in listing.iter_listing(object_cache, key, fetch, entry,
+                                     depth=listing_depth or None):
+        yield item
+
+
+def iter_subreddit(subreddit, sort, period=None):
+    """
+    yields (filename, post id) for the posts of a subreddit listing
+    """
+    if sort != 'top':
+        period = None
+
+    def fetch(after, limit):
+        return reddit.get_listing(subreddit, sort, period, after, limit)
+
+    for item in iter_listing(('r', subreddit.lower(), sort, period), fetch,
+                             listed_entry):
+        yield item
+
+
+def iter_user(username, kind):
+    """
+    yields (filename, post id, subreddit) for the things of one of a user's
+    listings; subreddit is None if the listing didn't say
+    """
+    def fetch(after, limit):
+        return reddit.get_user_listing(username, kind, after, limit)
+
+    for item in iter_listing(('u', username.lower(), kind), fetch,
+                             user_entry):
+        yield item
+
+
+def get_subscriptions():
+    """
+    returns the lowercased names of the subreddits the user is subscribed
+    to, as a set, fetched at most once per subscriptions ttl
+    """
+    subscriptions = object_cache.get('subscriptions', None)
+    if subscriptions is None:
+        subscriptions = set(subreddit.lower() for subreddit in
+                            reddit.get_my_subreddits())
+        object_cache.put('subscriptions', None, subscriptions)
+    return subscriptions
+
+
+def set_subscribed(subreddit, subscribed):
+    """
+    records our own subscribe or unsubscribe in the cached subscriptions,
+    and forgets that r/<subreddit>.sub was missing
+    """
+    subscriptions = object_cache.get('subscriptions', None)
+    if subscriptions is not None:
+        if subscribed:
+            subscriptions.add(subreddit.lower())
+        else:
+            subscriptions.discard(subreddit.lower())
+    object_cache.invalidate('missing', '/r/' + subreddit + '.sub')
+
+
+def post_entry(post):
+    """
+    returns (filename, post id) for a submission in a listing, noting its
+    mtime for getattr on the way
+    """
+    object_cache.put('mtime', post.id, thing_mtime(post))
+    filename = sanitize_filepath(post.title[0:pathmax] + ' ' + post.id)
+    return (filename, post.id)
+
+
+def listed_entry(post):
+    """
+    returns post_entry(post) for a submission fetched in a subreddit
+    listing, adding it to the search index on the way
+    """
+    index_post(post)
+    return post_entry(post)
+
+
+def user_entry(thing):
+    """
+    returns (filename, post id, subreddit) for a submission or comment in a
+    user listing; comments are named after their body but link to their
+    post
+    """
+    subreddit = thing.subreddit
+    if backend.is_comment(thing):
+        post_id = thing.link_id.split('_')[-1]
+        return (sanitize_filepath(thing.body[0:pathmax] + ' ' + post_id),
+                post_id, subreddit)
+    return post_entry(thing) + (subreddit,)
+
+
+def locate_user_entry(username, kind, filename):
+    """
+    returns (subreddit, post id) for the entry filename of a user listing,
+    from what was recorded when it was listed.  Subreddits the listing
+    didn't give are looked up for all of its entries with one by-id request.
+    """
+    entries = []
+    if kind is not None:
+        entries = list(iter_user(username, kind))
+    post_id = filename.split(' ')[-1]
+    subreddits = dict((name, (entry_id, subreddit))
+                      for name, entry_id, subreddit in entries)
+    if filename in subreddits:
+        post_id, subreddit = subreddits[filename]
+        if subreddit is not None:
+            return (subreddit, post_id)
+    if object_cache.get('location', post_id) is None:
+        missing = set([post_id])
+        for _, entry_id, subreddit in entries:
+            if subreddit is None and \
+                    object_cache.get('location', entry_id) is None:
+                missing.add(entry_id)
+        for post in reddit.get_by_id(sorted(missing)):
+            object_cache.put('location', post.id, str(post.subreddit))
+    subreddit = object_cache.get('location', post_id)
+    if subreddit is None:
+        raise IOError(errno.ENOENT, 'No such submission', post_id)
+    return (subreddit, post_id)
+
+
+def comment_name(comment):
+    """
+    returns the directory name of a comment
+    """
+    return sanitize_filepath(comment.body[0:pathmax] + ' ' + comment.id)
+
+
+def author_name(thing):
+    """
+    returns the name of the author of thing, or None if it was deleted
+    """
+    if not thing.author:
+        return None
+    return str(thing.author)
+
+
+def index_post(post):
+    """
+    adds a submission, its title and text, to the search index
+    """
+    text = post.title
+    if post.selftext:
+        text += '\n' + post.selftext
+    subreddit = str(post.subreddit)
+    search_index.add(post.fullname, 'r/%s/%s' % (subreddit, post.id),
+                     post_entry(post)[0], subreddit, author_name(post),
+                     post.created, text)
+
+
+def index_thread(post, index, things):
+    """
+    adds things of a thread, its submission or comments in index, to the
+    search index, under their place in the mount.  The path of every
+    comment above them is worked out once.
+    """
+    subreddit = str(post.subreddit)
+    # comment id -> path in the mount
+    known = {post.id: 'r/%s/%s' % (subreddit, post.id)}
+    for thing in things:
+        if thing is post:
+            index_post(post)
+            continue
+        above = []
+        thing_id = thing.id
+        while thing_id not in known:
+            entry = index.get(thing_id)
+            if entry is None:
+                # not spliced into the forest
                 break
+            above.append(thing_id)
+            thing_id = entry[1]
+        else:
+            path = known[thing_id]
+            for comment_id in reversed(above):
+                path = known[comment_id] = path + '/' + comment_id
+            search_index.add(thing.fullname, path, comment_name(thing),
+                             subreddit, author_name(thing), thing.created,
+                             thing.body)
+
+
+def index_forest(post, index):
+    """
+    queues a whole thread for the search index, so that fetching it doesn't
+    wait on indexing.  Queued threads are indexed by a prefetch worker, if
+    there are any, or before the next search.
+    """
+    with search_lock:
+        search_backlog.pop(post.id, None)
+        search_backlog[post.id] = (post, index)
+        overflow = len(search_backlog) > SEARCH_BACKLOG
+    prefetcher.submit(('search',), catch_up_search)
+    if overflow:
+        # nobody searches and nothing indexes in the background, don't
+        # hold on to every thread ever read
+        catch_up_search(len(search_backlog) - SEARCH_BACKLOG)
+
+
+def catch_up_search(count=None):
+    """
+    indexes the oldest count threads queued by index_forest, all if None
+    """
+    while count is None or count > 0:
+        with search_lock:
+            if not search_backlog:
+                return
+            _, (post, index) = search_backlog.popitem(last=False)
+        index_thread(post, index, [post] + list(index))
+        if count is not None:
+            count -= 1
+
+
+def search_results(node):
+    """
+    returns the (path, name) results of a search/<query> path, or None if
+    the query is invalid
+    """
+    catch_up_search()
+    return search_index.search(node.query.decode('utf-8', 'replace'))
+
+
+def search_result(name):
+    """
+    returns (path, name) of the search result called name, or None
+    """
+    catch_up_search()
+    return search_index.get(name.split(' ')[-1])
+
+
+def get_mtime(node):
+    """
+    returns a stable mtime for a node: when the comment or post it is in
+    was created or last edited, or when the listing it is in was fetched.
+    Expired entries are only peeked at, and left for get_submission to sync
+    or refetch.  A thread is only fetched for it if no listing it appeared
+    in said when its post was created, so that the mtime doesn't change
+    between the first stat and the next.
+    """
+    if node.username is not None:
+        if node.user_listing is None:
+            return mount_time
+        return listing_mtime(('u', node.username.lower(), node.user_listing))
+    if node.subreddit is None:
+        return mount_time
+    subreddit = node.subreddit.lower()
+    if node.sort is not None:
+        return listing_mtime(('r', subreddit, node.sort, node.period))
+    # watched things change when the watcher last saw them change
+    changed = watcher.changed(watch_key(node))
+    if changed is not None:
+        return int(changed)
+    if node.post_id is None or not node.post_id.isalnum():
+        return listing_mtime(('r', subreddit, 'hot', None))
+    post = object_cache.peek('submission', node.post_id)
+    if post is None and not node.comment_ids:
+        listed = object_cache.peek('mtime', node.post_id)
+        if listed is not None:
+            return listed
+    if post is None:
+        post = get_submission(node.post_id)
+    index = None
+    if node.comment_ids:
+        index = object_cache.peek('index', node.post_id)
+        if index is None or index.comments is not post.comments:
+            index = get_comment_index(node.post_id)
+    for comment_id in reversed(node.comment_ids):
+        entry = index.get(comment_id)
+        if entry is not None:
+            return thing_mtime(entry[0])
+    return thing_mtime(post)
+
+
+def listing_mtime(key):
+    """
+    returns when the first page of a listing was fetched
+    """
+    fetched = object_cache.fetched('page', (key, None))
+    if fetched is None:
+        return mount_time
+    return int(fetched)
+
+
+def thing_mtime(thing):
+    """
+    returns when a submission or comment was last edited, or created
+    """
+    edited = thing.edited
+    # very old things have edited set to True instead of a time
+    if edited and edited is not True:
+        return int(edited)
+    return int(thing.created)
+
+
+def get_submission(post_id):
+    """
+    returns the submission post_id, fetching it only if the cached
+    copy is missing or stale.  With incremental refresh, a stale copy is
+    synced instead when it can be.
+    """
+    fetched = object_cache.fetched('submission', post_id)
+    if (incremental_refresh and fetched is not None and
+            time.time() - fetched > object_cache.ttls['submission']):
+        post = sync_submission(post_id)
+        if post is not None:
+            return post
+    post = object_cache.get('submission', post_id)
+    if post is None:
+        post = fetch_submission(post_id)
+    return post
+
+
+def sync_submission(post_id):
+    """
+    splices the comments posted since a cached thread was fetched or last
+    synced into it, from the newest comments of its subreddit, and marks it
+    fresh.  Returns the thread, or None if it must be refetched: when it
+    isn't cached, is due for a full refresh, or more comments were posted
+    than the sync can see.
+    """
+    post = object_cache.peek('submission', post_id)
+    if post is None:
+        return None
+    index = object_cache.peek('index', post_id)
+    if index is None or index.comments is not post.comments:
+        index = new_comment_index(post_id, post)
+    if time.time() - index.built > FULL_REFRESH_INTERVAL:
+        return None
+    since = max(index.newest, post.created)
+    comments = reddit.get_new_comments(str(post.subreddit), since,
+                                       SYNC_LIMIT)
+    if len(comments) >= SYNC_LIMIT:
+        # the listing doesn't reach back to the last comment seen
+        registry.count('sync.overrun')
+        return None
+    link_id = 't3_' + post_id
+    comments = [comment for comment in reversed(comments)
+                if comment.link_id == link_id]
+    added = index.add_new(comments)
+    index_thread(post, index, comments)
+    registry.count('sync.comments', added)
+    object_cache.touch('submission', post_id)
+    object_cache.touch('index', post_id)
+    return post
+
+
+def fetch_submission(post_id):
+    """
+    fetches post_id with its comment forest and caches it
+    """
+    post = reddit.get_submission(post_id)
+    weight = 1 + (post.num_comments or 0)
+    object_cache.put('submission', post_id, post, weight=weight)
+    new_comment_index(post_id, post)
+    if more_budget > 0:
+        prefetcher.submit(('more', post_id), expand_thread, post_id,
+                          more_budget)
+    return post
+
+
+def revalidate(kind, key):
+    """
+    queues a refresh of a stale entry served from the persistent cache
+    """
+    if kind != 'submission':
+        return False
+    prefetcher.submit(('refresh', key), refresh_submission, key)
+    return prefetcher.workers > 0
+
+
+def refresh_submission(post_id):
+    """
+    syncs or, failing that, refetches a stale thread
+    """
+    if not incremental_refresh or sync_submission(post_id) is None:
+        fetch_submission(post_id)
+
+
+def get_comments(post_id):
+    """
+    returns the top-level comment forest of post_id
+    """
+    return get_submission(post_id).comments
+
+
+def new_comment_index(post_id, post):
+    """
+    builds and caches the comment id index of a fetched or loaded thread,
+    and adds the thread to the search index
+    """
+    index = forest.CommentIndex(post_id, post.comments)
+    object_cache.put('index', post_id, index)
+    index_forest(post, index)
+    return index
+
+
+def get_comment_index(post_id):
+    """
+    returns the comment id index of post_id
+    """
+    post = get_submission(post_id)
+    index = object_cache.get('index', post_id)
+    if index is None or index.comments is not post.comments:
+        # the submission was refetched or loaded from disk
+        index = new_comment_index(post_id, post)
+    return index
+
+
+def expand_more(post_id, parent_id):
+    """
+    fetches the MoreComments below parent_id, if it wasn't yet, and splices
+    the comments into the cached forest
+    """
+    index = get_comment_index(post_id)
+    more = index.take_more(parent_id)
+    if more is None:
+        return
+    try:
+        comments = reddit.expand_more(more)
+    except Exception:
+        index.put_back_more(parent_id, more)
+        raise
+    index.merge(parent_id, more, comments)
+    index_thread(get_submission(post_id), index,
+                 [comment for comment in comments
+                  if backend.is_comment(comment)])
+    # rendered files of the post are stale now
+    object_cache.bump('submission', post_id)
+
+
+def expand_thread(post_id, budget):
+    """
+    expands up to budget MoreComments of post_id, breadth-first
+    """
+    for _ in range(budget):
+        pending = get_comment_index(post_id).pending_more()
+        if not pending:
+            return
+        expand_more(post_id, pending[0])
+
+
+def invalidate_post(post_id):
+    """
+    drops everything cached about post_id, used after we change it ourselves
+    """
+    object_cache.invalidate('submission', post_id)
+    object_cache.invalidate('index', post_id)
+
+
+def apply_vote(node, thing, direction):
+    """
+    caches a copy of thing with the score the vote being sent will give it,
+    and returns the copy
+    """
+    previous = {True: 1, False: -1}.get(thing.likes, 0)
+    ups, downs = thing.ups, thing.downs
+    if previous > 0:
+        ups -= 1
+    elif previous < 0:
+        downs -= 1
+    if direction > 0:
+        ups += 1
+    elif direction < 0:
+        downs += 1
+    return replace_thing(node, thing.copy(
+        score=thing.score + direction - previous, ups=ups, downs=downs,
+        likes={1: True, -1: False}.get(direction)))
+
+
+def apply_reply(node, thing, text):
+    """
+    adds the reply being sent to the cached thread, until it is refetched
+    with the real one
+    """
+    parent_id = node.post_id
+    if node.comment_ids:
+        parent_id = thing.id
+    reply = model.Comment(
+        id='unsent%d' % next(unsent_ids), parent_id=thing.fullname,
+        link_id='t3_' + node.post_id, body=text.decode('utf-8', 'replace'),
+        author=username, created=time.time(), edited=False, score=1, ups=1,
+        downs=0, replies=[])
+    get_comment_index(node.post_id).add(parent_id, reply)
+
+
+def apply_edit(node, thing, text):
+    """
+    caches a copy of thing with the text of the edit being sent, and
+    returns the copy
+    """
+    text = text.decode('utf-8', 'replace')
+    if backend.is_comment(thing):
+        thing = thing.copy(body=text, edited=time.time())
+    else:
+        thing = thing.copy(selftext=text, edited=time.time())
+    return replace_thing(node, thing)
+
+
+def replace_thing(node, thing):
+    """
+    puts a changed copy of the submission or comment of node in its place
+    in the cache and returns it.  Cached things are never changed in place,
+    as an open flat file renders from the ones it was sized with.
+    """
+    if node.comment_ids:
+        get_comment_index(node.post_id).replace(thing)
+    else:
+        object_cache.bump('submission', node.post_id, thing)
+    return thing
+
+
+def sent(post_id, refetch):
+    """
+    returns the callback of an operation on post_id.  What was applied to
+    the cache is dropped if sending failed, or if the thread needs
+    refetching anyway.
+    """
+    def done(error):
+        if error is not None or refetch:
+            invalidate_post(post_id)
+    return done
+
+
+def content_revision(node):
+    """
+    returns the revision a content file is rendered at.  A flat file also
+    shows the comments below its post or comment, so syncs adding some
+    there change its revision, and only its.
+    """
+    revision = object_cache.revision('submission', node.post_id)
+    if revision is None or node.name != 'flat':
+        return revision
+    thing_id = node.post_id
+    if node.comment_ids:
+        thing_id = node.comment_ids[-1]
+    return (revision, get_comment_index(node.post_id).stamp(thing_id))
+
+
+def render(path):
+    """
+    returns the encoded contents of the content file at path, formatting it
+    only if the object behind it changed since the last rendering
+    """
+    node = paths.parse(path)
+    post = get_thing(node)
+    revision = content_revision(node)
+    if node.name == 'flat':
+        return render_flat(path, post, revision)
+    formatted = render_cache.get(path, revision)
+    if formatted is None:
+        start = time.time()
+        if node.comment_ids:
+            formatted = format_comment_file(post, node.name)
+        else:
+            formatted = format_submission_file(post, node.name)
+        registry.observe('format.' + node.name, time.time() - start)
+        if revision is not None:
+            render_cache.put(path, revision, formatted)
+    return formatted
+
+
+def render_flat(path, post, revision):
+    """
+    returns the flat file of a submission or comment as a format.FlatFile.
+    Only the offset of each comment is kept, reads format just the comments
+    they cover, so a huge thread never sits in memory as one string.
+    """
+    cached = object_cache.get('flat', path)
+    if cached is not None and cached[0] == revision:
+        return cached[1]
+    start = time.time()
+    if paths.parse(path).comment_ids:
+        flat = format.FlatFile(format.iter_comment_pieces(post))
+    else:
+        flat = format.FlatFile(format.iter_submission_pieces(post))
+    registry.observe('format.flat', time.time() - start)
+    if revision is not None:
+        object_cache.put('flat', path, (revision, flat),
+                         weight=len(flat.pieces))
+    return flat
+
+
+def format_submission_file(post, name):
+    """
+    returns the encoded contents of the content file name of a submission
+    """
+    formatted = ''
+    if name == 'content':
+        formatted = format.format_sub_content(post)
+        formatted = formatted.encode('ascii', 'ignore')
+    elif name == 'votes':
+        formatted = str(post.score) + '\n'
+    elif name == 'raw_content' and post.selftext:
+        formatted = post.selftext.encode('ascii', 'ignore')
+    elif name == 'raw_content' and post.url:
+        formatted = post.url.encode('ascii', 'ignore')
+    return formatted
+
+
+def get_link_url(path):
+    """
+    returns the remote url behind a thumbnail or link_content file, or None
+    """
+    node = paths.parse(path)
+    if node.kind != paths.CONTENT or node.comment_ids:
+        return None
+    post = get_submission(node.post_id)
+    if (node.name == 'thumbnail' and post.thumbnail
+            and post.thumbnail != 'self'
+            and post.thumbnail != 'default'):
+        return post.thumbnail
+    if node.name == 'link_content' and post.url:
+        return post.url
+    return None
+
+
+def format_comment_file(comment, name):
+    """
+    returns the encoded contents of the content file name of a comment
+    """
+    formatted = ''
+    if name == 'content':
+        formatted = format.format_comment(comment, recursive=False)
+        formatted = formatted.encode('ascii', 'ignore')
+    elif name == 'votes':
+        formatted = str(comment.score) + '\n'
+    elif name == 'raw_content':
+        formatted = comment.body.encode('ascii', 'ignore')
+    return formatted
+
+
+def get_comment_obj(path):
+    """
+    given a filesystem path, returns the comment object.  Raises ENOENT if
+    the path doesn't name a comment of the submission.
+    """
+    node = paths.parse(path)
+    comment = get_comment_index(node.post_id).resolve(node.comment_ids)
+    if comment is None:
+        raise IOError(errno.ENOENT, 'No such comment', path)
     return comment
 
 
+def get_thing(node):
+    """
+    returns the comment a node is in or, above the comments, its submission
+    """
+    if node.comment_ids:
+        return get_comment_obj(node.path)
+    return get_submission(node.post_id)
+
+
+def watch_key(node):
+    """
+    returns the key a node is watched under: r/<subreddit>/<post id> in a
+    thread, r/<subreddit> for a subreddit directory, None elsewhere
+    """
+    if node.subreddit is None or node.sort is not None or \
+            node.kind == paths.NEW_POST:
+        return None
+    if node.post_id is not None:
+        return 'r/%s/%s' % (node.subreddit.lower(), node.post_id)
+    return 'r/' + node.subreddit.lower()
+
+
+def update_watches(lines):
+    """
+    starts watching the subreddit or thread of each line, as
+    r/<subreddit>[/<post>], or stops with a "-" in front; returns False if
+    a line names neither
+    """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        key = watch_key(paths.parse('/' + line.lstrip('-').strip('/')))
+        if key is None:
+            return False
+        parts = key.split('/')
+        if line[0] == '-':
+            watcher.unwatch(key)
+        elif len(parts) == 2:
+            watcher.watch(key, lambda name=parts[1]: poll_subreddit(name))
+        else:
+            watcher.watch(key, lambda post_id=parts[2]: poll_thread(post_id))
+    return True
+
+
+def poll_subreddit(subreddit):
+    """
+    refetches the start of a subreddit's listing, returning the ids listed
+    """
+    object_cache.invalidate('page', (('r', subreddit, 'hot', None), None))
+    return [post_id for _, post_id in iter_subreddit(subreddit, 'hot')]
+
+
+def poll_thread(post_id):
+    """
+    syncs or refetches a thread, returning what shows when it changed
+    """
+    refresh_submission(post_id)
+    post = get_submission(post_id)
+    return (len(get_comment_index(post_id)), thing_mtime(post), post.score)
+
+
+def watch_changed(key, old, new):
+    """
+    counts what the watcher found new in a subreddit or thread
+    """
+    if key.count('/') == 1:
+        registry.count('watch.new_posts', len(set(new) - set(old)))
+    else:
+        registry.count('watch.new_comments', max(0, new[0] - old[0]))
+
+
+def render_watch():
+    """
+    returns the contents of /.watch, a line per watched key
+    """
+    return ''.join(key + '\n' for key in watcher.watched())
+
+
+def render_stats():
+    """
+    returns a JSON snapshot of the registry
+    """
+    return json.dumps(registry.snapshot(), indent=1, sort_keys=True) + '\n'
+
+
+def dump_stats(signum, frame):
+    """
+    SIGUSR1 handler, writes a snapshot to stats_file or stderr
+    """
+    if stats_file is None:
+        sys.stderr.write(render_stats())
+        return
+    with open(stats_file, 'w') as f:
+        f.write(render_stats())
+
+
+def cache_stats(cache):
+    """
+    returns the hit counts of an ObjectCache or RenderCache
+    """
+    lookups = cache.hits + cache.misses
+    return {'hits': cache.hits, 'misses': cache.misses,
+            'hit_ratio': float(cache.hits) / lookups if lookups else None}
+
+
+def client_stats(name):
+    """
+    returns a gauge reading name from the reddit client, if there is one
+    """
+    def read():
+        reddit_client = getattr(reddit, 'client', None)
+        if reddit_client is None:
+            return None
+        if name == 'coalesced':
+            return reddit_client.coalesced
+        if name == 'waiting':
+            return reddit_client.scheduler.depth()
+        return dict(zip(scheduler.NAMES, reddit_client.scheduler.admitted))
+    return read
+
+
+registry.gauge('cache.objects', lambda: cache_stats(object_cache))
+registry.gauge('cache.renders', lambda: cache_stats(render_cache))
+registry.gauge('links.bytes_downloaded',
+               lambda: link_fetcher.bytes_downloaded)
+registry.gauge('prefetch.pending', lambda: prefetcher.pending())
+registry.gauge('writeback.pending', lambda: write_behind.pending())
+registry.gauge('watch.watched', lambda: len(watcher.watched()))
+registry.gauge('search.documents', lambda: len(search_index))
+watcher.on_change = watch_changed
+registry.gauge('client.coalesced', client_stats('coalesced'))
+registry.gauge('scheduler.waiting', client_stats('waiting'))
+registry.gauge('scheduler.admitted', client_stats('admitted'))
+
+
 def login_get_username(config):
     """
     returns the username of the user to login
@@ -581,8 +1527,11 @@ def login_get_password(config):
 
 
 if __name__ == '__main__':
-    # Create a reddit object from praw
-    reddit = praw.Reddit(user_agent='redditvfs')
+    # Create a reddit object from praw, safe to share between FUSE threads
+    reddit = backend.PrawBackend(client.RedditClient(
+        praw.Reddit(user_agent='redditvfs')))
+    # count and time every backend call for /.stats
+    reddit = stats.Instrumented(reddit, registry, 'backend')
 
     # Login only if a configuration file is present
     if '-c' in sys.argv:
@@ -609,6 +1558,92 @@ if __name__ == '__main__':
     else:
         username = None
 
-    fs = redditvfs(reddit=reddit, username=username, dash_s_do='setsingle')
+    fs = redditvfs(reddit=reddit, username=username, dash_s_do='undef')
+    fs.parser.add_option('--multithreaded', dest='multithreaded',
+                         action='store_true', default=False,
+                         help='serve FUSE requests from several threads')
+    fs.parser.add_option('--prefetch-workers', dest='prefetch_workers',
+                         type='int', default=prefetch.DEFAULT_WORKERS,
+                         help='threads prefetching listed posts, 0 disables')
+    fs.parser.add_option('--listing-depth', dest='listing_depth',
+                         type='int', default=listing.DEFAULT_DEPTH,
+                         help='posts listed per directory, 0 for no limit')
+    fs.parser.add_option('--more-budget', dest='more_budget', type='int',
+                         default=more_budget,
+                         help='"load more" requests made in the background '
+                              'per thread')
+    fs.parser.add_option('--no-keep-cache', dest='keep_cache',
+                         action='store_false', default=True,
+                         help='drop the kernel page cache of content files '
+                              'on every open')
+    fs.parser.add_option('--refresh', dest='refresh', type='choice',
+                         choices=['full', 'incremental'], default='full',
+                         help='how expired threads are brought up to date: '
+                              'full refetches them, incremental adds the '
+                              'comments posted since')
+    fs.parser.add_option('--watch', dest='watch', default='',
+                         help='subreddits and threads kept fresh in the '
+                              'background, as r/<subreddit> or '
+                              'r/<subreddit>/<post>, separated by commas')
+    fs.parser.add_option('--watch-interval', dest='watch_interval',
+                         type='float', default=watch.DEFAULT_INTERVAL,
+                         help='seconds between two polls of a watched '
+                              'subreddit or thread')
+    fs.parser.add_option('--api-rate', dest='api_rate', type='float',
+                         default=scheduler.DEFAULT_RATE,
+                         help='requests per second made to reddit')
+    fs.parser.add_option('--stats-file', dest='stats_file', default=None,
+                         help='where SIGUSR1 writes statistics, instead of '
+                              'stderr')
+    fs.parser.add_option('--snapshot', dest='snapshot', default=None,
+                         help='mount a snapshot written by snapshot.py '
+                              'read-only, instead of reddit')
+    fs.parser.add_option('--dump', dest='dump', default=None,
+                         help='mount reddit dumps indexed by dump.py '
+                              'read-only, instead of reddit')
+    fs.parser.add_option('--cache-dir', dest='cache_dir', default=None,
+                         help='keep a persistent cache in this directory')
+    fs.parser.add_option('--cache-max-bytes', dest='cache_max_bytes',
+                         type='int', default=persist.DEFAULT_MAX_BYTES,
+                         help='size cap of the persistent cache')
     fs.parse(errex=1)
+    fs.multithreaded = fs.cmdline[0].multithreaded
+    prefetcher.workers = fs.cmdline[0].prefetch_workers
+    listing_depth = fs.cmdline[0].listing_depth
+    more_budget = fs.cmdline[0].more_budget
+    incremental_refresh = fs.cmdline[0].refresh == 'incremental'
+    watcher.interval = fs.cmdline[0].watch_interval
+    if not update_watches(fs.cmdline[0].watch.split(',')):
+        fs.parser.error('--watch takes r/<subreddit> or '
+                        'r/<subreddit>/<post>')
+    if fs.cmdline[0].snapshot is not None:
+        reddit = stats.Instrumented(snapshot.SnapshotBackend(
+            os.path.expanduser(fs.cmdline[0].snapshot)), registry, 'backend')
+    elif fs.cmdline[0].dump is not None:
+        reddit = stats.Instrumented(dump.DumpBackend(
+            os.path.expanduser(fs.cmdline[0].dump)), registry, 'backend')
+    else:
+        reddit.client.scheduler.rate = fs.cmdline[0].api_rate
+    keep_cache = fs.cmdline[0].keep_cache
+    stats_file = fs.cmdline[0].stats_file
+    if stats_file is not None:
+        stats_file = os.path.abspath(os.path.expanduser(stats_file))
+    signal.signal(signal.SIGUSR1, dump_stats)
+    for option in ['attr_timeout', 'entry_timeout']:
+        if option not in fs.fuse_args.optdict:
+            fs.fuse_args.add(option, str(DEFAULT_ATTR_TIMEOUT))
+    cache_dir = fs.cmdline[0].cache_dir
+    if cache_dir is not None:
+        cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        store = persist.PersistentStore(
+            os.path.join(cache_dir, 'cache.sqlite'),
+            max_bytes=fs.cmdline[0].cache_max_bytes)
+        object_cache.store = store
+        object_cache.revalidate = revalidate
+        render_cache.store = store
+        link_fetcher.store = linkcontent.BlobStore(
+            os.path.join(cache_dir, 'links'),
+            max_bytes=fs.cmdline[0].cache_max_bytes)
     fs.main()
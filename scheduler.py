@@ -0,0 +1,175 @@
+"""
+Scheduling of requests to reddit.  Every request takes a token from a bucket
+refilled at the API's rate, and when requests have to wait, the most urgent
+one goes first: what a user is waiting on in the filesystem, then background
+prefetching and refreshing, then bulk crawls.
+
+Lower priority classes also leave a few tokens in the bucket, so a crawl
+using up the whole budget still leaves room for the next interactive request
+to go out right away.
+"""
+import contextlib
+import itertools
+import threading
+import time
+
+# priority classes, most urgent first
+FOREGROUND = 0
+BACKGROUND = 1
+BULK = 2
+
+NAMES = ['foreground', 'background', 'bulk']
+
+# reddit allows 60 requests a minute
+DEFAULT_RATE = 1.0
+# requests that can go out at once after a quiet period
+DEFAULT_BURST = 10
+# tokens each class must leave in the bucket
+RESERVE = [0, 3, 6]
+
+_local = threading.local()
+
+
+def get_priority():
+    """
+    returns the priority class of requests made by the current thread
+    """
+    return getattr(_local, 'priority', FOREGROUND)
+
+
+def set_priority(priority):
+    """
+    sets the priority class of requests made by the current thread, such as
+    a prefetch worker
+    """
+    _local.priority = priority
+
+
+@contextlib.contextmanager
+def priority(priority):
+    """
+    runs the body with the current thread's requests in another class
+    """
+    previous = get_priority()
+    set_priority(priority)
+    try:
+        yield
+    finally:
+        set_priority(previous)
+
+
+class Ticket(object):
+    """
+    A request waiting for, or holding, its turn.
+    """
+    def __init__(self, priority, seq):
+        self.priority = priority
+        self.seq = seq
+
+
+class Scheduler(object):
+    """
+    A token bucket letting one request through at a time, most urgent class
+    first and in arrival order within a class.  A thread already holding its
+    turn passes straight through again, so nested calls don't deadlock.
+    """
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.admitted = [0] * len(NAMES)
+        self._updated = time.time()
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._seq = itertools.count()
+        self._owner = None
+        self._depth = 0
+
+    def ticket(self, priority=None):
+        """
+        returns a ticket for a request made by the current thread
+        """
+        if priority is None:
+            priority = get_priority()
+        return Ticket(priority, next(self._seq))
+
+    def boost(self, ticket, priority=None):
+        """
+        moves a waiting ticket up to priority, for when a more urgent caller
+        ends up waiting on the same request
+        """
+        if priority is None:
+            priority = get_priority()
+        with self._cond:
+            if priority < ticket.priority:
+                ticket.priority = priority
+                self._cond.notify_all()
+
+    def depth(self):
+        """
+        returns the number of requests waiting in each class, by name
+        """
+        with self._cond:
+            counts = dict((name, 0) for name in NAMES)
+            for ticket in self._waiting:
+                counts[NAMES[ticket.priority]] += 1
+            return counts
+
+    @contextlib.contextmanager
+    def request(self, ticket=None):
+        """
+        runs the body once ticket's turn has come and a token was taken
+        """
+        self.acquire(ticket)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def acquire(self, ticket=None):
+        me = threading.current_thread()
+        with self._cond:
+            if self._owner is me:
+                self._depth += 1
+                return
+            if ticket is None:
+                ticket = self.ticket()
+            self._waiting.append(ticket)
+            try:
+                while True:
+                    wait = self._wait_time(ticket)
+                    if wait == 0:
+                        break
+                    self._cond.wait(wait)
+            finally:
+                self._waiting.remove(ticket)
+            self.tokens -= 1
+            self.admitted[ticket.priority] += 1
+            self._owner = me
+            self._depth = 1
+
+    def release(self):
+        with self._cond:
+            self._depth -= 1
+            if self._depth == 0:
+                self._owner = None
+                self._cond.notify_all()
+
+    def _wait_time(self, ticket):
+        """
+        returns 0 if ticket may go now, otherwise how long to wait before
+        looking again (None until woken up)
+        """
+        now = time.time()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._owner is not None:
+            return None
+        first = min(self._waiting, key=lambda t: (t.priority, t.seq))
+        if first is not ticket:
+            return None
+        needed = 1 + min(RESERVE[ticket.priority], self.burst - 1)
+        if self.tokens >= needed:
+            return 0
+        return (needed - self.tokens) / self.rate
@@ -0,0 +1,220 @@
+"""
+Full-text search over the submissions and comments redditvfs has seen.
+Every thread and listing passing through the cache is added to a
+SearchIndex, an inverted index in memory, and search/<query>/ lists what
+matches as symlinks into r/, without asking reddit anything.
+
+A query is words, which must all appear, and "quoted phrases", whose words
+must appear in that order, optionally scoped with subreddit:<name> (or
+r:), author:<name> (or u:), after:<time> and before:<time>.  Times are
+dates (2014-07-31), seconds since the epoch, or ages such as 12h, 7d or 2w.
+"""
+import calendar
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# documents kept before the oldest are dropped
+MAX_DOCUMENTS = 200000
+# results listed per query
+MAX_RESULTS = 100
+# queries whose results are kept for the lookups following a listing
+MEMO_SIZE = 16
+
+TOKEN = re.compile(r'\w+', re.UNICODE)
+CLAUSE = re.compile(r'(\w+:)?("[^"]*"?|\S+)', re.UNICODE)
+AGE = re.compile(r'^(\d+)([hdw])$')
+AGE_UNITS = {'h': 3600, 'd': 24 * 3600, 'w': 7 * 24 * 3600}
+FILTERS = {'subreddit': 'subreddit', 'r': 'subreddit', 'author': 'author',
+           'u': 'author', 'after': 'after', 'before': 'before'}
+
+
+def tokenize(text):
+    """
+    returns the lowercase words of text
+    """
+    return TOKEN.findall(text.lower())
+
+
+def parse_time(value):
+    """
+    returns the epoch time of a date, epoch time or age, or None
+    """
+    match = AGE.match(value)
+    if match:
+        return time.time() - int(match.group(1)) * AGE_UNITS[match.group(2)]
+    if value.isdigit():
+        return int(value)
+    try:
+        return calendar.timegm(time.strptime(value, '%Y-%m-%d'))
+    except ValueError:
+        return None
+
+
+class Query(object):
+    """
+    A parsed query: terms and phrases (lists of terms) that must all
+    match, and the filters on the rest.
+    """
+    def __init__(self, text):
+        self.terms = []
+        self.phrases = []
+        self.subreddit = None
+        self.author = None
+        self.after = None
+        self.before = None
+        self.valid = True
+        for prefix, value in CLAUSE.findall(text):
+            field = FILTERS.get(prefix[:-1].lower())
+            if prefix and field is None:
+                # not a filter, just a word with a colon
+                value = prefix + value
+            elif field in ['after', 'before']:
+                setattr(self, field, parse_time(value))
+                self.valid = self.valid and getattr(self, field) is not None
+                continue
+            elif field is not None:
+                setattr(self, field, value.lower())
+                continue
+            words = tokenize(value)
+            if value.startswith('"') and len(words) > 1:
+                self.phrases.append(words)
+            self.terms.extend(words)
+        self.valid = self.valid and bool(self.terms or self.subreddit or
+                                         self.author)
+
+
+class SearchIndex(object):
+    """
+    Maps each word to the documents holding it and its positions there.  A
+    document is a submission (title and text) or a comment, by fullname,
+    with where it is in the mount and what queries filter on.  Documents
+    are replaced when their text changes and the oldest are dropped past
+    max_documents.
+    """
+    def __init__(self, max_documents=MAX_DOCUMENTS):
+        self.max_documents = max_documents
+        # fullname -> (path, name, subreddit, author, created, words, text
+        # hash), oldest first
+        self._documents = OrderedDict()
+        # word -> {fullname: position, or tuple of positions}
+        self._postings = {}
+        # query text -> (generation, results)
+        self._memo = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._documents)
+
+    def add(self, fullname, path, name, subreddit, author, created, text):
+        """
+        indexes the text of a submission or comment.  path is where it is
+        in the mount, from r/, and name what a result names it.
+        """
+        text_hash = hash(text)
+        with self._lock:
+            document = self._documents.get(fullname)
+            if document is not None and document[6] == text_hash and \
+                    document[0] == path:
+                return
+            if document is not None:
+                self._remove(fullname)
+            positions = {}
+            for position, word in enumerate(tokenize(text)):
+                positions.setdefault(word, []).append(position)
+            for word, found in positions.iteritems():
+                postings = self._postings.get(word)
+                if postings is None:
+                    postings = self._postings[word] = {}
+                postings[fullname] = found[0] if len(found) == 1 \
+                    else tuple(found)
+            self._documents[fullname] = (
+                path, name, (subreddit or '').lower(),
+                (author or '').lower(), created, tuple(positions),
+                text_hash)
+            while len(self._documents) > self.max_documents:
+                self._remove(next(iter(self._documents)))
+            self._generation += 1
+
+    def _remove(self, fullname):
+        document = self._documents.pop(fullname)
+        for word in document[5]:
+            postings = self._postings[word]
+            del postings[fullname]
+            if not postings:
+                del self._postings[word]
+
+    def get(self, thing_id):
+        """
+        returns (path, name) of the submission or comment thing_id, or None
+        """
+        document = self._documents.get('t1_' + thing_id) or \
+            self._documents.get('t3_' + thing_id)
+        if document is None:
+            return None
+        return document[:2]
+
+    def search(self, text, limit=MAX_RESULTS):
+        """
+        returns (path, name) of the documents matching a query, newest
+        first; None if the query is invalid
+        """
+        with self._lock:
+            memo = self._memo.pop(text, None)
+            if memo is not None and memo[0] == self._generation:
+                self._memo[text] = memo
+                return memo[1]
+            query = Query(text)
+            results = None
+            if query.valid:
+                results = self._search(query, limit)
+            self._memo[text] = (self._generation, results)
+            if len(self._memo) > MEMO_SIZE:
+                self._memo.popitem(last=False)
+            return results
+
+    def _search(self, query, limit):
+        if query.terms:
+            postings = [self._postings.get(word, {}) for word in query.terms]
+            # the rarest word gives the fewest candidates
+            postings.sort(key=len)
+            candidates = [fullname for fullname in postings[0]
+                          if all(fullname in other
+                                 for other in postings[1:])]
+        else:
+            candidates = list(self._documents)
+        matches = []
+        for fullname in candidates:
+            document = self._documents[fullname]
+            if query.subreddit is not None and \
+                    document[2] != query.subreddit:
+                continue
+            if query.author is not None and document[3] != query.author:
+                continue
+            if query.after is not None and document[4] < query.after:
+                continue
+            if query.before is not None and document[4] >= query.before:
+                continue
+            if not all(self._has_phrase(fullname, phrase)
+                       for phrase in query.phrases):
+                continue
+            matches.append(document)
+        matches.sort(key=lambda document: -document[4])
+        return [document[:2] for document in matches[:limit]]
+
+    def _has_phrase(self, fullname, words):
+        """
+        returns whether words appear one after another in a document
+        """
+        starts = None
+        for offset, word in enumerate(words):
+            found = self._postings[word][fullname]
+            if not isinstance(found, tuple):
+                found = (found,)
+            positions = set(position - offset for position in found)
+            starts = positions if starts is None else starts & positions
+            if not starts:
+                return False
+        return True
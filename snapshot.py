@@ -0,0 +1,296 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+Offline snapshots of subreddits.
+
+"./snapshot.py DIR SUBREDDIT..." crawls the listings of the given
+subreddits and writes every thread, with its whole comment forest, to DIR.
+Each thread is fetched once, by a pool of workers making bulk-priority
+requests.  "./redditvfs.py --snapshot DIR MOUNTPOINT" then mounts the
+snapshot read-only through a SnapshotBackend, without network access.
+
+A snapshot is three files: posts.jsonl, one JSON line per submission,
+comments.jsonl, one JSON line per thread holding the list of its comments
+(parents before children), and index.json, mapping each subreddit to its
+post ids in listing order and each post id to the offsets and lengths of
+its lines, plus what listings are sorted by.  Listings only read the short
+submission lines; a thread's comments are read when it is opened.
+"""
+import errno
+import json
+import optparse
+import os
+import Queue
+import sys
+import threading
+
+import praw
+
+import backend
+import client
+import forest
+import model
+import scheduler
+
+# attributes kept of submissions and comments
+SUBMISSION_FIELDS = ['id', 'title', 'selftext', 'url', 'thumbnail', 'author',
+                     'subreddit', 'created', 'edited', 'score', 'ups',
+                     'downs', 'num_comments']
+COMMENT_FIELDS = ['id', 'parent_id', 'link_id', 'body', 'author', 'created',
+                  'edited', 'score', 'ups', 'downs']
+
+# threads fetched at once while exporting
+DEFAULT_WORKERS = 4
+# posts exported per subreddit
+DEFAULT_POSTS = 100
+
+# bumped when the layout of the files changes
+FORMAT = 2
+
+INDEX = 'index.json'
+POSTS = 'posts.jsonl'
+COMMENTS = 'comments.jsonl'
+
+
+def thing_data(thing, fields):
+    """
+    returns the given attributes of a praw thing as JSON-ready values
+    """
+    data = {}
+    for field in fields:
+        value = getattr(thing, field, None)
+        if field in ['author', 'subreddit'] and value is not None:
+            value = unicode(value)
+        data[field] = value
+    return data
+
+
+def fetch_thread(reddit, post_id):
+    """
+    returns the JSON lines of a submission and of its comments, with every
+    "load more" expanded
+    """
+    post = reddit.get_submission(post_id)
+    index = forest.CommentIndex(post_id, post.comments)
+    while True:
+        pending = index.pending_more()
+        if not pending:
+            break
+        more = index.take_more(pending[0])
+        if more is not None:
+            index.merge(pending[0], more, reddit.expand_more(more))
+    comments = []
+    stack = list(reversed(post.comments))
+    while stack:
+        comment = stack.pop()
+        if not backend.is_comment(comment):
+            continue
+        comments.append(thing_data(comment, COMMENT_FIELDS))
+        stack.extend(reversed(comment.replies))
+    return (json.dumps(thing_data(post, SUBMISSION_FIELDS),
+                       separators=(',', ':')) + '\n',
+            json.dumps(comments, separators=(',', ':')) + '\n')
+
+
+def export(reddit, root, subreddits, posts=DEFAULT_POSTS, sort='hot',
+           period=None, workers=DEFAULT_WORKERS, log=None):
+    """
+    writes a snapshot of the first posts threads of each subreddit listing
+    to the directory root
+    """
+    listings = {}
+    post_ids = []
+    seen = set()
+    for subreddit in subreddits:
+        ids = []
+        after = None
+        while len(ids) < posts:
+            things = reddit.get_listing(subreddit, sort, period, after,
+                                        min(100, posts - len(ids)))
+            ids.extend(thing.id for thing in things)
+            if not things:
+                break
+            after = things[-1].fullname
+        listings[subreddit.lower()] = {'name': subreddit, 'posts': ids}
+        for post_id in ids:
+            if post_id not in seen:
+                seen.add(post_id)
+                post_ids.append(post_id)
+
+    jobs = Queue.Queue()
+    results = Queue.Queue()
+    for post_id in post_ids:
+        jobs.put(post_id)
+
+    def work():
+        scheduler.set_priority(scheduler.BULK)
+        while True:
+            try:
+                post_id = jobs.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results.put((post_id, fetch_thread(reddit, post_id)))
+            except Exception, e:
+                results.put((post_id, e))
+
+    for _ in range(workers):
+        thread = threading.Thread(target=work)
+        thread.daemon = True
+        thread.start()
+
+    if not os.path.isdir(root):
+        os.makedirs(root)
+    offsets = {}
+    with open(os.path.join(root, POSTS), 'wb') as posts_file, \
+            open(os.path.join(root, COMMENTS), 'wb') as comments_file:
+        for n in range(len(post_ids)):
+            post_id, lines = results.get()
+            if isinstance(lines, Exception):
+                if log is not None:
+                    log('%s failed: %r' % (post_id, lines))
+                continue
+            line, comments_line = lines
+            data = json.loads(line)
+            offsets[post_id] = [posts_file.tell(), len(line),
+                                data['created'], data['score'],
+                                data['author'], comments_file.tell(),
+                                len(comments_line)]
+            posts_file.write(line)
+            comments_file.write(comments_line)
+            if log is not None:
+                log('%d/%d %s' % (n + 1, len(post_ids), post_id))
+    for entry in listings.values():
+        entry['posts'] = [post_id for post_id in entry['posts']
+                          if post_id in offsets]
+    with open(os.path.join(root, INDEX), 'wb') as f:
+        json.dump({'format': FORMAT, 'subreddits': listings,
+                   'posts': offsets}, f)
+
+
+class SnapshotBackend(backend.ReadOnlyBackend):
+    """
+    Serves a snapshot written by export().  Only the index is loaded; a
+    submission is read from its line of posts.jsonl when it is asked for,
+    and its comments from comments.jsonl only by get_submission.
+    """
+    def __init__(self, root):
+        self.root = root
+        with open(os.path.join(root, INDEX), 'rb') as f:
+            index = json.load(f)
+        if index.get('format') != FORMAT:
+            raise ValueError('%s was written by another version of '
+                             'snapshot.py, take it again' % root)
+        self.subreddits = index['subreddits']
+        # post id -> [offset, length, created, score, author, comments
+        # offset, comments length]
+        self.posts = index['posts']
+        self._file = open(os.path.join(root, POSTS), 'rb')
+        self._comments_file = open(os.path.join(root, COMMENTS), 'rb')
+        self._lock = threading.Lock()
+
+    def _read(self, post_id, comments=False):
+        """
+        returns the submission post_id, or the list of its comments
+        """
+        entry = self.posts.get(post_id)
+        if entry is None:
+            raise IOError(errno.ENOENT, 'No such submission', post_id)
+        f, offset, length = self._file, entry[0], entry[1]
+        if comments:
+            f, offset, length = self._comments_file, entry[5], entry[6]
+        with self._lock:
+            f.seek(offset)
+            return json.loads(f.read(length))
+
+    def _submission(self, data):
+        return model.Submission(**dict(
+            (field, data.get(field)) for field in SUBMISSION_FIELDS))
+
+    def get_submission(self, post_id):
+        data = self._read(post_id)
+        post = self._submission(data)
+        comments = {}
+        for item in self._read(post_id, comments=True):
+            comment = model.Comment(**item)
+            comments[comment.id] = comment
+            parent = comments.get(comment.parent_id.split('_', 1)[-1])
+            if parent is not None:
+                parent.replies.append(comment)
+            else:
+                post.comments.append(comment)
+        return post
+
+    def get_by_id(self, post_ids):
+        return [self._submission(self._read(post_id))
+                for post_id in post_ids if post_id in self.posts]
+
+    def get_my_subreddits(self):
+        return [entry['name'] for entry in self.subreddits.values()]
+
+    def get_popular_subreddits(self):
+        return self.get_my_subreddits()
+
+    def get_listing(self, subreddit, sort, period, after, limit):
+        entry = self.subreddits.get(subreddit.lower())
+        if entry is None:
+            return []
+        ids = list(entry['posts'])
+        if sort == 'new':
+            ids.sort(key=lambda post_id: -self.posts[post_id][2])
+        elif sort == 'top':
+            ids.sort(key=lambda post_id: -self.posts[post_id][3])
+        return self._page(ids, after, limit)
+
+    def get_user_listing(self, username, kind, after, limit):
+        if kind == 'comments':
+            return []
+        ids = sorted((post_id for post_id, entry in self.posts.items()
+                      if entry[4] == username),
+                     key=lambda post_id: -self.posts[post_id][2])
+        return self._page(ids, after, limit)
+
+    def _page(self, ids, after, limit):
+        start = 0
+        if after is not None and after.split('_', 1)[-1] in ids:
+            start = ids.index(after.split('_', 1)[-1]) + 1
+        return self.get_by_id(ids[start:start + limit])
+
+    def get_new_comments(self, subreddit, since, limit):
+        # nothing is posted to a snapshot
+        return []
+
+    def expand_more(self, more):
+        # everything was expanded when the snapshot was taken
+        return []
+
+
+def main():
+    parser = optparse.OptionParser(
+        usage='%prog [options] DIR SUBREDDIT...',
+        description='exports subreddits to a snapshot in DIR, which '
+                    '"redditvfs.py --snapshot DIR" mounts offline')
+    parser.add_option('--posts', type='int', default=DEFAULT_POSTS,
+                      help='posts exported per subreddit')
+    parser.add_option('--sort', default='hot',
+                      help='listing the posts are taken from')
+    parser.add_option('--period', default='all',
+                      help='period of the top listing')
+    parser.add_option('--workers', type='int', default=DEFAULT_WORKERS,
+                      help='threads fetched at once')
+    options, args = parser.parse_args()
+    if len(args) < 2:
+        parser.error('a directory and at least one subreddit are needed')
+
+    reddit = backend.PrawBackend(client.RedditClient(
+        praw.Reddit(user_agent='redditvfs')))
+
+    def log(message):
+        sys.stderr.write(message + '\n')
+    export(reddit, args[0], args[1:], posts=options.posts,
+           sort=options.sort, period=options.period,
+           workers=options.workers, log=log)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
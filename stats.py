@@ -0,0 +1,166 @@
+"""
+Counters and latency histograms for a running mount, cheap enough to stay
+on all the time: recording is a couple of clock reads, a bisect and a few
+increments under a lock.  redditvfs serves a snapshot as JSON from /.stats
+and writes one out on SIGUSR1.
+"""
+import bisect
+import functools
+import threading
+import time
+import types
+
+# upper bounds of the histogram buckets, in seconds
+BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+
+class Histogram(object):
+    """
+    Counts of observed durations per bucket, with their count and sum.
+    """
+    def __init__(self):
+        # the last bucket holds everything past BUCKETS[-1]
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def percentile(self, fraction):
+        """
+        returns the upper bound of the bucket holding the given fraction of
+        observations, in seconds; None past the last bound
+        """
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def summary(self):
+        """
+        returns the histogram as a dict, with times in milliseconds
+        """
+        result = {'count': self.count, 'total_ms': self.total * 1000}
+        if self.count:
+            result['mean_ms'] = self.total * 1000 / self.count
+            for name, fraction in [('p50', 0.5), ('p90', 0.9), ('p99', 0.99)]:
+                bound = self.percentile(fraction)
+                if bound is not None:
+                    bound *= 1000
+                result[name + '_ms'] = bound
+        result['buckets_ms'] = dict(('%g' % (bound * 1000), count)
+                                    for bound, count in zip(BUCKETS,
+                                                            self.counts)
+                                    if count)
+        if self.counts[-1]:
+            result['buckets_ms']['+Inf'] = self.counts[-1]
+        return result
+
+
+class Registry(object):
+    """
+    Named counters and histograms, and gauges read when a snapshot is
+    taken.  Names are dotted, the first part grouping them in snapshots.
+    """
+    def __init__(self):
+        self.started = time.time()
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def observe(self, name, seconds):
+        """
+        counts a call to name that took seconds
+        """
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def gauge(self, name, func):
+        """
+        reports func() under name in every snapshot
+        """
+        self._gauges[name] = func
+
+    def timed(self, name):
+        """
+        decorator recording how long each call of a function takes.  For
+        generators, that is until they are exhausted or dropped.
+        """
+        def decorate(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kw):
+                start = time.time()
+                try:
+                    result = func(*args, **kw)
+                except Exception:
+                    self.count(name + '.errors')
+                    self.observe(name, time.time() - start)
+                    raise
+                if isinstance(result, types.GeneratorType):
+                    return self._timed_generator(name, start, result)
+                self.observe(name, time.time() - start)
+                return result
+            return wrapper
+        return decorate
+
+    def _timed_generator(self, name, start, generator):
+        try:
+            for item in generator:
+                yield item
+        finally:
+            self.observe(name, time.time() - start)
+
+    def snapshot(self):
+        """
+        returns everything recorded as a dict ready for json.dumps()
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = dict((name, histogram.summary())
+                              for name, histogram in self._histograms.items())
+        result = {'uptime_s': time.time() - self.started}
+        for name, value in counters.items():
+            group, _, key = name.partition('.')
+            result.setdefault(group, {}).setdefault(key, {})['count'] = value
+        for name, summary in histograms.items():
+            group, _, key = name.partition('.')
+            result.setdefault(group, {}).setdefault(key, {}).update(summary)
+        for name, func in self._gauges.items():
+            group, _, key = name.partition('.')
+            result.setdefault(group, {})[key] = func()
+        return result
+
+
+class Instrumented(object):
+    """
+    Wraps an object so that every call of its methods is counted and timed
+    under prefix.<method name>; other attributes pass through.
+    """
+    def __init__(self, target, registry, prefix):
+        self.__dict__['_target'] = target
+        self.__dict__['_registry'] = registry
+        self.__dict__['_prefix'] = prefix
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr) or name.startswith('_'):
+            return attr
+        return self._registry.timed(self._prefix + '.' + name)(attr)
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
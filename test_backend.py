@@ -0,0 +1,75 @@
+"""
+Tests of PrawBackend against a stand-in for praw's session.
+"""
+import unittest
+
+import backend
+import client
+import forest
+
+
+class PrawThing(object):
+    """
+    Looks like a praw thing: JSON fields in its __dict__, and a replies
+    property that fails if it would be fetched.
+    """
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    @property
+    def replies(self):
+        raise AssertionError('lazy fetch')
+
+
+def praw_comment(comment_id, parent, replies=()):
+    return PrawThing(id=comment_id, body=u'text', author=None,
+                     parent_id=parent, link_id=u't3_p', created=1.0,
+                     _replies=list(replies))
+
+
+class FakeSession(object):
+    """
+    Serves the thread p, whose comment c1 has a "continue this thread"
+    MoreComments, and records the requests made.
+    """
+    config = {'morechildren': '/api/morechildren'}
+
+    def __init__(self):
+        self.requests = []
+
+    def get_submission(self, submission_id=None, params=None):
+        self.requests.append(('get_submission', submission_id, params))
+        if params is None:
+            cont = PrawThing(id=u'm', parent_id=u't1_c1', children=[],
+                             count=0)
+            comments = [praw_comment(u'c1', u't3_p', [cont])]
+        else:
+            # the thread focused on c1
+            c3 = praw_comment(u'c3', u't1_c2')
+            comments = [praw_comment(u'c1', u't3_p',
+                                     [praw_comment(u'c2', u't1_c1', [c3])])]
+        return PrawThing(id=u'p', title=u'post', comments=comments)
+
+    def request_json(self, url, data=None):
+        self.requests.append(('request_json', url, data))
+        return {'data': {'things': []}}
+
+
+class ExpandMoreTest(unittest.TestCase):
+    def test_continue_this_thread(self):
+        session = FakeSession()
+        reddit = backend.PrawBackend(client.RedditClient(session))
+        post = reddit.get_submission('p')
+        index = forest.CommentIndex('p', post.comments)
+        more = index.take_more('c1')
+        self.assertEqual(more.count, 0)
+        comments = reddit.expand_more(more)
+        self.assertEqual([comment.id for comment in comments], ['c2', 'c3'])
+        index.merge('c1', more, comments)
+        self.assertEqual(index.resolve(['c1', 'c2', 'c3']).id, 'c3')
+        self.assertEqual(session.requests[-1],
+                         ('get_submission', 'p', {'comment': 'c1'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
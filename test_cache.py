@@ -0,0 +1,68 @@
+"""
+Tests of the object cache over a persistent store.
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import cache
+import persist
+
+
+class ObjectCacheTest(unittest.TestCase):
+    def test_bookkeeping_not_counted(self):
+        objects = cache.ObjectCache()
+        objects.put('submission', 'a', 'post')
+        objects.get('submission', 'a')
+        objects.get('missing', '/r/sub/.git')
+        objects.put('opened', '/r/sub/a/flat', 1)
+        objects.get('opened', '/r/sub/a/flat')
+        self.assertEqual((objects.hits, objects.misses), (1, 0))
+
+
+class Counted(object):
+    """
+    A value counting how many times it was pickled.
+    """
+    pickled = 0
+
+    def __getstate__(self):
+        Counted.pickled += 1
+        return {}
+
+
+class PersistentCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'cache.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_weight_survives_remount(self):
+        store = persist.PersistentStore(self.path)
+        cache.ObjectCache(store=store).put('submission', 'a', [1] * 10,
+                                           weight=11)
+        self.assertTrue(store.flush(10))
+        warm = cache.ObjectCache(store=persist.PersistentStore(self.path))
+        self.assertEqual(warm.get('submission', 'a'), [1] * 10)
+        self.assertEqual(warm.weight, 11)
+
+    def test_writes_coalesce(self):
+        store = persist.PersistentStore(self.path)
+        value = Counted()
+        Counted.pickled = 0
+        for revision in range(5):
+            store.put('submission', 'a', value, time.time(), revision)
+        store.put('submission', 'b', value, time.time(), 0)
+        self.assertTrue(store.flush(10))
+        self.assertEqual(Counted.pickled, 2)
+        store.put('submission', 'a', value, time.time(), 4)
+        self.assertTrue(store.flush(10))
+        self.assertEqual(Counted.pickled, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+"""
+Tests of the link content fetcher against local HTTP servers, one
+answering Range requests and one sending whole bodies.
+"""
+import BaseHTTPServer
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+
+import linkcontent
+
+BODY = ''.join(chr(i % 251) for i in range(10 * 1000 + 7))
+BLOCK_SIZE = 1000
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    ranges = True
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+
+    def do_GET(self):
+        match = re.match(r'bytes=(\d+)-(\d+)$',
+                         self.headers.getheader('Range') or '')
+        if self.ranges and match:
+            start = int(match.group(1))
+            data = BODY[start:int(match.group(2)) + 1]
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (
+                start, start + len(data) - 1, len(BODY)))
+        else:
+            data = BODY
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class NoRangeHandler(Handler):
+    ranges = False
+
+
+class LinkFetcherTest(unittest.TestCase):
+    handler = Handler
+
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0),
+                                                self.handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:%d/file' % self.server.server_port
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.root)
+
+    def read_all(self, fetcher, size=700):
+        chunks = []
+        offset = 0
+        while True:
+            data = fetcher.read(self.url, size, offset)
+            if not data:
+                return ''.join(chunks)
+            chunks.append(data)
+            offset += len(data)
+
+    def test_memory(self):
+        fetcher = linkcontent.LinkFetcher(block_size=BLOCK_SIZE)
+        self.assertEqual(fetcher.size(self.url), len(BODY))
+        self.assertEqual(fetcher.read(self.url, 10, 4995), BODY[4995:5005])
+        downloaded = fetcher.bytes_downloaded
+        self.assertEqual(self.read_all(fetcher), BODY)
+        self.assertTrue(fetcher.bytes_downloaded - downloaded <= len(BODY))
+
+    def test_store(self):
+        store = linkcontent.BlobStore(self.root, max_bytes=len(BODY))
+        fetcher = linkcontent.LinkFetcher(store, block_size=BLOCK_SIZE)
+        self.assertEqual(fetcher.read(self.url, 10, 4995), BODY[4995:5005])
+        self.assertEqual(self.read_all(fetcher), BODY)
+        downloaded = fetcher.bytes_downloaded
+        self.assertTrue(downloaded <= len(BODY) + BLOCK_SIZE)
+        self.assertEqual(self.read_all(fetcher), BODY)
+        self.assertEqual(fetcher.bytes_downloaded, downloaded)
+        self.assertTrue(os.path.exists(store.blob_path(self.url)))
+
+    def test_store_cap(self):
+        store = linkcontent.BlobStore(self.root, max_bytes=len(BODY) - 1)
+        fetcher = linkcontent.LinkFetcher(store, block_size=BLOCK_SIZE)
+        self.assertEqual(self.read_all(fetcher), BODY)
+        self.assertEqual(store.blob_path(self.url), None)
+        self.assertEqual(store.size, 0)
+
+
+class NoRangeTest(LinkFetcherTest):
+    handler = NoRangeHandler
+
+    def test_memory(self):
+        LinkFetcherTest.test_memory(self)
+        fetcher = linkcontent.LinkFetcher(block_size=BLOCK_SIZE)
+        self.assertEqual(self.read_all(fetcher), BODY)
+        self.assertEqual(fetcher.bytes_downloaded, len(BODY))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+"""
+Tests of the parsing of mount paths.
+"""
+import unittest
+
+import paths
+
+
+class ParseTest(unittest.TestCase):
+    def test_more(self):
+        node = paths.parse('/r/sub/p1/c1/more_c1')
+        self.assertEqual(node.kind, paths.MORE)
+        self.assertEqual(node.comment_ids, ['c1'])
+        node = paths.parse('/r/sub/p1/c1/more_c1/reply text c2')
+        self.assertEqual(node.kind, paths.MORE_LINK)
+
+    def test_comment_starting_with_more(self):
+        node = paths.parse('/r/sub/p1/more_of this c1')
+        self.assertEqual(node.kind, paths.COMMENT)
+        self.assertEqual(node.comment_ids, ['c1'])
+        node = paths.parse('/r/sub/p1/more_of this c1/reply text c2')
+        self.assertEqual(node.kind, paths.COMMENT)
+        self.assertEqual(node.comment_ids, ['c1', 'c2'])
+        node = paths.parse('/r/sub/p1/more_of this c1/votes')
+        self.assertEqual(node.kind, paths.CONTENT)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+"""
+Tests of redditvfs run against the synthetic reddit of fakereddit.py.
+"""
+import errno
+import os
+import unittest
+
+import backend
+import fakereddit
+import redditvfs
+
+
+class SyncTest(unittest.TestCase):
+    def setUp(self):
+        self.fake = fakereddit.FakeBackend(subreddits=1, posts=3,
+                                           comments=50)
+        redditvfs.reddit = self.fake
+        redditvfs.prefetcher.workers = 0
+        redditvfs.more_budget = 0
+        redditvfs.incremental_refresh = True
+        redditvfs.object_cache.clear()
+        redditvfs.render_cache.clear()
+        self.fs = redditvfs.redditvfs(reddit=self.fake)
+        self.post_id = self.fake.post_ids('sub0')[0]
+        self.path = '/r/sub0/' + self.post_id
+
+    def tearDown(self):
+        redditvfs.incremental_refresh = False
+
+    def expire(self):
+        # as if the thread was fetched a ttl ago
+        cache = redditvfs.object_cache
+        for key, entry in cache._entries.items():
+            if key[0] in ['submission', 'index']:
+                fetched = entry[1] - cache.ttls[key[0]] - 1
+                cache._entries[key] = (entry[0], fetched) + entry[2:]
+
+    def test_getattr_then_read_syncs(self):
+        flat = self.path + '/flat'
+        size = len(self.fs.read(flat, 10 ** 7, 0))
+        self.fake.post_comments(self.post_id, 3)
+        self.expire()
+        calls = dict(self.fake.calls)
+        self.fs.getattr(flat)
+        data = self.fs.read(flat, 10 ** 7, 0)
+        self.assertEqual(self.fake.calls['get_submission'],
+                         calls['get_submission'])
+        self.assertEqual(self.fake.calls['get_new_comments'],
+                         calls.get('get_new_comments', 0) + 1)
+        self.assertTrue(len(data) > size)
+
+
+class MtimeTest(unittest.TestCase):
+    def setUp(self):
+        self.fake = fakereddit.FakeBackend(subreddits=1, posts=3,
+                                           comments=20)
+        redditvfs.reddit = self.fake
+        redditvfs.prefetcher.workers = 0
+        redditvfs.more_budget = 0
+        redditvfs.object_cache.clear()
+        redditvfs.render_cache.clear()
+        self.fs = redditvfs.redditvfs(reddit=self.fake)
+
+    def mtime(self, path):
+        return self.fs.getattr(path).st_mtime
+
+    def test_stable_from_first_stat(self):
+        post_id = self.fake.post_ids('sub0')[-1]
+        post = '/r/sub0/' + [entry.name for entry in
+                             self.fs.readdir('/r/sub0', 0)
+                             if entry.name.endswith(' ' + post_id)][0]
+        first = self.mtime(post)
+        self.assertEqual(self.fake.calls['get_submission'], 0)
+        comment = '%s/%s' % (post, [
+            entry.name for entry in self.fs.readdir(post, 0)][-1])
+        self.assertEqual(self.mtime(post), first)
+        first = self.mtime(comment)
+        redditvfs.object_cache.clear()
+        self.assertEqual(self.mtime(comment), first)
+        self.assertEqual(self.mtime(post + '/flat'),
+                         self.mtime(post + '/votes'))
+
+
+class SubscribeTest(unittest.TestCase):
+    def setUp(self):
+        self.fake = fakereddit.FakeBackend(subreddits=1, posts=1,
+                                           comments=0, logged_in=False)
+        redditvfs.reddit = self.fake
+        self.fs = redditvfs.redditvfs(reddit=self.fake)
+
+    def test_logged_out(self):
+        self.assertEqual(self.fs.mkdir('/r/sub0.sub', 0755), -errno.EACCES)
+        self.assertEqual(self.fs.rmdir('/r/sub0.sub'), -errno.EACCES)
+        self.assertEqual(self.fake.calls['subscribe'], 0)
+        self.assertEqual(self.fake.calls['unsubscribe'], 0)
+
+    def test_read_only(self):
+        redditvfs.reddit = backend.ReadOnlyBackend()
+        self.assertEqual(self.fs.mkdir('/r/sub0.sub', 0755), -errno.EROFS)
+        self.assertEqual(self.fs.rmdir('/r/sub0.sub'), -errno.EROFS)
+
+
+class StatsTest(unittest.TestCase):
+    def test_write_open(self):
+        redditvfs.reddit = fakereddit.FakeBackend()
+        fs = redditvfs.redditvfs(reddit=redditvfs.reddit)
+        self.assertEqual(fs.open('/.stats', os.O_WRONLY), -errno.EACCES)
+        self.assertEqual(fs.open('/.stats', os.O_RDWR), -errno.EACCES)
+        self.assertNotEqual(fs.open('/.stats', os.O_RDONLY), -errno.EACCES)
+
+
+class OpenFlatTest(unittest.TestCase):
+    def setUp(self):
+        self.fake = fakereddit.FakeBackend(subreddits=1, posts=1,
+                                           comments=50)
+        redditvfs.reddit = self.fake
+        redditvfs.prefetcher.workers = 0
+        redditvfs.more_budget = 0
+        redditvfs.object_cache.clear()
+        redditvfs.render_cache.clear()
+        self.fs = redditvfs.redditvfs(reddit=self.fake)
+        self.path = '/r/sub0/' + self.fake.post_ids('sub0')[0]
+
+    def read(self, path, fh=None):
+        return self.fs.read(path, 10 ** 7, 0, fh)
+
+    def check_unchanged(self, write_path, data):
+        flat = self.path + '/flat'
+        fh = self.fs.open(flat, os.O_RDONLY)
+        before = self.read(flat)
+        self.assertEqual(self.fs.write(write_path, data, 0), len(data))
+        self.assertEqual(self.read(flat, fh), before)
+        self.assertNotEqual(self.read(flat), before)
+
+    def test_vote_while_open(self):
+        comment = [name for name in self.fs.readdir(self.path, 0)
+                   if name.name.endswith('c0')][0].name
+        self.check_unchanged('%s/%s/votes' % (self.path, comment), '1')
+        self.check_unchanged(self.path + '/votes', '-1')
+
+    def test_edit_while_open(self):
+        self.check_unchanged(self.path + '/raw_content', 'edited text')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+"""
+Tests of snapshots taken of the synthetic reddit of fakereddit.py.
+"""
+import shutil
+import tempfile
+import unittest
+
+import fakereddit
+import snapshot
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.fake = fakereddit.FakeBackend(subreddits=1, posts=5,
+                                           comments=30)
+        snapshot.export(self.fake, self.root, ['sub0'], posts=5, workers=2)
+        self.backend = snapshot.SnapshotBackend(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_thread(self):
+        post_id = self.fake.post_ids('sub0')[0]
+        post = self.backend.get_submission(post_id)
+        self.assertEqual(post.title, self.fake.get_submission(post_id).title)
+        count = 0
+        stack = list(post.comments)
+        while stack:
+            comment = stack.pop()
+            count += 1
+            stack.extend(comment.replies)
+        self.assertEqual(count, 30)
+
+    def test_listing_reads_no_comments(self):
+        self.backend._comments_file.close()
+        listed = self.backend.get_listing('sub0', 'new', None, None, 10)
+        self.assertEqual(sorted(post.id for post in listed),
+                         sorted(self.fake.post_ids('sub0')))
+
+
+if __name__ == '__main__':
+    unittest.main()
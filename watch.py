@@ -0,0 +1,134 @@
+"""
+Watching subreddits and threads for changes.  A Watcher polls each watched
+object from one background thread, once per interval however many readers
+follow it, and compares the result with the previous poll.  Only when they
+differ is the object's change time moved and on_change called.
+
+redditvfs polls by refreshing its cache, so readers polling the mount are
+served from memory, and reports the change time as the mtime of what
+changed.  FUSE can also push invalidations to the kernel, for inotify and
+the page cache to notice changes by themselves, but fuse-python has no
+binding for those calls; watched files are opened with direct_io instead.
+"""
+import threading
+import time
+
+import scheduler
+
+# seconds between two polls of a watched object, below the cache's TTLs so
+# that readers never find a watched object expired
+DEFAULT_INTERVAL = 30
+
+
+class Watcher(object):
+    """
+    Watched objects by key, each with the function polling it.  A poll
+    returns a comparable summary of the object, such as the ids listed.
+    Polling starts with start(), which must come after FUSE daemonized.
+    """
+    def __init__(self, interval=DEFAULT_INTERVAL, on_change=None,
+                 registry=None):
+        self.interval = interval
+        self.on_change = on_change
+        self.registry = registry
+        # key -> poll function
+        self._polls = {}
+        # key -> (last summary, when it last changed or None)
+        self._states = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def watch(self, key, poll):
+        """
+        starts polling key with poll(), unless it is already watched
+        """
+        with self._lock:
+            if key in self._polls:
+                return
+            self._polls[key] = poll
+        self._wakeup.set()
+
+    def start(self):
+        """
+        starts the polling thread
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def unwatch(self, key):
+        with self._lock:
+            self._polls.pop(key, None)
+            self._states.pop(key, None)
+
+    def watched(self):
+        """
+        returns the watched keys
+        """
+        with self._lock:
+            return sorted(self._polls)
+
+    def is_watched(self, key):
+        return key in self._polls
+
+    def changed(self, key):
+        """
+        returns when the object key was last seen changing, or None if it
+        isn't watched or wasn't seen changing yet
+        """
+        state = self._states.get(key)
+        if state is None:
+            return None
+        return state[1]
+
+    def poll(self, key):
+        """
+        polls key now; returns whether it changed since the last poll
+        """
+        poll = self._polls.get(key)
+        if poll is None:
+            return False
+        summary = poll()
+        self._count('polls')
+        with self._lock:
+            if key not in self._polls:
+                return False
+            previous = self._states.get(key)
+            if previous is None:
+                # the first poll has nothing to compare with
+                self._states[key] = (summary, None)
+                return False
+            if previous[0] == summary:
+                return False
+            self._states[key] = (summary, time.time())
+        self._count('changes')
+        if self.on_change is not None:
+            self.on_change(key, previous[0], summary)
+        return True
+
+    def _count(self, name):
+        if self.registry is not None:
+            self.registry.count('watch.' + name)
+
+    def _run(self):
+        # users waiting on the filesystem go first
+        scheduler.set_priority(scheduler.BACKGROUND)
+        next_round = 0
+        while True:
+            self._wakeup.clear()
+            keys = self.watched()
+            if time.time() >= next_round:
+                next_round = time.time() + self.interval
+            else:
+                # woken up by watch(), only the new keys are due
+                keys = [key for key in keys if key not in self._states]
+            for key in keys:
+                try:
+                    self.poll(key)
+                except Exception:
+                    # tried again on the next round
+                    self._count('errors')
+            self._wakeup.wait(max(0, next_round - time.time()))
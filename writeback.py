@@ -0,0 +1,159 @@
+"""
+Write-behind of the changes made through the filesystem.  Votes, replies,
+edits and new posts are applied to the local cache right away and sent to
+reddit from a background thread, so a write doesn't wait on the API and a
+script voting on a thousand posts doesn't block on a thousand requests.
+
+Operations on the same thing coalesce while they are queued: voting twice
+sends only the last vote, editing twice only the last text.  Failures are
+retried with exponential backoff before being given up.
+"""
+import threading
+import time
+
+# attempts made at an operation before it is given up
+MAX_ATTEMPTS = 5
+# seconds before the first retry, doubled for every one after it
+RETRY_DELAY = 2.0
+MAX_RETRY_DELAY = 60.0
+
+
+class Operation(object):
+    """
+    A change waiting to be sent by calling func(*args).  A later operation
+    with the same key replaces it while it is queued; done(error) is called
+    once it was sent, with error None, or given up.
+    """
+    def __init__(self, key, func, args, done):
+        self.key = key
+        self.func = func
+        self.args = args
+        self.done = done
+        self.attempts = 0
+        self.due = 0.0
+
+
+class WriteBehind(object):
+    """
+    A queue of operations sent in order by one daemon thread, so that a
+    reply goes out before an edit of what it replied to.  The thread is
+    started on first use, after FUSE has daemonized.
+    """
+    def __init__(self, registry=None):
+        self.registry = registry
+        self._queue = []
+        # key -> queued Operation
+        self._pending = {}
+        self._busy = False
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def submit(self, key, func, args=(), done=None):
+        """
+        queues func(*args), replacing the queued operation with the same
+        key unless key is None
+        """
+        with self._cond:
+            queued = self._pending.get(key) if key is not None else None
+            if queued is not None:
+                queued.func = func
+                queued.args = args
+                queued.done = done
+                self._count('coalesced')
+                return
+            operation = Operation(key, func, args, done)
+            self._queue.append(operation)
+            if key is not None:
+                self._pending[key] = operation
+            self._count('queued')
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify_all()
+
+    def pending(self):
+        """
+        returns the number of operations queued or being sent
+        """
+        with self._cond:
+            return len(self._queue) + self._busy
+
+    def drain(self, timeout=None):
+        """
+        waits until everything queued was sent or given up, at most timeout
+        seconds; returns whether it was
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._queue or self._busy:
+                if deadline is None:
+                    self._cond.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def _count(self, name):
+        if self.registry is not None:
+            self.registry.count('writeback.' + name)
+
+    def _take(self):
+        """
+        removes and returns the first operation that is due, waiting for
+        one; called with the condition held
+        """
+        while True:
+            now = time.time()
+            wait = None
+            for operation in self._queue:
+                if operation.due <= now:
+                    self._queue.remove(operation)
+                    if self._pending.get(operation.key) is operation:
+                        del self._pending[operation.key]
+                    return operation
+                if wait is None or operation.due - now < wait:
+                    wait = operation.due - now
+            self._cond.wait(wait)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                operation = self._take()
+                self._busy = True
+            error = None
+            try:
+                operation.func(*operation.args)
+            except Exception, e:
+                error = e
+            with self._cond:
+                self._busy = False
+                retry = (error is not None and
+                         operation.attempts + 1 < MAX_ATTEMPTS and
+                         operation.key not in self._pending)
+                if retry:
+                    operation.attempts += 1
+                    operation.due = time.time() + min(
+                        MAX_RETRY_DELAY,
+                        RETRY_DELAY * 2 ** (operation.attempts - 1))
+                    self._queue.append(operation)
+                    if operation.key is not None:
+                        self._pending[operation.key] = operation
+                    self._count('retried')
+                self._cond.notify_all()
+            if retry:
+                continue
+            if error is None:
+                self._count('sent')
+            elif operation.key not in self._pending:
+                self._count('failed')
+            else:
+                # superseded by an operation queued while it was sent
+                continue
+            if operation.done is not None:
+                try:
+                    operation.done(error)
+                except Exception:
+                    pass